@@ -0,0 +1,114 @@
+"""Нагрузочный тест API при большом числе соединений (только stdlib).
+
+Сравнение WSGI и ASGI развёртываний:
+
+    gunicorn st_remy.wsgi:application -w 4 -b 127.0.0.1:8001
+    gunicorn st_remy.asgi:application -w 4 -k uvicorn.workers.UvicornWorker -b 127.0.0.1:8002
+
+    python benchmarks/http_load.py http://127.0.0.1:8001/api/v1/history/ -c 500 -n 20000
+    python benchmarks/http_load.py http://127.0.0.1:8002/api/v1/history/ -c 500 -n 20000
+
+Для голосования: -m POST -d '{"history": 1}' -H 'Authorization: Token ...'
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlparse
+
+
+async def worker(url, args, queue, latencies, errors):
+  reader = writer = None
+  path = url.path + ('?' + url.query if url.query else '')
+  body = args.data.encode() if args.data else b''
+  headers = [
+    '%s %s HTTP/1.1' % (args.method, path or '/'),
+    'Host: %s' % url.netloc,
+    'Connection: keep-alive',
+    'Accept: application/json',
+  ] + args.header
+  if body:
+    headers += ['Content-Type: application/json', 'Content-Length: %d' % len(body)]
+  request = ('\r\n'.join(headers) + '\r\n\r\n').encode() + body
+
+  while True:
+    try:
+      queue.get_nowait()
+    except asyncio.QueueEmpty:
+      break
+
+    started = time.perf_counter()
+    try:
+      if writer is None:
+        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+      writer.write(request)
+      await writer.drain()
+
+      status_line = await reader.readline()
+      length = 0
+      keep_alive = True
+      while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+          break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+          length = int(value)
+        if name.lower() == 'connection' and value.strip().lower() == 'close':
+          keep_alive = False
+      await reader.readexactly(length)
+
+      if not keep_alive:
+        writer.close()
+        reader = writer = None
+
+      if not status_line.split()[1].startswith(b'2'):
+        errors.append(status_line)
+      latencies.append(time.perf_counter() - started)
+    except (OSError, asyncio.IncompleteReadError, IndexError) as e:
+      errors.append(e)
+      if writer is not None:
+        writer.close()
+      reader = writer = None
+
+  if writer is not None:
+    writer.close()
+
+
+async def run(args):
+  url = urlparse(args.url)
+  queue = asyncio.Queue()
+  for _ in range(args.requests):
+    queue.put_nowait(None)
+
+  latencies, errors = [], []
+  started = time.perf_counter()
+  await asyncio.gather(*[worker(url, args, queue, latencies, errors) for _ in range(args.concurrency)])
+  elapsed = time.perf_counter() - started
+
+  latencies.sort()
+  def percentile(p):
+    return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else 0
+
+  print('requests:    %d (errors: %d)' % (len(latencies), len(errors)))
+  print('concurrency: %d' % args.concurrency)
+  print('rps:         %.1f' % (len(latencies) / elapsed))
+  print('latency ms:  mean %.1f  p50 %.1f  p95 %.1f  p99 %.1f' % (
+    statistics.mean(latencies) * 1000 if latencies else 0,
+    percentile(0.5), percentile(0.95), percentile(0.99),
+  ))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('url')
+  parser.add_argument('-c', '--concurrency', type=int, default=100)
+  parser.add_argument('-n', '--requests', type=int, default=10000)
+  parser.add_argument('-m', '--method', default='GET')
+  parser.add_argument('-d', '--data', default='')
+  parser.add_argument('-H', '--header', action='append', default=[])
+  asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+  main()
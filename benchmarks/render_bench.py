@@ -0,0 +1,87 @@
+"""Время кодирования и размер ответа для страницы из 100 историй.
+
+    DJANGO_SETTINGS_MODULE=st_remy.settings python benchmarks/render_bench.py -n 200
+
+Сравниваются стандартный JSONRenderer, ORJSONRenderer и MessagePack,
+размер - без сжатия и после gzip (как отдаёт CompressionMiddleware).
+"""
+import argparse
+import base64
+import gzip
+import os
+import random
+import sys
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'st_remy.settings')
+
+import django
+django.setup()
+
+from rest_framework.renderers import JSONRenderer
+
+from histories.renderers import ORJSONRenderer, MessagePackRenderer
+
+
+WORDS = (
+  'дом улица двор город семья переезд ремонт сад окно крыша лестница площадь '
+  'дерево мост парк школа дача кухня балкон фасад забор река берег дорога'
+).split()
+
+def image(rnd, index, kind):
+  digest = '%064x' % rnd.getrandbits(256)
+  return OrderedDict([
+    ('image', 'https://st-remy.example/media/images/%s/%s/%s.jpg' % (digest[:2], digest[2:4], digest)),
+    ('date', 1950 + index % 70),
+    ('width', 1280),
+    ('height', 960 if kind == 'before' else 854),
+    # превью - сжатый JPEG, почти несжимаемые данные
+    ('placeholder', 'data:image/jpeg;base64,' + base64.b64encode(bytes(rnd.getrandbits(8) for _ in range(450))).decode()),
+  ])
+
+def page(size):
+  rnd = random.Random(42)
+  results = [
+    OrderedDict([
+      ('id', index),
+      ('desc', ' '.join(rnd.choice(WORDS) for _ in range(60))),
+      ('orientation', 'horizontal'),
+      ('week', '2020-10-04'),
+      ('user', 'Иван Иванов'),
+      ('img_before', image(rnd, index, 'before')),
+      ('img_after', image(rnd, index, 'after')),
+      ('voices', index * 3),
+      ('voted', None),
+    ])
+    for index in range(1, size + 1)
+  ]
+  return OrderedDict([('count', 1000), ('next', None), ('previous', None), ('results', results)])
+
+def measure(renderer, data, rounds):
+  start = time.perf_counter()
+  for _ in range(rounds):
+    content = renderer.render(data, renderer.media_type, {})
+  elapsed = (time.perf_counter() - start) / rounds
+  return elapsed, content
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-n', '--rounds', type=int, default=200)
+  parser.add_argument('-s', '--size', type=int, default=100, help='Историй на странице')
+  args = parser.parse_args()
+
+  data = page(args.size)
+  print('%-22s %10s %10s %10s' % ('renderer', 'ms/page', 'bytes', 'gzip'))
+  for name, renderer in (
+    ('JSONRenderer', JSONRenderer()),
+    ('ORJSONRenderer', ORJSONRenderer()),
+    ('MessagePackRenderer', MessagePackRenderer()),
+  ):
+    elapsed, content = measure(renderer, data, args.rounds)
+    print('%-22s %10.3f %10d %10d' % (name, elapsed * 1000, len(content), len(gzip.compress(content, 6))))
+
+
+if __name__ == '__main__':
+  main()
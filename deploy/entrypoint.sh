@@ -0,0 +1,18 @@
+#!/bin/sh
+# Запуск в продакшене: миграции (ST_REMY_MIGRATE=1), сборка схемы API, gunicorn
+set -e
+
+cd "$(dirname "$0")/.."
+
+if [ "${ST_REMY_MIGRATE:-0}" = "1" ]; then
+  python manage.py migrate --noinput
+fi
+
+python manage.py build_schema
+
+case "${GUNICORN_WORKER_CLASS:-sync}" in
+  uvicorn*) APP=st_remy.asgi:application ;;
+  *) APP=st_remy.wsgi:application ;;
+esac
+
+exec gunicorn -c deploy/gunicorn.conf.py "$APP" "$@"
@@ -0,0 +1,59 @@
+"""Конфигурация gunicorn для продакшена.
+
+    gunicorn -c deploy/gunicorn.conf.py st_remy.wsgi:application
+
+Приложение загружается и прогревается в мастере до форка (preload_app),
+количество и класс воркеров задаются переменными окружения.
+"""
+import multiprocessing
+import os
+
+def env_int(name, default):
+  return int(os.environ.get(name, default))
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+workers = env_int('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)
+# sync, gthread или uvicorn.workers.UvicornWorker (вместе с st_remy.asgi:application)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+threads = env_int('GUNICORN_THREADS', 1)
+
+preload_app = True
+
+timeout = env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+
+# перезапуск воркеров против утечек памяти, со сдвигом, чтобы не все сразу
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 5000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 500)
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+
+def on_starting(server):
+  # при preload_app приложение уже импортировано, прогрев достаётся воркерам через fork
+  if os.environ.get('ST_REMY_WARMUP', '1') != '1':
+    return
+
+  from st_remy.warmup import warmup
+  server.log.info('Warmup: %s', warmup())
+
+def post_fork(server, worker):
+  from django.core.cache import caches
+  from django.db import connections
+
+  # сокеты мастера нельзя делить между процессами
+  connections.close_all()
+  for cache in caches.all():
+    cache.close()
+
+def post_worker_init(worker):
+  from django.db import connections
+
+  # постоянное соединение открывается до первого запроса (CONN_MAX_AGE)
+  for conn in connections.all():
+    try:
+      conn.ensure_connection()
+    except Exception:
+      worker.log.exception('Database connection failed for %s', conn.alias)
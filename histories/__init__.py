@@ -1,2 +1,4 @@
 __author__ = 'Umbokc'
-__version__ = '1.0.0'
\ No newline at end of file
+__version__ = '1.0.0'
+
+default_app_config = 'histories.apps.HistoriesConfig'
\ No newline at end of file
@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.utils.safestring import mark_safe
 from django.template.defaultfilters import truncatechars
 
-from .models import History, Image, Leaderboard, Voice, Profile
+from .models import History, Image, Leaderboard, Voice, Profile, ArchivedVoice, ArchivedHistory, Week
+from .exports import export_action
 
 @admin.register(Image)
 class ImageAdmin(admin.ModelAdmin):
@@ -41,6 +42,7 @@ class HistoryAdmin(admin.ModelAdmin):
   list_editable = ("status",)
   exclude = ('img_before','img_after', 'admin_viewed')
   list_per_page = 10
+  actions = [export_action('histories', 'csv'), export_action('histories', 'ndjson')]
 
   def get_desc(self, obj):
     return truncatechars(obj.desc, 35)
@@ -66,7 +68,7 @@ class HistoryAdmin(admin.ModelAdmin):
     return 'Отсутствуют'
 
   def get_voices(self, obj):
-    return obj.voices.count()
+    return obj.voices.count() + obj.archived_voices
 
   get_images.short_description = 'Изображения'
   get_user.short_description = 'Пользователь'
@@ -100,6 +102,7 @@ class VoiceAdmin(admin.ModelAdmin):
   """Голоса"""
   save_on_top = True
   save_as = True
+  actions = [export_action('voices', 'csv'), export_action('voices', 'ndjson')]
 
 @admin.register(Leaderboard)
 class LeaderboardAdmin(admin.ModelAdmin):
@@ -107,6 +110,18 @@ class LeaderboardAdmin(admin.ModelAdmin):
   save_on_top = True
   save_as = True
 
+@admin.register(Week)
+class WeekAdmin(admin.ModelAdmin):
+  """Недели конкурса (создаются автоматически)"""
+  list_display = ("day", "start", "end", "deadline")
+  readonly_fields = ("day", "start", "end")
+
+  def has_add_permission(self, request):
+    return False
+
+  def has_delete_permission(self, request, obj=None):
+    return False
+
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
   """Пользователи"""
@@ -115,6 +130,7 @@ class ProfileAdmin(admin.ModelAdmin):
   list_display = ("get_user", "get_email", "first_name", "surname", "get_type", "phone", "social_name", "social_id")
   exclude = ("user",)
   readonly_fields = ("get_user",)
+  actions = [export_action('profiles', 'csv'), export_action('profiles', 'ndjson')]
 
   def get_user(self, obj):
     return f'{obj.user.username}'
@@ -133,3 +149,32 @@ class ProfileAdmin(admin.ModelAdmin):
   get_user.short_description = 'Пользователь'
   get_email.short_description = 'Почта'
   get_type.short_description = 'Роль'
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+  """Архивные таблицы: только просмотр"""
+
+  def has_add_permission(self, request):
+    return False
+
+  def has_change_permission(self, request, obj=None):
+    return False
+
+  def has_delete_permission(self, request, obj=None):
+    return False
+
+@admin.register(ArchivedVoice)
+class ArchivedVoiceAdmin(ReadOnlyAdmin):
+  """Архивные голоса"""
+  list_display = ("id", "history_id", "user_id", "week", "created_at")
+  list_filter = ("week",)
+  search_fields = ("=history_id", "=user_id")
+  # без COUNT(*) по всей архивной таблице
+  show_full_result_count = False
+
+@admin.register(ArchivedHistory)
+class ArchivedHistoryAdmin(ReadOnlyAdmin):
+  """Архивные истории"""
+  list_display = ("id", "user_id", "week", "status", "voices", "archived_at")
+  list_filter = ("week",)
+  search_fields = ("=id", "=user_id")
+  show_full_result_count = False
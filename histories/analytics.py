@@ -0,0 +1,233 @@
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import ArchivedVoice, History, Voice, HourlyVotes, WeeklyVotes, RollupWatermark
+from .service import get_last_day_week
+from . import archive
+
+ANALYTICS = {
+  # голоса моложе этого не агрегируются: транзакции ещё могут коммитить более ранние created_at
+  'LAG_SECONDS': 60,
+  'BATCH_SIZE': 5000,
+  'MAX_LIMIT': 100,
+}
+ANALYTICS.update(getattr(settings, 'ANALYTICS', {}))
+
+WATERMARK = 'votes'
+
+INTERVALS = {
+  'hour': HourlyVotes,
+  'week': WeeklyVotes,
+}
+
+def hour_bucket(value):
+  return value.replace(minute=0, second=0, microsecond=0)
+
+def week_bucket(value):
+  return get_last_day_week(timezone.localdate(value))
+
+def get_watermark():
+  mark = RollupWatermark.objects.filter(name=WATERMARK).first()
+  return mark.created_at if mark else None
+
+def lock_position():
+  """Позиция (created_at, id) последнего учтённого голоса под блокировкой.
+
+  Только внутри транзакции: пока она идёт, rollup и rebuild ждут.
+  """
+  mark = RollupWatermark.objects.select_for_update().filter(name=WATERMARK).first()
+  if mark is None or mark.created_at is None:
+    return None
+  return mark.created_at, mark.last_id
+
+def rollup(batch_size=None, now=None):
+  """Добавляет в агрегаты голоса после сохранённой позиции"""
+  batch_size = batch_size or ANALYTICS['BATCH_SIZE']
+  cutoff = (now or timezone.now()) - datetime.timedelta(seconds=ANALYTICS['LAG_SECONDS'])
+  processed = 0
+
+  while True:
+    with transaction.atomic():
+      mark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+
+      voices = Voice.objects.filter(created_at__lte=cutoff)
+      if mark.created_at:
+        voices = voices.filter(
+          Q(created_at__gt=mark.created_at) | Q(created_at=mark.created_at, id__gt=mark.last_id)
+        )
+      rows = list(
+        voices.order_by('created_at', 'id')
+        .values_list('id', 'created_at', 'history_id', 'user__profile__city')[:batch_size]
+      )
+      if not rows:
+        break
+
+      apply(rows)
+      mark.last_id, mark.created_at = rows[-1][0], rows[-1][1]
+      mark.save()
+
+    processed += len(rows)
+
+  return processed
+
+def rebuild(batch_size=None):
+  """Полный пересчёт агрегатов: архивные голоса, затем таблица голосов с начала.
+
+  Архив учитывается в одной транзакции со сбросом позиции: move_voices
+  ждёт блокировку и не переносит голоса, пока архив читается.
+  """
+  batch_size = batch_size or ANALYTICS['BATCH_SIZE']
+  # голоса перенесённых в архив историй уже не к чему привязать
+  archived = ArchivedVoice.objects.filter(history_id__in=History.objects.values('pk'))
+  processed = 0
+
+  with transaction.atomic():
+    mark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+    HourlyVotes.objects.all().delete()
+    WeeklyVotes.objects.all().delete()
+    mark.created_at = None
+    mark.last_id = 0
+    mark.save()
+
+    last_id = 0
+    while True:
+      rows = list(
+        archived.filter(pk__gt=last_id).order_by('pk')
+        .values_list('id', 'created_at', 'history_id', 'city')[:batch_size]
+      )
+      if not rows:
+        break
+      apply(rows)
+      last_id = rows[-1][0]
+      processed += len(rows)
+
+  return processed + rollup(batch_size)
+
+def apply(rows):
+  hourly = Counter()
+  weekly = Counter()
+  for _, created_at, history_id, city in rows:
+    city = (city or '').strip()
+    hourly[(history_id, hour_bucket(created_at), city)] += 1
+    weekly[(history_id, week_bucket(created_at), city)] += 1
+
+  increment(HourlyVotes, hourly)
+  increment(WeeklyVotes, weekly)
+
+def increment(model, counter):
+  # агрегаты пишет только rollup под блокировкой позиции, поэтому чтение-запись безопасно
+  history_ids = {key[0] for key in counter}
+  buckets = {key[1] for key in counter}
+  existing = {
+    (row.history_id, row.bucket, row.city): row
+    for row in model.objects.filter(history_id__in=history_ids, bucket__in=buckets)
+  }
+
+  updated = []
+  created = []
+  for key, votes in counter.items():
+    row = existing.get(key)
+    if row:
+      row.votes += votes
+      updated.append(row)
+    else:
+      history_id, bucket, city = key
+      created.append(model(history_id=history_id, bucket=bucket, city=city, votes=votes))
+
+  model.objects.bulk_update(updated, ['votes'], batch_size=500)
+  model.objects.bulk_create(created, batch_size=500)
+
+def parse_interval(value):
+  value = value or 'week'
+  if value not in INTERVALS:
+    raise ValidationError({'interval': 'Допустимые значения: %s.' % ', '.join(INTERVALS)})
+  return value
+
+def parse_bucket(value, interval, name):
+  if not value:
+    return None
+
+  if interval == 'week':
+    week = archive.parse_week(value)
+    if week is None:
+      raise ValidationError({name: 'Ожидается дата в формате YYYY-MM-DD.'})
+    return get_last_day_week(week)
+
+  try:
+    moment = parse_datetime(value)
+  except ValueError:
+    moment = None
+  if moment is None:
+    raise ValidationError({name: 'Ожидается дата и время в формате ISO 8601.'})
+  if timezone.is_naive(moment):
+    moment = timezone.make_aware(moment)
+  return hour_bucket(moment)
+
+def parse_limit(value, default=10):
+  try:
+    limit = int(value) if value else default
+  except ValueError:
+    raise ValidationError({'limit': 'Введите правильное число.'})
+  return max(1, min(limit, ANALYTICS['MAX_LIMIT']))
+
+def filter_range(queryset, interval, params):
+  start = parse_bucket(params.get('from'), interval, 'from')
+  end = parse_bucket(params.get('to'), interval, 'to')
+  if start:
+    queryset = queryset.filter(bucket__gte=start)
+  if end:
+    queryset = queryset.filter(bucket__lte=end)
+  if not (start or end) and interval == 'week':
+    # по умолчанию - текущая неделя
+    queryset = queryset.filter(bucket=get_last_day_week(timezone.localdate()))
+  return queryset
+
+def series(history_id, params):
+  """Голоса истории по часам или неделям"""
+  interval = parse_interval(params.get('interval'))
+  queryset = INTERVALS[interval].objects.filter(history_id=history_id)
+  if params.get('from') or params.get('to'):
+    queryset = filter_range(queryset, interval, params)
+
+  return list(
+    queryset.values('bucket').annotate(votes=Sum('votes')).order_by('bucket')
+  )
+
+def top(params):
+  """Самые популярные истории за период"""
+  interval = parse_interval(params.get('interval'))
+  queryset = filter_range(INTERVALS[interval].objects.all(), interval, params)
+  if params.get('city'):
+    queryset = queryset.filter(city=params['city'])
+
+  rows = list(
+    queryset.values('history_id').annotate(votes=Sum('votes'))
+    .order_by('-votes', 'history_id')[:parse_limit(params.get('limit'))]
+  )
+  descs = dict(History.objects.filter(pk__in=[row['history_id'] for row in rows]).values_list('pk', 'desc'))
+  return [
+    {'history': row['history_id'], 'desc': descs.get(row['history_id']), 'votes': row['votes']}
+    for row in rows
+  ]
+
+def cities(params):
+  """Голоса по городам за период"""
+  interval = parse_interval(params.get('interval'))
+  queryset = filter_range(INTERVALS[interval].objects.all(), interval, params)
+  if params.get('history'):
+    try:
+      queryset = queryset.filter(history_id=int(params['history']))
+    except ValueError:
+      raise ValidationError({'history': 'Введите правильное число.'})
+
+  return list(
+    queryset.values('city').annotate(votes=Sum('votes'))
+    .order_by('-votes', 'city')[:parse_limit(params.get('limit'))]
+  )
@@ -6,4 +6,5 @@ class HistoriesConfig(AppConfig):
   verbose_name = "Истории"
 
   def ready(self):
+    import histories.checks
     import histories.signals
\ No newline at end of file
@@ -0,0 +1,104 @@
+import datetime
+import gzip
+import os
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import History, Leaderboard, FrozenWeek
+from .renderers import ORJSONRenderer
+from .serializers import HistoryDetailSerializer, WinnerListSerializer
+from .winners import RelativeRequest
+from . import weeks
+
+ARCHIVE = {
+  'ROOT': os.path.join(settings.MEDIA_ROOT, 'archive'),
+  'URL': settings.MEDIA_URL + 'archive/',
+}
+ARCHIVE.update(getattr(settings, 'ARCHIVE', {}))
+
+FILES = ('histories', 'winners')
+
+def parse_week(value):
+  try:
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+  except (TypeError, ValueError):
+    return None
+
+def is_closed(week):
+  return week < weeks.current().day
+
+def file_path(week, name):
+  return os.path.join(ARCHIVE['ROOT'], week.isoformat(), '%s.json' % name)
+
+def file_url(week, name):
+  return '%s%s/%s.json' % (ARCHIVE['URL'], week.isoformat(), name)
+
+def get_frozen_url(week, name):
+  """Ссылка на архив недели, если он актуален"""
+  if week is None or not is_closed(week):
+    return None
+
+  if not FrozenWeek.objects.filter(week=week, dirty=False).exists():
+    return None
+
+  return file_url(week, name)
+
+def mark_dirty(*weeks):
+  # архив бывает только у закрытых недель
+  weeks = [week for week in weeks if week and is_closed(week)]
+  if weeks:
+    FrozenWeek.objects.filter(week__in=weeks, dirty=False).update(dirty=True)
+
+def pending_weeks():
+  """Закрытые недели без актуального архива"""
+  current = weeks.current().day
+  days = set(History.objects.filter(week__lt=current).values_list('week', flat=True).distinct())
+  days |= set(Leaderboard.objects.filter(week__lt=current).values_list('week', flat=True).distinct())
+  fresh = set(FrozenWeek.objects.filter(dirty=False).values_list('week', flat=True))
+  return sorted(days - fresh)
+
+def build_request():
+  # в архиве пути изображений без хоста: файл отдаётся с любого зеркала,
+  # клиент дополняет их адресом, с которого получил архив
+  return RelativeRequest()
+
+def render_week(week, request=None):
+  # изменения во время генерации снова пометят неделю
+  existed = FrozenWeek.objects.filter(week=week).update(dirty=False)
+
+  request = request or build_request()
+  context = {'request': request}
+
+  histories = History.objects.filter(draft=False, status='pub', week=week) \
+    .select_related('user__profile', 'img_before', 'img_after') \
+    .order_by('-created_at')
+  winners = Leaderboard.objects.filter(week=week) \
+    .select_related('history__user__profile', 'history__img_before', 'history__img_after') \
+    .order_by('-main', '-week')
+
+  payloads = {
+    'histories': HistoryDetailSerializer(histories, many=True, context=context).data,
+    'winners': WinnerListSerializer(winners, many=True, context=context).data,
+  }
+
+  for name, results in payloads.items():
+    data = OrderedDict([
+      ('count', len(results)),
+      ('next', None),
+      ('previous', None),
+      ('results', results),
+    ])
+    write_file(file_path(week, name), ORJSONRenderer().render(data))
+
+  if not existed:
+    FrozenWeek.objects.get_or_create(week=week)
+
+def write_file(path, content):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+
+  for target, body in ((path, content), (path + '.gz', gzip.compress(content, 9))):
+    tmp = target + '.tmp'
+    with open(tmp, 'wb') as f:
+      f.write(body)
+    os.replace(tmp, target)
@@ -0,0 +1,157 @@
+"""Async-версии горячих эндпоинтов для запуска под ASGI.
+
+Django 3.1 не имеет асинхронного ORM и кэша. Обращения к кэшу (готовые
+ответы, закэшированный пользователь, лимиты) уходят в пул потоков и не
+блокируют event loop, а работа с БД выполняется одним переходом в
+sync_to_async на общий поток.
+"""
+import json
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework.exceptions import (
+  AuthenticationFailed, MethodNotAllowed, NotAuthenticated, ParseError, Throttled, ValidationError
+)
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .renderers import ORJSONRenderer
+from .response_cache import response_cache
+from .serializers import CreateVoiceSerializer, HistoryDetailSerializerAuth
+from . import idempotency, views
+
+JSON_MEDIA_TYPES = ('', '*/*', 'application/json')
+
+def get_authenticators():
+  return [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+
+def authenticate_sync(request):
+  for authenticator in get_authenticators():
+    principal = authenticator.authenticate(request)
+    if principal is not None:
+      return principal[0]
+  return None
+
+def authenticate_from_cache(request):
+  for authenticator in get_authenticators():
+    if hasattr(authenticator, 'authenticate_cached'):
+      principal = authenticator.authenticate_cached(request)
+      if principal is not None:
+        return principal[0]
+  return None
+
+async def authenticate(request):
+  user = await sync_to_async(authenticate_from_cache, thread_sensitive=False)(request)
+  if user is not None:
+    return user
+  return await sync_to_async(authenticate_sync, thread_sensitive=True)(request)
+
+def check_throttles(request, user, scope):
+  """Возвращает время ожидания, если запрос нужно отклонить"""
+  drf_request = Request(request)
+  drf_request.user = user
+  view = SimpleNamespace(throttle_scope=scope)
+
+  for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+    throttle = throttle_class()
+    if not throttle.allow_request(drf_request, view):
+      return throttle.wait()
+  return None
+
+def render_json(data, status=200):
+  return HttpResponse(ORJSONRenderer().render(data), status=status, content_type='application/json')
+
+def is_cacheable(request):
+  # только анонимный JSON без редиректа на архив недели
+  return (
+    request.method == 'GET'
+    and 'HTTP_AUTHORIZATION' not in request.META
+    and 'week' not in request.GET
+    and 'format' not in request.GET
+    and request.META.get('HTTP_ACCEPT', '') in JSON_MEDIA_TYPES
+  )
+
+def cached_entry(namespace, request):
+  key = response_cache.build_key(namespace, request.build_absolute_uri(request.path), request.GET, 'anon', 'application/json')
+  return response_cache.get_entry(key)
+
+def cached_list(namespace, sync_view):
+  async def view(request, *args, **kwargs):
+    if is_cacheable(request):
+      entry = await sync_to_async(cached_entry, thread_sensitive=False)(namespace, request)
+      if entry is not None:
+        content, content_type = entry
+        response = HttpResponse(content, content_type=content_type)
+        response['X-Cache'] = 'HIT'
+        return response
+
+    return await sync_to_async(sync_view, thread_sensitive=True)(request, *args, **kwargs)
+
+  view.csrf_exempt = True
+  return view
+
+history_list = cached_list('history', views.HistoryViewSet.as_view({'get': 'list', 'post': 'create'}))
+winner_list = cached_list('winner', views.WinnerViewSet.as_view({'get': 'list'}))
+
+def vote(request, user, data):
+  drf_request = Request(request)
+  drf_request.user = user
+  context = {'request': drf_request}
+
+  serializer = CreateVoiceSerializer(data=data, context=context)
+  try:
+    serializer.is_valid(raise_exception=True)
+    instance = serializer.save()
+  except ValidationError as e:
+    return e.detail, 400
+
+  context['voted'] = {instance.history_id}
+  return HistoryDetailSerializerAuth(instance.history, context=context).data, 200
+
+async def add_voice(request):
+  """Добавление голоса истории"""
+  if request.method != 'POST':
+    return render_json({'detail': MethodNotAllowed(request.method).detail}, status=405)
+
+  try:
+    user = await authenticate(request)
+  except AuthenticationFailed as e:
+    return render_json({'detail': e.detail}, status=401)
+
+  if user is None:
+    return render_json({'detail': NotAuthenticated.default_detail}, status=401)
+
+  wait = await sync_to_async(check_throttles, thread_sensitive=False)(request, user, 'voice')
+  if wait is not None:
+    response = render_json({'detail': Throttled(wait).detail}, status=429)
+    response['Retry-After'] = '%d' % wait
+    return response
+
+  if request.content_type == 'application/json':
+    try:
+      data = json.loads(request.body or b'{}')
+    except ValueError:
+      return render_json({'detail': ParseError.default_detail}, status=400)
+  else:
+    data = request.POST
+
+  try:
+    key = idempotency.get_key(request)
+  except ValidationError as e:
+    return render_json(e.detail, status=400)
+
+  if key is None:
+    payload, status = await sync_to_async(vote, thread_sensitive=True)(request, user, data)
+    return render_json(payload, status=status)
+
+  def run():
+    payload, status = vote(request, user, data)
+    return render_json(payload, status=status)
+
+  try:
+    return await idempotency.execute_async(user, 'voice', key, request.path, idempotency.get_fingerprint(data), run)
+  except (idempotency.IdempotencyConflict, idempotency.IdempotencyMismatch, ValidationError) as e:
+    return render_json({'detail': e.detail} if isinstance(e.detail, str) else e.detail, status=e.status_code)
+
+add_voice.csrf_exempt = True
@@ -0,0 +1,189 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+AUTH_CACHE = {
+  'LOCAL_SIZE': 2048,
+  'LOCAL_TTL': 30,
+  'SHARED_TTL': 300,
+  'PREFIX': 'auth',
+}
+AUTH_CACHE.update(getattr(settings, 'AUTH_CACHE', {}))
+
+class PrincipalCache:
+  """LRU+TTL кэш пользователей в памяти процесса поверх общего кэша Django.
+
+  У каждого ключа в общем кэше есть поколение: delete меняет его, и копии
+  в памяти других процессов перестают совпадать при следующем обращении.
+  """
+
+  def __init__(self, size, local_ttl, shared_ttl, prefix):
+    self.size = size
+    self.local_ttl = local_ttl
+    self.shared_ttl = shared_ttl
+    self.prefix = prefix
+    self.hits = 0
+    self.misses = 0
+    self._items = OrderedDict()
+    self._lock = threading.Lock()
+
+  def make_key(self, kind, ident):
+    return '%s:%s:%s' % (self.prefix, kind, ident)
+
+  def generation_key(self, key):
+    return key + ':gen'
+
+  def get(self, key):
+    now = time.monotonic()
+    generation_key = self.generation_key(key)
+
+    with self._lock:
+      item = self._items.get(key)
+
+    if item is not None:
+      expires, generation, value = item
+      if expires > now and cache.get(generation_key) == generation:
+        with self._lock:
+          if key in self._items:
+            self._items.move_to_end(key)
+          self.hits += 1
+        return value
+      with self._lock:
+        self._items.pop(key, None)
+
+    values = cache.get_many([key, generation_key])
+    value, generation = values.get(key), values.get(generation_key)
+    if value is None or generation is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    self._set_local(key, value, generation, now)
+    return value
+
+  def set(self, key, value):
+    generation_key = self.generation_key(key)
+    # поколение без срока: иначе его вытеснение выглядело бы как инвалидация
+    cache.add(generation_key, uuid.uuid4().hex, None)
+    generation = cache.get(generation_key)
+    cache.set(key, value, self.shared_ttl)
+    if generation is not None:
+      self._set_local(key, value, generation, time.monotonic())
+
+  def delete(self, *keys):
+    cache.delete_many(keys)
+    cache.set_many({self.generation_key(key): uuid.uuid4().hex for key in keys}, None)
+    with self._lock:
+      for key in keys:
+        self._items.pop(key, None)
+
+  def clear_local(self):
+    with self._lock:
+      self._items.clear()
+      self.hits = self.misses = 0
+
+  def stats(self):
+    total = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': self.hits / total if total else 0.0,
+      'local_size': len(self._items),
+    }
+
+  def _set_local(self, key, value, generation, now):
+    with self._lock:
+      self._items[key] = (now + self.local_ttl, generation, value)
+      self._items.move_to_end(key)
+      while len(self._items) > self.size:
+        self._items.popitem(last=False)
+
+principal_cache = PrincipalCache(
+  AUTH_CACHE['LOCAL_SIZE'],
+  AUTH_CACHE['LOCAL_TTL'],
+  AUTH_CACHE['SHARED_TTL'],
+  AUTH_CACHE['PREFIX'],
+)
+
+def token_cache_key(key):
+  # сам токен в ключ кэша не попадает
+  digest = hashlib.sha256(key.encode()).hexdigest()
+  return principal_cache.make_key('token', digest)
+
+def user_cache_key(user_id):
+  return principal_cache.make_key('user', user_id)
+
+def invalidate_token(key):
+  principal_cache.delete(token_cache_key(key))
+
+def invalidate_user(user_id, token_keys=()):
+  keys = [user_cache_key(user_id)] + [token_cache_key(key) for key in token_keys]
+  principal_cache.delete(*keys)
+
+class CachedTokenAuthentication(TokenAuthentication):
+  """Авторизация по токену с кэшированием пользователя"""
+
+  def authenticate_credentials(self, key):
+    cache_key = token_cache_key(key)
+    principal = principal_cache.get(cache_key)
+    if principal is not None:
+      return principal
+
+    principal = super().authenticate_credentials(key)
+    principal_cache.set(cache_key, principal)
+    return principal
+
+  def authenticate_cached(self, request):
+    """Только из кэша, без запросов к БД (для async-вьюх)"""
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or auth[0].lower() != self.keyword.lower().encode():
+      return None
+
+    try:
+      key = auth[1].decode()
+    except UnicodeError:
+      return None
+
+    return principal_cache.get(token_cache_key(key))
+
+class CachedJWTAuthentication(JWTAuthentication):
+  """Авторизация по JWT с кэшированием пользователя"""
+
+  def get_user(self, validated_token):
+    user_id = validated_token.get(jwt_settings.USER_ID_CLAIM)
+    if user_id is None:
+      return super().get_user(validated_token)
+
+    cache_key = user_cache_key(user_id)
+    user = principal_cache.get(cache_key)
+    if user is not None:
+      return user
+
+    user = super().get_user(validated_token)
+    principal_cache.set(cache_key, user)
+    return user
+
+  def authenticate_cached(self, request):
+    """Только из кэша, без запросов к БД (для async-вьюх)"""
+    header = self.get_header(request)
+    if header is None:
+      return None
+
+    raw_token = self.get_raw_token(header)
+    if raw_token is None:
+      return None
+
+    validated_token = self.get_validated_token(raw_token)
+    user = principal_cache.get(user_cache_key(validated_token.get(jwt_settings.USER_ID_CLAIM)))
+    if user is None:
+      return None
+
+    return user, validated_token
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+LOCAL_BACKENDS = (
+  'django.core.cache.backends.locmem.LocMemCache',
+  'django.core.cache.backends.dummy.DummyCache',
+)
+
+@register(Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+  """Лимиты, single-flight и инвалидация авторизации работают только на общем кэше"""
+  errors = []
+  for alias in ('default', 'throttle'):
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend in LOCAL_BACKENDS:
+      errors.append(Warning(
+        'Кэш %r хранится в памяти процесса и не общий для воркеров.' % alias,
+        hint='Задайте ST_REMY_MEMCACHED=host:port.',
+        id='histories.W001',
+      ))
+  return errors
@@ -0,0 +1,149 @@
+"""Перенос данных закрытых недель из горячих таблиц в архивные.
+
+Голоса уходят в ArchivedVoice, их количество копится в History.archived_voices,
+поэтому счётчики в ответах не меняются. Отклонённые истории по желанию
+переносятся в ArchivedHistory вместе с описанием изображений. Каждая пачка -
+отдельная короткая транзакция.
+"""
+import datetime
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .models import ArchivedHistory, ArchivedVoice, History, Image, Voice
+from . import analytics, weeks
+
+COLD_STORAGE = {
+  # сколько последних закрытых недель остаются в горячих таблицах
+  'KEEP_WEEKS': 2,
+  'BATCH_SIZE': 1000,
+  # пауза между пачками, секунд
+  'SLEEP': 0,
+}
+COLD_STORAGE.update(getattr(settings, 'COLD_STORAGE', {}))
+
+def cutoff_week(keep_weeks=None):
+  """Недели раньше этой переносятся в архив"""
+  keep_weeks = COLD_STORAGE['KEEP_WEEKS'] if keep_weeks is None else keep_weeks
+  return weeks.current().day - datetime.timedelta(weeks=keep_weeks)
+
+def pause():
+  if COLD_STORAGE['SLEEP']:
+    time.sleep(COLD_STORAGE['SLEEP'])
+
+def move_voices(before, batch_size=None):
+  """Переносит голоса историй недель раньше before. Возвращает число голосов"""
+  batch_size = batch_size or COLD_STORAGE['BATCH_SIZE']
+  voices = Voice.objects.filter(contest_week__day__lt=before)
+
+  moved = 0
+  while True:
+    with transaction.atomic():
+      # голоса, ещё не попавшие в агрегаты аналитики, остаются на месте;
+      # позиция сравнивается так же, как в rollup: (created_at, id)
+      position = analytics.lock_position()
+      if position is None:
+        break
+      created_at, last_id = position
+
+      rows = list(
+        voices.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lte=last_id))
+        .order_by('pk')
+        .values_list('pk', 'history_id', 'user_id', 'contest_week__day', 'created_at', 'user__profile__city')[:batch_size]
+      )
+      if not rows:
+        break
+
+      ArchivedVoice.objects.bulk_create([
+        ArchivedVoice(id=pk, history_id=history_id, user_id=user_id, week=week, created_at=created_at, city=city or '')
+        for pk, history_id, user_id, week, created_at, city in rows
+      ], ignore_conflicts=True)
+
+      counts = Counter(row[1] for row in rows)
+      for history_id, count in counts.items():
+        History.objects.filter(pk=history_id).update(archived_voices=F('archived_voices') + count)
+
+      # без сигналов: счётчики не меняются, поэтому кэши и архивы недель остаются верными
+      Voice.objects.filter(pk__in=[row[0] for row in rows])._raw_delete(Voice.objects.db)
+
+    moved += len(rows)
+    pause()
+
+  return moved
+
+def image_data(image):
+  return {
+    'image': image.image.name,
+    'date': image.date,
+    'status': image.status,
+    'comment': image.comment,
+    'width': image.width,
+    'height': image.height,
+    'size': image.size,
+    'placeholder': image.placeholder,
+    'created_at': image.created_at.isoformat(),
+  }
+
+def keep_files(refs):
+  """Добавляет ссылки архивных записей на файлы (имя -> количество).
+
+  Удаление Image освободит свою ссылку, а архивная запись должна удержать
+  файл, в том числе от gc_media.
+  """
+  storage = Image._meta.get_field('image').storage
+  for name, count in refs.items():
+    storage.acquire(name, count)
+
+def move_rejected(before, batch_size=None):
+  """Переносит отклонённые истории недель раньше before. Возвращает число историй"""
+  batch_size = batch_size or COLD_STORAGE['BATCH_SIZE']
+  # история в списке победителей удалилась бы вместе с ним
+  histories = History.objects.filter(week__lt=before, status='reject', leaderboard__isnull=True)
+
+  moved = 0
+  while True:
+    with transaction.atomic():
+      batch = list(histories.order_by('pk').annotate(hot_voices=Count('voices'))[:batch_size])
+      if not batch:
+        break
+
+      ids = [history.pk for history in batch]
+      images = list(Image.objects.filter(Q(history_id__in=ids) | Q(img_before__in=ids) | Q(img_after__in=ids)))
+      by_pk = {image.pk: image for image in images}
+
+      keep_files(Counter(image.image.name for image in images if image.image.name))
+
+      archived = []
+      for history in batch:
+        linked = {image.pk for image in images if image.history_id == history.pk}
+        linked.update(pk for pk in (history.img_before_id, history.img_after_id) if pk)
+        archived.append(ArchivedHistory(
+          id=history.pk,
+          user_id=history.user_id,
+          week=history.week,
+          status=history.status,
+          desc=history.desc,
+          desc_comment=history.desc_comment,
+          orientation=history.orientation,
+          voices=history.archived_voices + history.hot_voices,
+          images=[image_data(by_pk[pk]) for pk in sorted(linked)],
+          created_at=history.created_at,
+        ))
+
+      ArchivedHistory.objects.bulk_create(archived, ignore_conflicts=True)
+      Image.objects.filter(pk__in=list(by_pk)).delete()
+      History.objects.filter(pk__in=ids).delete()
+
+    moved += len(batch)
+    pause()
+
+  return moved
+
+def history_voices(history_id):
+  """Все голоса истории: горячие и архивные (медленный путь для чтения)"""
+  hot = Voice.objects.filter(history_id=history_id).values_list('user_id', 'created_at')
+  cold = ArchivedVoice.objects.filter(history_id=history_id).values_list('user_id', 'created_at')
+  return hot.union(cold, all=True).order_by('created_at')
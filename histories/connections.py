@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.db import connections
+
+def idle_limit():
+  return getattr(settings, 'CONN_HEALTH_CHECK_IDLE', 30)
+
+def check_connections(**kwargs):
+  """Перед запросом проверяет постоянные соединения, которые долго простаивали.
+
+  Django 3.1 не умеет CONN_HEALTH_CHECKS: соединение, закрытое базой или
+  балансировщиком за время простоя, иначе упадёт на первом запросе.
+  """
+  now = time.monotonic()
+  for conn in connections.all():
+    if conn.connection is None:
+      continue
+    last_used = getattr(conn, 'st_remy_last_used', None)
+    if last_used is not None and now - last_used > idle_limit() and not conn.is_usable():
+      conn.close()
+
+def touch_connections(**kwargs):
+  now = time.monotonic()
+  for conn in connections.all():
+    if conn.connection is not None:
+      conn.st_remy_last_used = now
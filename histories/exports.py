@@ -0,0 +1,188 @@
+import csv
+import datetime
+
+import orjson
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F, OuterRef, Subquery
+from django.http import StreamingHttpResponse
+
+from .models import ArchivedVoice, History, Image, Profile, Voice
+
+CHUNK_SIZE = 2000
+# строк CSV в одном куске ответа
+ROWS_PER_CHUNK = 200
+
+# название -> (модель, [(колонка, поле для values_list)])
+EXPORTS = {
+  'profiles': (Profile, [
+    ('id', 'id'),
+    ('username', 'user__username'),
+    ('email', 'user__email'),
+    ('first_name', 'first_name'),
+    ('surname', 'surname'),
+    ('phone', 'phone'),
+    ('birth_date', 'birth_date'),
+    ('city', 'city'),
+    ('social_name', 'social_name'),
+    ('social_id', 'social_id'),
+    ('created_at', 'created_at'),
+  ]),
+  'voices': (Voice, [
+    ('id', 'id'),
+    ('history', 'history_id'),
+    ('week', 'history__week'),
+    ('user', 'user_id'),
+    ('email', 'user__email'),
+    ('created_at', 'created_at'),
+  ]),
+  'histories': (History, [
+    ('id', 'id'),
+    ('user', 'user_id'),
+    ('email', 'user__email'),
+    ('first_name', 'user__profile__first_name'),
+    ('surname', 'user__profile__surname'),
+    ('phone', 'user__profile__phone'),
+    ('week', 'week'),
+    ('status', 'status'),
+    ('draft', 'draft'),
+    ('score', 'score'),
+    ('desc', 'desc'),
+    ('created_at', 'created_at'),
+  ]),
+}
+
+FORMATS = {
+  'csv': 'text/csv; charset=utf-8',
+  'ndjson': 'application/x-ndjson',
+}
+
+def rows(queryset, columns):
+  """Строки выгрузки без создания моделей, в постоянной памяти"""
+  # объединение (with_archived_voices) уже собрано в нужные колонки
+  if not queryset.query.combinator:
+    lookups = [lookup for _, lookup in columns]
+    queryset = queryset.order_by('pk').values_list(*lookups)
+  return queryset.iterator(chunk_size=CHUNK_SIZE)
+
+def with_archived_voices(queryset, week=None):
+  """Голоса вместе с перенесёнными в ArchivedVoice (move_to_cold_storage)"""
+  _, columns = EXPORTS['voices']
+  hot = queryset.values_list(*[lookup for _, lookup in columns])
+  email = User.objects.filter(pk=OuterRef('user_id')).values('email')[:1]
+  # аннотации идут в SELECT после полей модели, поэтому created_at - тоже аннотация
+  cold = ArchivedVoice.objects.annotate(email=Subquery(email), created=F('created_at')) \
+    .values_list('id', 'history_id', 'week', 'user_id', 'email', 'created')
+  if week:
+    cold = cold.filter(week=week)
+  # id архивного голоса - id исходного Voice, пересечений нет
+  return hot.union(cold, all=True).order_by('id')
+
+class Echo:
+  """Псевдо-файл для csv.writer: writerow возвращает строку вместо записи"""
+
+  def write(self, value):
+    return value
+
+def stream_csv(queryset, columns):
+  writer = csv.writer(Echo())
+  # BOM, чтобы Excel открыл кириллицу в UTF-8
+  yield '\ufeff' + writer.writerow([name for name, _ in columns])
+
+  chunk = []
+  for row in rows(queryset, columns):
+    chunk.append(writer.writerow(row))
+    if len(chunk) >= ROWS_PER_CHUNK:
+      yield ''.join(chunk)
+      chunk = []
+  if chunk:
+    yield ''.join(chunk)
+
+def stream_ndjson(queryset, columns):
+  names = [name for name, _ in columns]
+  for row in rows(queryset, columns):
+    yield orjson.dumps(dict(zip(names, row))) + b'\n'
+
+STREAMS = {
+  'csv': stream_csv,
+  'ndjson': stream_ndjson,
+}
+
+def export_response(name, queryset, fmt='csv'):
+  _, columns = EXPORTS[name]
+  response = StreamingHttpResponse(STREAMS[fmt](queryset, columns), content_type=FORMATS[fmt])
+  filename = '%s-%s.%s' % (name, datetime.date.today().isoformat(), fmt)
+  response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+  return response
+
+def export_action(name, fmt):
+  """Действие админки: выгрузка выбранных записей"""
+
+  def action(modeladmin, request, queryset):
+    return export_response(name, queryset, fmt)
+
+  action.short_description = 'Выгрузить в %s' % fmt.upper()
+  action.__name__ = 'export_%s' % fmt
+  return action
+
+# Поток опубликованных историй для партнёров: тот же формат, что у ленты,
+# но без сериализаторов DRF и без накопления ответа в памяти.
+
+FEED_EXPORT = {
+  # строк в одном ответе; продолжение - ?after=<id последней строки>
+  'MAX_ROWS': 10000,
+  # строк в одном запросе к БД
+  'CHUNK_SIZE': 500,
+}
+FEED_EXPORT.update(getattr(settings, 'FEED_EXPORT', {}))
+
+IMAGE_FIELDS = ('image', 'date', 'width', 'height', 'placeholder')
+FEED_COLUMNS = (
+  ('id', 'desc', 'orientation', 'week', 'user__profile__first_name', 'user__profile__surname', 'archived_voices')
+  + tuple('img_before__%s' % name for name in IMAGE_FIELDS)
+  + tuple('img_after__%s' % name for name in IMAGE_FIELDS)
+)
+BEFORE = 7
+AFTER = BEFORE + len(IMAGE_FIELDS)
+
+def feed_image(row, offset, image_url):
+  name = row[offset]
+  if not name:
+    return None
+  values = row[offset:offset + len(IMAGE_FIELDS)]
+  return dict(zip(IMAGE_FIELDS, (image_url(name),) + values[1:]))
+
+def feed_lines(queryset, request, after=0, limit=None):
+  """Строки NDJSON по возрастанию id, пачками по CHUNK_SIZE (keyset)"""
+  from .serializers import get_voice_counts
+
+  storage = Image._meta.get_field('image').storage
+
+  def image_url(name):
+    return request.build_absolute_uri(storage.url(name))
+
+  remaining = limit or FEED_EXPORT['MAX_ROWS']
+
+  while remaining > 0:
+    size = min(FEED_EXPORT['CHUNK_SIZE'], remaining)
+    rows = list(queryset.filter(pk__gt=after).order_by('pk').values_list(*FEED_COLUMNS)[:size])
+    if not rows:
+      return
+
+    counts = get_voice_counts([row[0] for row in rows])
+    for row in rows:
+      yield orjson.dumps({
+        'id': row[0],
+        'desc': row[1],
+        'orientation': row[2],
+        'week': row[3],
+        'user': '%s %s' % (row[4], row[5]),
+        'img_before': feed_image(row, BEFORE, image_url),
+        'img_after': feed_image(row, AFTER, image_url),
+        'voices': counts.get(row[0], 0) + row[6],
+      }) + b'\n'
+
+    after = rows[-1][0]
+    remaining -= len(rows)
+    if len(rows) < size:
+      return
@@ -0,0 +1,88 @@
+"""Выборочные поля ответа: ?fields=id,user,img_after.image и ?omit=desc
+
+Набор полей - пара (include, omit) вложенных словарей: имя поля -> None
+(поле целиком) или словарь для полей вложенного объекта.
+"""
+from rest_framework import serializers
+
+EMPTY = (None, None)
+
+def parse(value):
+  if not value:
+    return None
+
+  spec = {}
+  for name in value.split(','):
+    parts = [part.strip() for part in name.split('.')]
+    if all(parts):
+      add(spec, parts)
+  return spec or None
+
+def add(spec, parts):
+  head = parts[0]
+  if len(parts) == 1:
+    spec[head] = None
+    return
+
+  if head in spec and spec[head] is None:
+    return
+  add(spec.setdefault(head, {}), parts[1:])
+
+def from_request(request):
+  params = request.query_params
+  return parse(params.get('fields')), parse(params.get('omit'))
+
+def is_requested(request):
+  return 'fields' in request.query_params or 'omit' in request.query_params
+
+def wants(fieldset, name):
+  include, omit = fieldset
+  if include is not None and name not in include:
+    return False
+  return not (omit and name in omit and omit[name] is None)
+
+def nested(fieldset, name):
+  include, omit = fieldset
+  return (include.get(name) if include else None, omit.get(name) if omit else None)
+
+def prune(data, fieldset):
+  """Применяет набор полей к готовому словарю (например, payload из WinnerEntry)"""
+  if fieldset == EMPTY or not isinstance(data, dict):
+    return data
+
+  return {
+    name: prune(value, nested(fieldset, name))
+    for name, value in data.items()
+    if wants(fieldset, name)
+  }
+
+class SparseFieldsMixin:
+  """Оставляет в сериализаторе только запрошенные поля.
+
+  Набор берётся из context['fieldset'] для корневого сериализатора и
+  передаётся вложенным через атрибут fieldset.
+  """
+  fieldset = None
+
+  def get_fields(self):
+    fields = super().get_fields()
+    fieldset = self.get_fieldset()
+    if fieldset == EMPTY:
+      return fields
+
+    pruned = type(fields)()
+    for name, field in fields.items():
+      if wants(fieldset, name):
+        if isinstance(field, SparseFieldsMixin):
+          field.fieldset = nested(fieldset, name)
+        pruned[name] = field
+    return pruned
+
+  def get_fieldset(self):
+    if self.fieldset is not None:
+      return self.fieldset
+
+    parent = getattr(self, 'parent', None)
+    if parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None):
+      return self.context.get('fieldset', EMPTY)
+    return EMPTY
@@ -0,0 +1,206 @@
+"""Повтор запросов с заголовком Idempotency-Key.
+
+Первый запрос с ключом занимает строку IdempotencyKey и после выполнения
+сохраняет в неё готовый ответ. Повтор в пределах TTL получает сохранённые
+байты без повторной работы, а одновременный дубль ждёт завершения первого.
+Ключ привязан к хэшу разобранных полей и файлов: тот же ключ с другими
+данными получает 422.
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.datastructures import MultiValueDict
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY = {
+  'TTL_HOURS': 24,
+  # сколько дубль ждёт первый запрос, секунд
+  'WAIT': 10,
+  'POLL_INTERVAL': 0.1,
+  # незавершённый ключ старше этого считается брошенным (упавший воркер)
+  'LOCK_TIMEOUT': 60,
+}
+IDEMPOTENCY.update(getattr(settings, 'IDEMPOTENCY', {}))
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+class IdempotencyConflict(APIException):
+  status_code = status.HTTP_409_CONFLICT
+  default_detail = 'Запрос с этим Idempotency-Key ещё выполняется, повторите позже.'
+  default_code = 'idempotency_conflict'
+
+class IdempotencyMismatch(APIException):
+  status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+  default_detail = 'Idempotency-Key уже использован с другим телом запроса.'
+  default_code = 'idempotency_mismatch'
+
+def get_key(request):
+  key = request.META.get(HEADER, '').strip()
+  if not key:
+    return None
+  if len(key) > MAX_LENGTH or not key.isprintable():
+    raise ValidationError({'Idempotency-Key': 'Ключ - до %d печатных символов.' % MAX_LENGTH})
+  return key
+
+def is_stale(entry, now):
+  if entry.created_at < now - datetime.timedelta(hours=IDEMPOTENCY['TTL_HOURS']):
+    return True
+  lock_timeout = datetime.timedelta(seconds=IDEMPOTENCY['LOCK_TIMEOUT'])
+  return entry.status_code is None and entry.created_at < now - lock_timeout
+
+def replay(entry):
+  response = HttpResponse(bytes(entry.content), status=entry.status_code, content_type=entry.content_type)
+  response['Idempotent-Replayed'] = 'true'
+  return response
+
+def hash_file(upload):
+  # файл читается по чанкам: загрузка целиком в память не нужна
+  digest = hashlib.sha256()
+  for chunk in upload.chunks():
+    digest.update(chunk)
+  upload.seek(0)
+  return {'name': upload.name, 'size': upload.size, 'sha256': digest.hexdigest()}
+
+def canonical(value):
+  if isinstance(value, UploadedFile):
+    return hash_file(value)
+  if isinstance(value, MultiValueDict):
+    return {key: [canonical(item) for item in value.getlist(key)] for key in value}
+  if isinstance(value, dict):
+    return {str(key): canonical(item) for key, item in value.items()}
+  if isinstance(value, (list, tuple)):
+    return [canonical(item) for item in value]
+  return value
+
+def get_fingerprint(data):
+  """Хэш разобранных данных запроса.
+
+  request.body не используется: Django не отдаёт тело больше
+  DATA_UPLOAD_MAX_MEMORY_SIZE, а фото как раз такие.
+  """
+  body = json.dumps(canonical(data), sort_keys=True, default=str)
+  return hashlib.sha256(body.encode()).hexdigest()
+
+def try_claim(user, scope, key, path, fingerprint):
+  """Одна попытка занять ключ.
+
+  Возвращает (строка, None), (строка, сохранённый ответ) или (None, None),
+  если первый запрос ещё выполняется.
+  """
+  while True:
+    # сначала чтение: повтор завершённого запроса ничего не пишет
+    entry = IdempotencyKey.objects.filter(user=user, scope=scope, key=key).first()
+    if entry is None:
+      try:
+        with transaction.atomic():
+          entry = IdempotencyKey.objects.create(user=user, scope=scope, key=key, path=path, fingerprint=fingerprint)
+          return entry, None
+      except IntegrityError:
+        # ключ одновременно занял другой запрос
+        continue
+    if is_stale(entry, timezone.now()):
+      IdempotencyKey.objects.filter(pk=entry.pk, created_at=entry.created_at).delete()
+      continue
+    if entry.path != path:
+      raise ValidationError({'Idempotency-Key': 'Ключ уже использован для другого запроса.'})
+    # у ключей, созданных до появления хэша, он пустой
+    if entry.fingerprint and entry.fingerprint != fingerprint:
+      raise IdempotencyMismatch()
+    if entry.status_code is not None:
+      return entry, replay(entry)
+    return None, None
+
+def claim(user, scope, key, path, fingerprint):
+  """Занимает ключ, дожидаясь первого запроса. Возвращает (строка, None) или (строка, сохранённый ответ)"""
+  deadline = time.monotonic() + IDEMPOTENCY['WAIT']
+  while True:
+    entry, response = try_claim(user, scope, key, path, fingerprint)
+    if entry is not None:
+      return entry, response
+    if time.monotonic() >= deadline:
+      raise IdempotencyConflict()
+    time.sleep(IDEMPOTENCY['POLL_INTERVAL'])
+
+def store(entry, response):
+  # ошибки сервера не запоминаем: повтор должен выполниться заново
+  if response.status_code >= 500:
+    release(entry)
+    return
+  IdempotencyKey.objects.filter(pk=entry.pk).update(
+    status_code=response.status_code,
+    content=response.content,
+    content_type=response.get('Content-Type', ''),
+  )
+
+def release(entry):
+  IdempotencyKey.objects.filter(pk=entry.pk).delete()
+
+def run_claimed(entry, func):
+  try:
+    response = func()
+  except BaseException:
+    release(entry)
+    raise
+  store(entry, response)
+  return response
+
+def execute(user, scope, key, path, fingerprint, func):
+  """Выполняет func() (готовый HttpResponse) не больше одного раза на ключ"""
+  entry, response = claim(user, scope, key, path, fingerprint)
+  if response is not None:
+    return response
+  return run_claimed(entry, func)
+
+async def execute_async(user, scope, key, path, fingerprint, func):
+  """То же для async-вьюх: ожидание первого запроса не занимает поток с БД"""
+  deadline = time.monotonic() + IDEMPOTENCY['WAIT']
+  while True:
+    entry, response = await sync_to_async(try_claim, thread_sensitive=True)(user, scope, key, path, fingerprint)
+    if entry is not None:
+      break
+    if time.monotonic() >= deadline:
+      raise IdempotencyConflict()
+    await asyncio.sleep(IDEMPOTENCY['POLL_INTERVAL'])
+
+  if response is not None:
+    return response
+  return await sync_to_async(run_claimed, thread_sensitive=True)(entry, func)
+
+def idempotent(scope):
+  """Декоратор действия DRF: ответ рендерится сразу, чтобы сохранить байты"""
+
+  def decorator(method):
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+      key = get_key(request)
+      if key is None:
+        return method(self, request, *args, **kwargs)
+
+      def run():
+        try:
+          response = method(self, request, *args, **kwargs)
+        except Exception as exc:
+          response = self.handle_exception(exc)
+        return self.finalize_response(request, response, *args, **kwargs).render()
+
+      return execute(request.user, scope, key, request.path, get_fingerprint(request.data), run)
+    return wrapper
+  return decorator
+
+def expired(hours=None):
+  hours = IDEMPOTENCY['TTL_HOURS'] if hours is None else hours
+  return IdempotencyKey.objects.filter(created_at__lt=timezone.now() - datetime.timedelta(hours=hours))
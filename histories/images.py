@@ -0,0 +1,66 @@
+import base64
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image as PILImage, ImageOps
+
+EXIF_ORIENTATION = 0x0112
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+def make_placeholder(image):
+  """Крошечное превью (LQIP) в виде data URI"""
+  thumb = image.convert('RGB')
+  thumb.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+  buffer = BytesIO()
+  thumb.save(buffer, 'JPEG', quality=PLACEHOLDER_QUALITY)
+  return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+def normalize(fileobj, name):
+  """Поворачивает изображение по EXIF и считает метаданные.
+
+  Возвращает (content, metadata), где content - новый файл, если изображение
+  пришлось повернуть, иначе None.
+  """
+  fileobj.seek(0)
+  with PILImage.open(fileobj) as source:
+    image_format = source.format
+    rotated = source.getexif().get(EXIF_ORIENTATION, 1) != 1
+    image = ImageOps.exif_transpose(source) if rotated else source.copy()
+
+  content = None
+  size = fileobj.size if hasattr(fileobj, 'size') else None
+
+  if rotated:
+    buffer = BytesIO()
+    options = {'quality': 90} if image_format == 'JPEG' else {}
+    image.save(buffer, image_format, **options)
+    content = ContentFile(buffer.getvalue(), name=name)
+    size = content.size
+
+  metadata = {
+    'width': image.width,
+    'height': image.height,
+    'size': size,
+    'placeholder': make_placeholder(image),
+  }
+  return content, metadata
+
+def prepare_upload(upload):
+  """Файл и поля Image для загруженного изображения"""
+  try:
+    content, metadata = normalize(upload, upload.name)
+  except (OSError, ValueError, PILImage.DecompressionBombError):
+    return upload, {'size': upload.size}
+
+  upload.seek(0)
+  return content or upload, metadata
+
+def get_orientation(image):
+  if image and image.width and image.height:
+    return 'vertical' if image.height > image.width else 'horizontal'
+  return None
+
+def derive_orientation(history):
+  """Ориентация истории по фотографиям (в приоритете фото "до")"""
+  return get_orientation(history.img_before) or get_orientation(history.img_after) or history.orientation
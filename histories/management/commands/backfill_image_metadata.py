@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from PIL import Image as PILImage
+
+from histories.models import History, Image
+from histories.response_cache import response_cache
+from histories import images, archive, winners
+
+def process(pk):
+  try:
+    image = Image.objects.get(pk=pk)
+    storage = image.image.storage
+    name = image.image.name
+
+    with storage.open(name) as f:
+      content, metadata = images.normalize(f, name)
+
+    if content is not None:
+      # повёрнутое по EXIF изображение заменяет исходное
+      metadata['image'] = storage.save(name, content)
+      if hasattr(storage, 'release'):
+        storage.release(name)
+      elif metadata['image'] != name:
+        storage.delete(name)
+
+    Image.objects.filter(pk=pk).update(**metadata)
+    return image.history_id
+  except (OSError, ValueError, PILImage.DecompressionBombError):
+    # битый файл или слишком большое изображение - пропускаем
+    return None
+  finally:
+    connection.close()
+
+class Command(BaseCommand):
+  help = 'Заполняет размеры, вес и превью для уже загруженных изображений'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--all', action='store_true', help='Обработать и уже заполненные изображения')
+
+  def handle(self, *args, **options):
+    queryset = Image.objects.all() if options['all'] else Image.objects.filter(width__isnull=True)
+    queryset = queryset.order_by('pk')
+
+    processed = 0
+    last_pk = 0
+    history_ids = set()
+
+    with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+      while True:
+        pks = list(queryset.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['batch_size']])
+        if not pks:
+          break
+
+        for history_id in executor.map(process, pks):
+          if history_id:
+            history_ids.add(history_id)
+
+        processed += len(pks)
+        last_pk = pks[-1]
+        self.stdout.write('Обработано изображений: %d' % processed)
+
+    self.update_orientation(history_ids)
+    self.stdout.write(self.style.SUCCESS('Готово: %d изображений, %d историй' % (processed, len(history_ids))))
+
+  def update_orientation(self, history_ids, chunk_size=500):
+    history_ids = sorted(history_ids)
+    weeks = set()
+
+    for start in range(0, len(history_ids), chunk_size):
+      chunk = history_ids[start:start + chunk_size]
+      histories = History.objects.filter(pk__in=chunk).select_related('img_before', 'img_after')
+      changed = []
+
+      for history in histories:
+        weeks.add(history.week)
+        orientation = images.derive_orientation(history)
+        if orientation != history.orientation:
+          history.orientation = orientation
+          changed.append(history)
+
+      History.objects.bulk_update(changed, ['orientation'])
+
+    # update()/bulk_update() не отправляют сигналы
+    archive.mark_dirty(*weeks)
+    winners.schedule_for_histories(history_ids)
+    for model_name in ('Image', 'History'):
+      response_cache.invalidate_model(model_name)
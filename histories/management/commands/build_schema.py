@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from st_remy.yasg import SCHEMA, build_schema
+
+class Command(BaseCommand):
+  help = 'Собирает схему OpenAPI (JSON и YAML) для отдачи без генерации на лету'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--root', help='Каталог для файлов схемы (по умолчанию SCHEMA["ROOT"])')
+
+  def handle(self, *args, **options):
+    version = build_schema(options['root'])
+    self.stdout.write(self.style.SUCCESS('Схема %s собрана в %s' % (version, options['root'] or SCHEMA['ROOT'])))
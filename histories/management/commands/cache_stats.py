@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from histories.response_cache import response_cache
+
+class Command(BaseCommand):
+  help = 'Счётчики попаданий в кэш ответов'
+
+  def handle(self, *args, **options):
+    stats = response_cache.stats()
+    self.stdout.write('hits: {hits}\nmisses: {misses}\nhit rate: {hit_rate:.2%}'.format(**stats))
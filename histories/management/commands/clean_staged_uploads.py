@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from histories import staging
+
+class Command(BaseCommand):
+  help = 'Удаляет предзагрузки, которые не были использованы в истории'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--hours', type=float, help='Возраст предзагрузки (по умолчанию STAGED_UPLOADS["TTL_HOURS"])')
+
+  def handle(self, *args, **options):
+    count = 0
+    for upload in staging.expired(options['hours']).iterator():
+      staging.discard(upload)
+      count += 1
+
+    self.stdout.write(self.style.SUCCESS('Удалено предзагрузок: %d' % count))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from histories import idempotency
+
+class Command(BaseCommand):
+  help = 'Удаляет сохранённые ответы Idempotency-Key старше TTL'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--hours', type=float, help='Возраст ключа (по умолчанию IDEMPOTENCY["TTL_HOURS"])')
+
+  def handle(self, *args, **options):
+    count, _ = idempotency.expired(options['hours']).delete()
+    self.stdout.write(self.style.SUCCESS('Удалено ключей: %d' % count))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from histories import trending
+
+class Command(BaseCommand):
+  help = 'Затухание рейтинга историй (запускать по расписанию раз в DECAY_INTERVAL_HOURS)'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--rebuild', action='store_true', help='Пересчитать рейтинг заново по голосам')
+
+  def handle(self, *args, **options):
+    if options['rebuild']:
+      count = trending.rebuild()
+      self.stdout.write(self.style.SUCCESS('Пересчитан рейтинг %d историй' % count))
+      return
+
+    count = trending.decay()
+    self.stdout.write(self.style.SUCCESS('Обновлён рейтинг %d историй' % count))
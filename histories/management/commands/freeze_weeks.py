@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from histories import archive
+
+class Command(BaseCommand):
+  help = 'Генерирует статичные JSON-архивы закрытых недель (только новые и изменённые)'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--week', help='Неделя (воскресенье) в формате YYYY-MM-DD')
+
+  def handle(self, *args, **options):
+    if options['week']:
+      week = archive.parse_week(options['week'])
+      if week is None or not archive.is_closed(week):
+        raise CommandError('Неделя должна быть закрытой датой в формате YYYY-MM-DD')
+      weeks = [week]
+    else:
+      weeks = archive.pending_weeks()
+
+    request = archive.build_request()
+    for week in weeks:
+      archive.render_week(week, request)
+      self.stdout.write('Неделя %s заморожена' % week)
+
+    self.stdout.write(self.style.SUCCESS('Готово: %d' % len(weeks)))
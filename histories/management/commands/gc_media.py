@@ -0,0 +1,103 @@
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from histories.models import Image, StoredFile
+
+# служебные каталоги внутри MEDIA_ROOT, которые не относятся к Image
+EXCLUDE_DIRS = ('archive', 'staging')
+
+def walk(root, exclude):
+  """Потоковый обход файлов: (относительный путь, полный путь, stat)"""
+  stack = ['']
+  while stack:
+    relative_dir = stack.pop()
+    try:
+      entries = os.scandir(os.path.join(root, relative_dir))
+    except FileNotFoundError:
+      continue
+
+    with entries:
+      for entry in entries:
+        relative = os.path.join(relative_dir, entry.name).replace(os.sep, '/')
+        if entry.is_dir(follow_symlinks=False):
+          if relative not in exclude:
+            stack.append(relative)
+        elif entry.is_file(follow_symlinks=False):
+          yield relative, entry.path, entry.stat(follow_symlinks=False)
+
+def batches(iterable, size):
+  batch = []
+  for item in iterable:
+    batch.append(item)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+class Command(BaseCommand):
+  help = 'Удаляет (или переносит в карантин) файлы в MEDIA_ROOT без ссылок из Image и StoredFile'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--dry-run', action='store_true', help='Только отчёт, без удаления')
+    parser.add_argument('--grace-hours', type=float, default=24, help='Не трогать файлы моложе N часов')
+    parser.add_argument('--quarantine', help='Переносить файлы в этот каталог вместо удаления')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--exclude', action='append', default=[], help='Каталог внутри MEDIA_ROOT, который не нужно сканировать')
+
+  def handle(self, *args, **options):
+    root = settings.MEDIA_ROOT
+    exclude = set(EXCLUDE_DIRS) | set(options['exclude'])
+    quarantine = options['quarantine']
+    if quarantine:
+      quarantine = os.path.abspath(quarantine)
+      if quarantine.startswith(os.path.abspath(root) + os.sep):
+        exclude.add(os.path.relpath(quarantine, root).replace(os.sep, '/'))
+
+    deadline = time.time() - options['grace_hours'] * 3600
+    dry_run = options['dry_run']
+    verbose = dry_run or options['verbosity'] > 1
+    scanned = orphaned = orphaned_bytes = 0
+
+    for batch in batches(walk(root, exclude), options['batch_size']):
+      scanned += len(batch)
+      names = [name for name, _, _ in batch]
+      referenced = set(Image.objects.filter(image__in=names).values_list('image', flat=True))
+      # на файл могут ссылаться и без Image (например, ArchivedHistory.images)
+      referenced |= set(StoredFile.objects.filter(name__in=names, refs__gt=0).values_list('name', flat=True))
+
+      removed = []
+      for name, path, stat in batch:
+        if name in referenced or stat.st_mtime > deadline:
+          continue
+
+        orphaned += 1
+        orphaned_bytes += stat.st_size
+        if verbose:
+          self.stdout.write(name)
+
+        if not dry_run:
+          self.remove(path, name, quarantine)
+          removed.append(name)
+
+      if removed:
+        StoredFile.objects.filter(name__in=removed).delete()
+
+    action = 'Найдено' if dry_run else ('Перенесено в карантин' if quarantine else 'Удалено')
+    self.stdout.write(self.style.SUCCESS(
+      'Просканировано файлов: %d. %s неиспользуемых: %d (%.1f МБ)' % (
+        scanned, action, orphaned, orphaned_bytes / 1024 / 1024
+      )
+    ))
+
+  def remove(self, path, name, quarantine):
+    if quarantine:
+      target = os.path.join(quarantine, name)
+      os.makedirs(os.path.dirname(target), exist_ok=True)
+      shutil.move(path, target)
+    else:
+      os.remove(path)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from histories import cold_storage
+
+class Command(BaseCommand):
+  help = 'Переносит голоса (и отклонённые истории) закрытых недель в архивные таблицы'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--keep-weeks', type=int, help='Закрытых недель в горячих таблицах (по умолчанию COLD_STORAGE["KEEP_WEEKS"])')
+    parser.add_argument('--batch-size', type=int, help='Строк в одной транзакции')
+    parser.add_argument('--rejected', action='store_true', help='Перенести и отклонённые истории')
+
+  def handle(self, *args, **options):
+    before = cold_storage.cutoff_week(options['keep_weeks'])
+
+    voices = cold_storage.move_voices(before, options['batch_size'])
+    self.stdout.write(self.style.SUCCESS('Голосов перенесено: %d (недели до %s)' % (voices, before)))
+
+    if options['rejected']:
+      histories = cold_storage.move_rejected(before, options['batch_size'])
+      self.stdout.write(self.style.SUCCESS('Отклонённых историй перенесено: %d' % histories))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from histories import winners
+
+class Command(BaseCommand):
+  help = 'Перестраивает готовые ответы списка победителей'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=500)
+
+  def handle(self, *args, **options):
+    built = winners.rebuild(chunk_size=options['batch_size'])
+    self.stdout.write(self.style.SUCCESS('Готово: %d' % built))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from histories import search
+
+class Command(BaseCommand):
+  help = 'Перестраивает полнотекстовый индекс описаний историй'
+
+  def handle(self, *args, **options):
+    search.reindex(connection)
+    self.stdout.write(self.style.SUCCESS('Индекс перестроен (%s)' % connection.vendor))
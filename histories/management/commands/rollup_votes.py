@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from histories import analytics
+
+class Command(BaseCommand):
+  help = 'Добавляет новые голоса в почасовые и понедельные агрегаты'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--rebuild', action='store_true', help='Пересчитать агрегаты с нуля по Voice и ArchivedVoice')
+    parser.add_argument('--batch-size', type=int, default=None)
+
+  def handle(self, *args, **options):
+    if options['rebuild']:
+      processed = analytics.rebuild(options['batch_size'])
+    else:
+      processed = analytics.rollup(options['batch_size'])
+
+    self.stdout.write(self.style.SUCCESS('Учтено голосов: %d, позиция: %s' % (processed, analytics.get_watermark())))
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+COMPRESSION = {
+  'MIN_SIZE': 1024,
+  # уже сжатые форматы
+  'SKIP_CONTENT_TYPES': ('image/', 'video/', 'audio/', 'application/gzip', 'application/zip'),
+}
+COMPRESSION.update(getattr(settings, 'COMPRESSION', {}))
+
+class CompressionMiddleware(GZipMiddleware):
+  """gzip только для ответов больше COMPRESSION['MIN_SIZE'] байт"""
+
+  def process_response(self, request, response):
+    if not response.streaming and len(response.content) < COMPRESSION['MIN_SIZE']:
+      return response
+    if response.get('Content-Type', '').startswith(COMPRESSION['SKIP_CONTENT_TYPES']):
+      return response
+    return super().process_response(request, response)
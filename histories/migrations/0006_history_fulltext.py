@@ -0,0 +1,57 @@
+from django.db import migrations
+
+# SQL на момент миграции: histories.search может меняться независимо
+FTS_TABLE = 'histories_history_fts'
+PG_INDEX = 'histories_history_desc_tsv'
+
+SETUP = {
+    'sqlite': [
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+        f'"desc", content=\'histories_history\', content_rowid=\'id\', tokenize=\'unicode61\')',
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON histories_history BEGIN '
+        f'INSERT INTO {FTS_TABLE}(rowid, "desc") VALUES (new.id, new."desc"); END',
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON histories_history BEGIN '
+        f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, "desc") VALUES (\'delete\', old.id, old."desc"); END',
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF "desc" ON histories_history BEGIN '
+        f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, "desc") VALUES (\'delete\', old.id, old."desc"); '
+        f'INSERT INTO {FTS_TABLE}(rowid, "desc") VALUES (new.id, new."desc"); END',
+        f'INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES (\'rebuild\')',
+    ],
+    'postgresql': [
+        f'CREATE INDEX IF NOT EXISTS {PG_INDEX} ON histories_history '
+        f'USING GIN (to_tsvector(\'russian\', histories_history."desc"))',
+    ],
+}
+
+TEARDOWN = {
+    'sqlite': [
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+        f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+        f'DROP TABLE IF EXISTS {FTS_TABLE}',
+    ],
+    'postgresql': [
+        f'DROP INDEX IF EXISTS {PG_INDEX}',
+    ],
+}
+
+
+def create_index(apps, schema_editor):
+    for sql in SETUP.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    for sql in TEARDOWN.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0005_auto_20201001_1643'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
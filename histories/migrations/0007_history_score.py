@@ -0,0 +1,22 @@
+# Generated by Django 3.1.1 on 2026-10-18 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0006_history_fulltext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Рейтинг'),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['-score', '-id'], name='history_trending_idx'),
+        ),
+    ]
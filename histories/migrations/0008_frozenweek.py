@@ -0,0 +1,25 @@
+# Generated by Django 3.1.1 on 2026-10-18 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0007_history_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FrozenWeek',
+            fields=[
+                ('week', models.DateField(primary_key=True, serialize=False, verbose_name='Неделя')),
+                ('frozen_at', models.DateTimeField(auto_now=True, verbose_name='Дата генерации')),
+                ('dirty', models.BooleanField(default=False, verbose_name='Требует перегенерации')),
+            ],
+            options={
+                'verbose_name': 'Архив недели',
+                'verbose_name_plural': 'Архивы недель',
+            },
+        ),
+    ]
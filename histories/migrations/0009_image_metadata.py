@@ -0,0 +1,44 @@
+# Generated by Django 3.1.1 on 2026-10-18 23:17
+
+from django.db import migrations, models
+
+
+def fix_orientation(apps, schema_editor):
+    History = apps.get_model('histories', 'History')
+    History.objects.filter(orientation='horiz').update(orientation='horizontal')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0008_frozenweek'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Высота'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='placeholder',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Превью (LQIP)'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='size',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Размер, байт'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ширина'),
+        ),
+        migrations.AlterField(
+            model_name='history',
+            name='orientation',
+            field=models.CharField(choices=[('vertical', 'Вертикальная'), ('horizontal', 'Горизонтальная')], default='horizontal', max_length=10, verbose_name='Ориентация'),
+        ),
+        migrations.RunPython(fix_orientation, migrations.RunPython.noop),
+    ]
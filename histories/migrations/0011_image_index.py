@@ -0,0 +1,18 @@
+# Generated by Django 3.1.1 on 2026-10-18 23:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0010_storedfile'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(db_index=True, upload_to='images/', verbose_name='Изображение'),
+        ),
+    ]
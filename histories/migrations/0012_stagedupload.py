@@ -0,0 +1,37 @@
+# Generated by Django 3.1.1 on 2026-10-18 23:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('histories', '0011_image_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StagedUpload',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file', models.CharField(max_length=255, verbose_name='Путь')),
+                ('ext', models.CharField(max_length=8, verbose_name='Расширение')),
+                ('sha256', models.CharField(max_length=64, verbose_name='SHA-256')),
+                ('width', models.PositiveIntegerField(blank=True, null=True, verbose_name='Ширина')),
+                ('height', models.PositiveIntegerField(blank=True, null=True, verbose_name='Высота')),
+                ('size', models.PositiveIntegerField(blank=True, null=True, verbose_name='Размер, байт')),
+                ('placeholder', models.TextField(blank=True, default='', verbose_name='Превью (LQIP)')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Предзагрузка',
+                'verbose_name_plural': 'Предзагрузки',
+            },
+        ),
+    ]
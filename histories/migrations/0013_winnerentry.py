@@ -0,0 +1,33 @@
+# Generated by Django 3.1.1 on 2026-10-18 23:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0012_stagedupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WinnerEntry',
+            fields=[
+                ('leaderboard', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='histories.leaderboard', verbose_name='Победитель')),
+                ('week', models.DateField(verbose_name='Неделя')),
+                ('main', models.BooleanField(default=False, verbose_name='Главный победитель')),
+                ('history_id', models.PositiveIntegerField(db_index=True, verbose_name='История')),
+                ('payload', models.JSONField(verbose_name='Данные')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Готовый победитель',
+                'verbose_name_plural': 'Готовые победители',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='winnerentry',
+            index=models.Index(fields=['-main', '-week'], name='winner_entry_order_idx'),
+        ),
+    ]
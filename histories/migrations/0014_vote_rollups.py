@@ -0,0 +1,71 @@
+# Generated by Django 3.1.1 on 2026-10-18 23:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0013_winnerentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False, verbose_name='Название')),
+                ('created_at', models.DateTimeField(blank=True, null=True, verbose_name='Время голоса')),
+                ('last_id', models.PositiveIntegerField(default=0, verbose_name='ID голоса')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Позиция агрегации',
+                'verbose_name_plural': 'Позиции агрегации',
+            },
+        ),
+        migrations.CreateModel(
+            name='WeeklyVotes',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateField(verbose_name='Неделя')),
+                ('city', models.CharField(blank=True, default='', max_length=255, verbose_name='Город')),
+                ('votes', models.PositiveIntegerField(default=0, verbose_name='Голосов')),
+                ('history', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='histories.history', verbose_name='История')),
+            ],
+            options={
+                'verbose_name': 'Голоса за неделю',
+                'verbose_name_plural': 'Голоса по неделям',
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyVotes',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(verbose_name='Час')),
+                ('city', models.CharField(blank=True, default='', max_length=255, verbose_name='Город')),
+                ('votes', models.PositiveIntegerField(default=0, verbose_name='Голосов')),
+                ('history', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='histories.history', verbose_name='История')),
+            ],
+            options={
+                'verbose_name': 'Голоса за час',
+                'verbose_name_plural': 'Голоса по часам',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='weeklyvotes',
+            index=models.Index(fields=['bucket'], name='weekly_votes_bucket_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='weeklyvotes',
+            unique_together={('history', 'bucket', 'city')},
+        ),
+        migrations.AddIndex(
+            model_name='hourlyvotes',
+            index=models.Index(fields=['bucket'], name='hourly_votes_bucket_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='hourlyvotes',
+            unique_together={('history', 'bucket', 'city')},
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.1.1 on 2026-10-18 23:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('histories', '0014_vote_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=16, verbose_name='Эндпоинт')),
+                ('key', models.CharField(max_length=64, verbose_name='Ключ')),
+                ('path', models.CharField(max_length=255, verbose_name='Адрес')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Код ответа')),
+                ('content', models.BinaryField(default=b'', verbose_name='Тело ответа')),
+                ('content_type', models.CharField(blank=True, default='', max_length=100, verbose_name='Content-Type')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Создан')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ключ идемпотентности',
+                'verbose_name_plural': 'Ключи идемпотентности',
+                'unique_together': {('user', 'scope', 'key')},
+            },
+        ),
+    ]
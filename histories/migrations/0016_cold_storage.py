@@ -0,0 +1,60 @@
+# Generated by Django 3.1.1 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0015_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedHistory',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('user_id', models.PositiveIntegerField(db_index=True, verbose_name='Пользователь')),
+                ('week', models.DateField(db_index=True, verbose_name='Неделя')),
+                ('status', models.CharField(choices=[('mod', 'На модерации'), ('pub', 'Опубликовано'), ('reject', 'Отклонено')], max_length=10, verbose_name='Статус истории')),
+                ('desc', models.TextField(verbose_name='Описание')),
+                ('desc_comment', models.TextField(blank=True, null=True, verbose_name='Комментарий к описанию')),
+                ('orientation', models.CharField(choices=[('vertical', 'Вертикальная'), ('horizontal', 'Горизонтальная')], max_length=10, verbose_name='Ориентация')),
+                ('voices', models.PositiveIntegerField(default=0, verbose_name='Голосов')),
+                ('images', models.JSONField(default=list, verbose_name='Изображения')),
+                ('created_at', models.DateTimeField(verbose_name='Создана')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Перенесена')),
+            ],
+            options={
+                'verbose_name': 'Архивная история',
+                'verbose_name_plural': 'Архивные истории',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedVoice',
+            fields=[
+                ('id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('history_id', models.PositiveIntegerField(verbose_name='История')),
+                ('user_id', models.PositiveIntegerField(verbose_name='Пользователь')),
+                ('week', models.DateField(db_index=True, verbose_name='Неделя')),
+                ('created_at', models.DateTimeField(verbose_name='Создан')),
+            ],
+            options={
+                'verbose_name': 'Архивный голос',
+                'verbose_name_plural': 'Архивные голоса',
+            },
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='archived_voices',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Голосов в архиве'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedvoice',
+            index=models.Index(fields=['user_id', 'history_id'], name='archived_voice_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedvoice',
+            index=models.Index(fields=['history_id'], name='archived_voice_history_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.1.1 on 2026-10-18 23:43
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def sunday(day):
+    return day + datetime.timedelta(days=6 - day.weekday())
+
+
+def backfill_weeks(apps, schema_editor):
+    Week = apps.get_model('histories', 'Week')
+    History = apps.get_model('histories', 'History')
+    Leaderboard = apps.get_model('histories', 'Leaderboard')
+    Voice = apps.get_model('histories', 'Voice')
+
+    tz = timezone.get_default_timezone()
+    days = set(History.objects.values_list('week', flat=True).distinct())
+    days |= set(Leaderboard.objects.values_list('week', flat=True).distinct())
+
+    for day in sorted(days):
+        label = sunday(day)
+        start = timezone.make_aware(datetime.datetime.combine(label - datetime.timedelta(days=6), datetime.time.min), tz)
+        end = timezone.make_aware(datetime.datetime.combine(label + datetime.timedelta(days=1), datetime.time.min), tz)
+        week, _ = Week.objects.get_or_create(day=label, defaults={'start': start, 'end': end, 'deadline': end})
+
+        History.objects.filter(week=day).update(contest_week=week)
+        Leaderboard.objects.filter(week=day).update(contest_week=week)
+        Voice.objects.filter(history__week=day).update(contest_week=week)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0016_cold_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Week',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True, verbose_name='Неделя (воскресенье)')),
+                ('start', models.DateTimeField(verbose_name='Начало')),
+                ('end', models.DateTimeField(verbose_name='Конец')),
+                ('deadline', models.DateTimeField(verbose_name='Приём историй до')),
+            ],
+            options={
+                'verbose_name': 'Неделя конкурса',
+                'verbose_name_plural': 'Недели конкурса',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='contest_week',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='histories.week', verbose_name='Неделя конкурса'),
+        ),
+        migrations.AddField(
+            model_name='leaderboard',
+            name='contest_week',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='histories.week', verbose_name='Неделя конкурса'),
+        ),
+        migrations.AddField(
+            model_name='voice',
+            name='contest_week',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='histories.week', verbose_name='Неделя конкурса'),
+        ),
+        migrations.RunPython(backfill_weeks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+from urllib.parse import urlsplit
+
+from django.db import migrations
+
+
+def strip_origin(apps, schema_editor):
+    WinnerEntry = apps.get_model('histories', 'WinnerEntry')
+    for entry in WinnerEntry.objects.all().iterator():
+        history = entry.payload.get('history') or {}
+        changed = False
+        for name in ('img_before', 'img_after'):
+            image = history.get(name)
+            if image and image.get('image'):
+                parts = urlsplit(image['image'])
+                if parts.netloc:
+                    image['image'] = parts.path
+                    changed = True
+        if changed:
+            WinnerEntry.objects.filter(pk=entry.pk).update(payload=entry.payload)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0017_week'),
+    ]
+
+    operations = [
+        migrations.RunPython(strip_origin, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+def fill_city(apps, schema_editor):
+    ArchivedVoice = apps.get_model('histories', 'ArchivedVoice')
+    Profile = apps.get_model('histories', 'Profile')
+    user_ids = ArchivedVoice.objects.values('user_id').distinct()
+    cities = Profile.objects.filter(user_id__in=user_ids).exclude(city__isnull=True).exclude(city='')
+    for user_id, city in cities.values_list('user_id', 'city').iterator():
+        ArchivedVoice.objects.filter(user_id=user_id).update(city=city)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0018_winner_relative_urls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedvoice',
+            name='city',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Город'),
+        ),
+        migrations.RunPython(fill_city, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+FTS_TABLE = 'histories_history_fts'
+
+RESTORE = [
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON histories_history BEGIN '
+    f'INSERT INTO {FTS_TABLE}(rowid, "desc") VALUES (new.id, new."desc"); END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON histories_history BEGIN '
+    f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, "desc") VALUES (\'delete\', old.id, old."desc"); END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF "desc" ON histories_history BEGIN '
+    f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, "desc") VALUES (\'delete\', old.id, old."desc"); '
+    f'INSERT INTO {FTS_TABLE}(rowid, "desc") VALUES (new.id, new."desc"); END',
+    f'INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES (\'rebuild\')',
+]
+
+
+def restore_index(apps, schema_editor):
+    # sqlite пересоздаёт histories_history при изменении полей (0007, 0009, 0016, 0017),
+    # триггеры FTS при этом удаляются; дальше их восстанавливает post_migrate
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in RESTORE:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('histories', '0020_idempotencykey_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(restore_index, migrations.RunPython.noop),
+    ]
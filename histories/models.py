@@ -1,4 +1,7 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 from django.core.validators import RegexValidator
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
@@ -23,15 +26,36 @@ STATUS_ITEMS = STATUS + (
   ('edit', 'Редактируется'),
 )
 
+class Week(models.Model):
+  """Неделя конкурса: границы в часовом поясе проекта (TIME_ZONE)"""
+
+  day = models.DateField("Неделя (воскресенье)", unique=True)
+  start = models.DateTimeField("Начало")
+  end = models.DateTimeField("Конец")
+  deadline = models.DateTimeField("Приём историй до")
+
+  def __str__(self):
+    return f'{self.day}'
+
+  class Meta:
+    verbose_name = "Неделя конкурса"
+    verbose_name_plural = "Недели конкурса"
+    ordering = ['-day']
+
 class Image(TimeStampMixin):
   """Изображение"""
 
-  image = models.ImageField("Изображение", upload_to="images/")
+  image = models.ImageField("Изображение", upload_to="images/", db_index=True)
   date = models.PositiveSmallIntegerField("Дата фотографии", default=2019)
   status = models.CharField("Статус изображения", max_length=10, choices=STATUS_ITEMS, default='mod')
   comment = models.TextField("Комментарий", null=True, blank=True)
   history = models.ForeignKey('History', verbose_name="История", on_delete=models.CASCADE, related_name="images", null=True, blank=True)
 
+  width = models.PositiveIntegerField("Ширина", null=True, blank=True, editable=False)
+  height = models.PositiveIntegerField("Высота", null=True, blank=True, editable=False)
+  size = models.PositiveIntegerField("Размер, байт", null=True, blank=True, editable=False)
+  placeholder = models.TextField("Превью (LQIP)", blank=True, default='', editable=False)
+
   def __str__(self):
     return f'{self.id}'
 
@@ -53,12 +77,16 @@ class History(TimeStampMixin):
 
   user = models.ForeignKey(User, verbose_name="Пользователь", on_delete=models.CASCADE)
 
-  orientation = models.CharField("Ориентация", max_length=10, choices=ORIENTATION, default='horiz')
+  orientation = models.CharField("Ориентация", max_length=10, choices=ORIENTATION, default='horizontal')
   status = models.CharField("Статус истории", max_length=10, choices=STATUS, default='mod')
 
   week = models.DateField("Неделя")
+  contest_week = models.ForeignKey(Week, verbose_name="Неделя конкурса", on_delete=models.PROTECT, related_name="+", null=True, blank=True, editable=False)
   admin_viewed = models.BooleanField("Просмотренно админом", default=False)
   draft = models.BooleanField("Черновик", default=False)
+  score = models.FloatField("Рейтинг", default=0, editable=False)
+  # голоса, перенесённые в ArchivedVoice (manage.py move_to_cold_storage)
+  archived_voices = models.PositiveIntegerField("Голосов в архиве", default=0, editable=False)
 
   img_before = models.OneToOneField(
     Image,
@@ -95,12 +123,16 @@ class History(TimeStampMixin):
   class Meta:
     verbose_name = "История"
     verbose_name_plural = "Истории"
+    indexes = [
+      models.Index(fields=['-score', '-id'], name='history_trending_idx'),
+    ]
 
 class Leaderboard(TimeStampMixin):
   """Список победителей"""
 
   history = models.ForeignKey(History, verbose_name="История", on_delete=models.CASCADE)
   week = models.DateField("Неделя")
+  contest_week = models.ForeignKey(Week, verbose_name="Неделя конкурса", on_delete=models.PROTECT, related_name="+", null=True, blank=True, editable=False)
   main = models.BooleanField("Главный победитель", default=False)
 
   def __str__(self):
@@ -115,6 +147,8 @@ class Voice(TimeStampMixin):
 
   history = models.ForeignKey(History, verbose_name="История", on_delete=models.CASCADE, related_name="voices")
   user = models.ForeignKey(User, verbose_name="Пользователь", on_delete=models.CASCADE)
+  # неделя истории, чтобы группировать голоса без join
+  contest_week = models.ForeignKey(Week, verbose_name="Неделя конкурса", on_delete=models.PROTECT, related_name="+", null=True, blank=True, editable=False)
 
   def __str__(self):
     return f'{self.history} - {self.user}'
@@ -155,3 +189,185 @@ class Profile(TimeStampMixin):
   class Meta:
     verbose_name = "Пользователь"
     verbose_name_plural = "Пользователи"
+
+class FrozenWeek(models.Model):
+  """Замороженный архив недели"""
+
+  week = models.DateField("Неделя", primary_key=True)
+  frozen_at = models.DateTimeField("Дата генерации", auto_now=True)
+  dirty = models.BooleanField("Требует перегенерации", default=False)
+
+  def __str__(self):
+    return f'{self.week}'
+
+  class Meta:
+    verbose_name = "Архив недели"
+    verbose_name_plural = "Архивы недель"
+
+class StoredFile(models.Model):
+  """Файл в хранилище с адресацией по содержимому"""
+
+  name = models.CharField("Путь", max_length=255, primary_key=True)
+  refs = models.PositiveIntegerField("Количество ссылок", default=0)
+
+  def __str__(self):
+    return self.name
+
+  class Meta:
+    verbose_name = "Файл"
+    verbose_name_plural = "Файлы"
+
+class StagedUpload(TimeStampMixin):
+  """Предварительно загруженное изображение"""
+
+  id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+  user = models.ForeignKey(User, verbose_name="Пользователь", on_delete=models.CASCADE)
+  file = models.CharField("Путь", max_length=255)
+  ext = models.CharField("Расширение", max_length=8)
+  sha256 = models.CharField("SHA-256", max_length=64)
+
+  width = models.PositiveIntegerField("Ширина", null=True, blank=True)
+  height = models.PositiveIntegerField("Высота", null=True, blank=True)
+  size = models.PositiveIntegerField("Размер, байт", null=True, blank=True)
+  placeholder = models.TextField("Превью (LQIP)", blank=True, default='')
+
+  def __str__(self):
+    return f'{self.id}'
+
+  class Meta:
+    verbose_name = "Предзагрузка"
+    verbose_name_plural = "Предзагрузки"
+
+class WinnerEntry(models.Model):
+  """Готовый ответ для списка победителей (денормализованная копия Leaderboard)"""
+
+  leaderboard = models.OneToOneField(Leaderboard, verbose_name="Победитель", on_delete=models.CASCADE, primary_key=True)
+  week = models.DateField("Неделя")
+  main = models.BooleanField("Главный победитель", default=False)
+  history_id = models.PositiveIntegerField("История", db_index=True)
+  payload = models.JSONField("Данные")
+  updated_at = models.DateTimeField(auto_now=True)
+
+  def __str__(self):
+    return f'{self.week}'
+
+  class Meta:
+    verbose_name = "Готовый победитель"
+    verbose_name_plural = "Готовые победители"
+    indexes = [
+      models.Index(fields=['-main', '-week'], name='winner_entry_order_idx'),
+    ]
+
+class HourlyVotes(models.Model):
+  """Голоса по историям за час (по городу проголосовавшего)"""
+
+  bucket = models.DateTimeField("Час")
+  history = models.ForeignKey(History, verbose_name="История", on_delete=models.CASCADE, related_name="+")
+  city = models.CharField("Город", max_length=255, blank=True, default='')
+  votes = models.PositiveIntegerField("Голосов", default=0)
+
+  class Meta:
+    verbose_name = "Голоса за час"
+    verbose_name_plural = "Голоса по часам"
+    unique_together = ('history', 'bucket', 'city')
+    indexes = [
+      models.Index(fields=['bucket'], name='hourly_votes_bucket_idx'),
+    ]
+
+class WeeklyVotes(models.Model):
+  """Голоса по историям за неделю (по городу проголосовавшего)"""
+
+  bucket = models.DateField("Неделя")
+  history = models.ForeignKey(History, verbose_name="История", on_delete=models.CASCADE, related_name="+")
+  city = models.CharField("Город", max_length=255, blank=True, default='')
+  votes = models.PositiveIntegerField("Голосов", default=0)
+
+  class Meta:
+    verbose_name = "Голоса за неделю"
+    verbose_name_plural = "Голоса по неделям"
+    unique_together = ('history', 'bucket', 'city')
+    indexes = [
+      models.Index(fields=['bucket'], name='weekly_votes_bucket_idx'),
+    ]
+
+class RollupWatermark(models.Model):
+  """Позиция последнего учтённого голоса"""
+
+  name = models.CharField("Название", max_length=32, primary_key=True)
+  created_at = models.DateTimeField("Время голоса", null=True, blank=True)
+  last_id = models.PositiveIntegerField("ID голоса", default=0)
+  updated_at = models.DateTimeField(auto_now=True)
+
+  def __str__(self):
+    return self.name
+
+  class Meta:
+    verbose_name = "Позиция агрегации"
+    verbose_name_plural = "Позиции агрегации"
+
+class IdempotencyKey(models.Model):
+  """Сохранённый ответ на запрос с заголовком Idempotency-Key"""
+
+  user = models.ForeignKey(User, verbose_name="Пользователь", on_delete=models.CASCADE, related_name="+")
+  scope = models.CharField("Эндпоинт", max_length=16)
+  key = models.CharField("Ключ", max_length=64)
+  path = models.CharField("Адрес", max_length=255)
+  # sha256 тела первого запроса
+  fingerprint = models.CharField("Хэш тела", max_length=64, blank=True, default='')
+  # пусто, пока первый запрос выполняется
+  status_code = models.PositiveSmallIntegerField("Код ответа", null=True, blank=True)
+  content = models.BinaryField("Тело ответа", default=b'')
+  content_type = models.CharField("Content-Type", max_length=100, blank=True, default='')
+  created_at = models.DateTimeField("Создан", default=timezone.now, db_index=True)
+
+  def __str__(self):
+    return f'{self.scope}:{self.key}'
+
+  class Meta:
+    verbose_name = "Ключ идемпотентности"
+    verbose_name_plural = "Ключи идемпотентности"
+    unique_together = ('user', 'scope', 'key')
+
+class ArchivedVoice(models.Model):
+  """Голос закрытой недели, перенесённый из Voice (только для чтения)"""
+
+  id = models.PositiveIntegerField(primary_key=True)
+  history_id = models.PositiveIntegerField("История")
+  user_id = models.PositiveIntegerField("Пользователь")
+  week = models.DateField("Неделя", db_index=True)
+  created_at = models.DateTimeField("Создан")
+  # город проголосовавшего на момент переноса, для пересчёта аналитики
+  city = models.CharField("Город", max_length=255, blank=True, default='')
+
+  def __str__(self):
+    return f'{self.history_id} - {self.user_id}'
+
+  class Meta:
+    verbose_name = "Архивный голос"
+    verbose_name_plural = "Архивные голоса"
+    indexes = [
+      models.Index(fields=['user_id', 'history_id'], name='archived_voice_user_idx'),
+      models.Index(fields=['history_id'], name='archived_voice_history_idx'),
+    ]
+
+class ArchivedHistory(models.Model):
+  """Отклонённая история закрытой недели вместе с изображениями"""
+
+  id = models.PositiveIntegerField(primary_key=True)
+  user_id = models.PositiveIntegerField("Пользователь", db_index=True)
+  week = models.DateField("Неделя", db_index=True)
+  status = models.CharField("Статус истории", max_length=10, choices=STATUS)
+  desc = models.TextField("Описание")
+  desc_comment = models.TextField("Комментарий к описанию", null=True, blank=True)
+  orientation = models.CharField("Ориентация", max_length=10, choices=History.ORIENTATION)
+  voices = models.PositiveIntegerField("Голосов", default=0)
+  images = models.JSONField("Изображения", default=list)
+  created_at = models.DateTimeField("Создана")
+  archived_at = models.DateTimeField("Перенесена", auto_now_add=True)
+
+  def __str__(self):
+    return f'{self.id}'
+
+  class Meta:
+    verbose_name = "Архивная история"
+    verbose_name_plural = "Архивные истории"
@@ -0,0 +1,89 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+class FeedPagination(LimitOffsetPagination):
+  """Лента по limit/offset; полная выгрузка - потоком через /history/export/"""
+  max_limit = 50
+
+class TrendingPagination(BasePagination):
+  """Keyset-пагинация по рейтингу (score, id).
+
+  Затухание меняет score всех историй одним UPDATE, поэтому позиция
+  курсора берётся по id из текущего score этой истории, а не пересчётом.
+  """
+
+  cursor_query_param = 'cursor'
+  limit_query_param = 'limit'
+  default_limit = 10
+  max_limit = 50
+  invalid_cursor_message = 'Неверный курсор'
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.base_url = request.build_absolute_uri()
+    self.limit = self.get_limit(request)
+
+    position = self.decode_cursor(request, queryset.model)
+    if position is not None:
+      score, pk = position
+      queryset = queryset.filter(Q(score__lt=score) | Q(score=score, pk__lt=pk))
+
+    items = list(queryset.order_by('-score', '-id')[:self.limit + 1])
+    self.has_next = len(items) > self.limit
+    self.page = items[:self.limit]
+    return self.page
+
+  def get_paginated_response(self, data):
+    return Response(OrderedDict([
+      ('next', self.get_next_link()),
+      ('results', data)
+    ]))
+
+  def get_next_link(self):
+    if not self.has_next:
+      return None
+
+    last = self.page[-1]
+    token = '%d:%r' % (last.pk, last.score)
+    encoded = b64encode(token.encode('ascii')).decode('ascii')
+    return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+  def get_limit(self, request):
+    try:
+      limit = int(request.query_params[self.limit_query_param])
+    except (KeyError, ValueError):
+      return self.default_limit
+    return max(1, min(limit, self.max_limit))
+
+  def decode_cursor(self, request, model):
+    encoded = request.query_params.get(self.cursor_query_param)
+    if not encoded:
+      return None
+
+    try:
+      pk, score = b64decode(encoded.encode('ascii')).decode('ascii').split(':')
+      pk, score = int(pk), float(score)
+    except (TypeError, ValueError):
+      raise NotFound(self.invalid_cursor_message)
+
+    # между страницами рейтинг мог затухнуть: берём текущий score той же истории,
+    # сохранённый - только если её уже нет
+    current = model._default_manager.filter(pk=pk).values_list('score', flat=True).first()
+    return (score if current is None else current), pk
+
+  def get_paginated_response_schema(self, schema):
+    return {
+      'type': 'object',
+      'properties': {
+        'next': {
+          'type': 'string',
+          'nullable': True,
+        },
+        'results': schema,
+      },
+    }
@@ -0,0 +1,209 @@
+import functools
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+RESPONSE_CACHE = {
+  'TIMEOUT': 60,
+  'LOCK_TIMEOUT': 10,
+  'WAIT': 5,
+  'PREFIX': 'response',
+}
+RESPONSE_CACHE.update(getattr(settings, 'RESPONSE_CACHE', {}))
+
+# какие модели влияют на какие эндпоинты
+NAMESPACES = {
+  'history': ('History', 'Image', 'Voice'),
+  'winner': ('Leaderboard', 'WinnerEntry'),
+}
+
+class ResponseCache:
+  """Кэш отрендеренных ответов с версионированием и single-flight"""
+
+  def __init__(self, timeout, lock_timeout, wait, prefix):
+    self.timeout = timeout
+    self.lock_timeout = lock_timeout
+    self.wait = wait
+    self.prefix = prefix
+    self._locks = {}
+    self._locks_guard = threading.Lock()
+
+  def version_key(self, namespace):
+    return '%s:%s:version' % (self.prefix, namespace)
+
+  def get_version(self, namespace):
+    key = self.version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+      # не начинаем с 1, чтобы не попасть на старые записи после вытеснения ключа
+      cache.add(key, int(time.time() * 1000), None)
+      version = cache.get(key)
+    return version
+
+  def invalidate(self, namespace):
+    key = self.version_key(namespace)
+    try:
+      cache.incr(key)
+    except ValueError:
+      cache.add(key, int(time.time() * 1000), None)
+
+  def invalidate_model(self, model_name):
+    for namespace, models in NAMESPACES.items():
+      if model_name in models:
+        self.invalidate(namespace)
+
+  def make_key(self, namespace, request):
+    authenticator = getattr(request, 'successful_authenticator', None)
+    if authenticator:
+      # ответ содержит персональные поля (voted), поэтому кэш у каждого пользователя свой
+      auth_name = '%s:%s' % (authenticator.__class__.__name__, request.user.pk)
+    else:
+      auth_name = 'anon'
+    return self.build_key(
+      namespace,
+      # в ответах абсолютные ссылки, поэтому хост и схема входят в ключ
+      request.build_absolute_uri(request.path),
+      request.query_params,
+      auth_name,
+      getattr(request, 'accepted_media_type', '') or '',
+    )
+
+  def build_key(self, namespace, path, params, auth_name, media_type):
+    raw = '|'.join([path, repr(sorted(params.lists())), auth_name, media_type])
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return '%s:%s:%s:%s' % (self.prefix, namespace, self.get_version(namespace), digest)
+
+  def count(self, name):
+    key = '%s:stats:%s' % (self.prefix, name)
+    try:
+      cache.incr(key)
+    except ValueError:
+      cache.add(key, 1, None)
+
+  def stats(self):
+    keys = ['%s:stats:%s' % (self.prefix, name) for name in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    hits, misses = (values.get(key, 0) for key in keys)
+    total = hits + misses
+    return {
+      'hits': hits,
+      'misses': misses,
+      'hit_rate': hits / total if total else 0.0,
+    }
+
+  def get_entry(self, key):
+    entry = cache.get(key)
+    if entry is not None:
+      self.count('hits')
+    return entry
+
+  def get_or_render(self, key, render):
+    entry = self.get_entry(key)
+    if entry is not None:
+      return entry, True
+
+    with self._local_lock(key):
+      # пока ждали, ответ мог отрендерить другой поток
+      entry = cache.get(key)
+      if entry is not None:
+        self.count('hits')
+        return entry, True
+
+      lock_key = key + ':lock'
+      if not cache.add(lock_key, 1, self.lock_timeout):
+        entry = self._wait_for(key)
+        if entry is not None:
+          self.count('hits')
+          return entry, True
+
+      try:
+        self.count('misses')
+        entry = render()
+        if entry is not None:
+          cache.set(key, entry, self.timeout)
+        return entry, False
+      finally:
+        cache.delete(lock_key)
+
+  def _wait_for(self, key):
+    deadline = time.monotonic() + self.wait
+    while time.monotonic() < deadline:
+      time.sleep(0.05)
+      entry = cache.get(key)
+      if entry is not None:
+        return entry
+    return None
+
+  def _local_lock(self, key):
+    with self._locks_guard:
+      lock = self._locks.get(key)
+      if lock is None:
+        lock = self._locks[key] = _KeyLock(self, key)
+      lock.users += 1
+    return lock
+
+  def _release_local_lock(self, lock):
+    with self._locks_guard:
+      lock.users -= 1
+      if lock.users == 0:
+        self._locks.pop(lock.key, None)
+
+class _KeyLock:
+
+  def __init__(self, owner, key):
+    self.owner = owner
+    self.key = key
+    self.users = 0
+    self.lock = threading.Lock()
+
+  def __enter__(self):
+    self.lock.acquire()
+    return self
+
+  def __exit__(self, *exc):
+    self.lock.release()
+    self.owner._release_local_lock(self)
+
+response_cache = ResponseCache(
+  RESPONSE_CACHE['TIMEOUT'],
+  RESPONSE_CACHE['LOCK_TIMEOUT'],
+  RESPONSE_CACHE['WAIT'],
+  RESPONSE_CACHE['PREFIX'],
+)
+
+def cache_response(namespace):
+  """Кэширует ответ GET-метода вьюсета (только 200)"""
+
+  def decorator(method):
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+      response = None
+
+      def render():
+        nonlocal response
+        response = method(self, request, *args, **kwargs)
+        if response.status_code != 200 or not hasattr(response, 'render'):
+          return None
+
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = self.get_renderer_context()
+        response.render()
+        return (response.content, response['Content-Type'])
+
+      key = response_cache.make_key(namespace, request)
+      entry, hit = response_cache.get_or_render(key, render)
+
+      if response is None:
+        content, content_type = entry
+        response = HttpResponse(content, content_type=content_type)
+
+      response['X-Cache'] = 'HIT' if hit else 'MISS'
+      return response
+
+    return wrapper
+  return decorator
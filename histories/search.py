@@ -0,0 +1,107 @@
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.migrations.recorder import MigrationRecorder
+
+FTS_TABLE = 'histories_history_fts'
+PG_INDEX = 'histories_history_desc_tsv'
+PG_CONFIG = 'russian'
+PG_VECTOR = "to_tsvector('%s', histories_history.\"desc\")" % PG_CONFIG
+
+# при пересоздании histories_history в миграциях sqlite удаляет триггеры:
+# их восстанавливает ensure_index по сигналу post_migrate.
+# Миграции держат свою копию SQL: правка здесь не меняет историю схемы
+SQLITE_SETUP = [
+  f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+  f'"desc", content=\'histories_history\', content_rowid=\'id\', tokenize=\'unicode61\')',
+  f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON histories_history BEGIN '
+  f'INSERT INTO {FTS_TABLE}(rowid, "desc") VALUES (new.id, new."desc"); END',
+  f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON histories_history BEGIN '
+  f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, "desc") VALUES (\'delete\', old.id, old."desc"); END',
+  f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF "desc" ON histories_history BEGIN '
+  f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, "desc") VALUES (\'delete\', old.id, old."desc"); '
+  f'INSERT INTO {FTS_TABLE}(rowid, "desc") VALUES (new.id, new."desc"); END',
+  f'INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES (\'rebuild\')',
+]
+
+SQLITE_TEARDOWN = [
+  f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+  f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+  f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+  f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+PG_SETUP = [
+  f'CREATE INDEX IF NOT EXISTS {PG_INDEX} ON histories_history USING GIN ({PG_VECTOR})',
+]
+
+PG_TEARDOWN = [
+  f'DROP INDEX IF EXISTS {PG_INDEX}',
+]
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+def get_terms(query):
+  return WORD_RE.findall(query.lower())[:10]
+
+def ensure_index(using=DEFAULT_DB_ALIAS):
+  """Создаёт недостающие таблицу, триггеры или индекс (после migrate)"""
+  connection = connections[using]
+  if ('histories', '0006_history_fulltext') not in MigrationRecorder(connection).applied_migrations():
+    return
+
+  if connection.vendor == 'sqlite':
+    with connection.cursor() as cursor:
+      cursor.execute(
+        "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+        ['%s_%s' % (FTS_TABLE, suffix) for suffix in ('ai', 'ad', 'au')],
+      )
+      if cursor.fetchone()[0] == 3:
+        return
+      # пока триггеров не было, индекс отстал: setup перестраивает его целиком
+      for sql in SQLITE_SETUP:
+        cursor.execute(sql)
+  elif connection.vendor == 'postgresql':
+    with connection.cursor() as cursor:
+      for sql in PG_SETUP:
+        cursor.execute(sql)
+
+def reindex(using=connection):
+  """Перестроение полнотекстового индекса"""
+  with using.cursor() as cursor:
+    if using.vendor == 'sqlite':
+      for sql in SQLITE_TEARDOWN + SQLITE_SETUP:
+        cursor.execute(sql)
+    elif using.vendor == 'postgresql':
+      cursor.execute(f'REINDEX INDEX {PG_INDEX}')
+
+def search(queryset, query):
+  """Фильтрует queryset историй по описанию и сортирует по релевантности"""
+  terms = get_terms(query)
+  if not terms:
+    return queryset.none()
+
+  vendor = connection.vendor
+
+  if vendor == 'sqlite':
+    # префиксный поиск: все слова, последнее может быть недописанным
+    match = ' '.join('"%s"*' % term for term in terms)
+    return queryset.extra(
+      tables=[FTS_TABLE],
+      where=[f'{FTS_TABLE}.rowid = histories_history.id', f'{FTS_TABLE} MATCH %s'],
+      params=[match],
+      select={'rank': f'bm25({FTS_TABLE})'},
+    ).order_by('rank', '-created_at')
+
+  if vendor == 'postgresql':
+    tsquery = ' & '.join('%s:*' % term for term in terms)
+    return queryset.extra(
+      where=[f"{PG_VECTOR} @@ to_tsquery('{PG_CONFIG}', %s)"],
+      params=[tsquery],
+      select={'rank': f"ts_rank({PG_VECTOR}, to_tsquery('{PG_CONFIG}', %s))"},
+      select_params=[tsquery],
+    ).order_by('-rank', '-created_at')
+
+  for term in terms:
+    queryset = queryset.filter(desc__icontains=term)
+  return queryset
@@ -1,6 +1,8 @@
 from collections import OrderedDict
 
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count
 from djoser.serializers import (
   UserSerializer as BaseUserSerializer,
   UserCreateSerializer as BaseUserRegistrationSerializer
@@ -8,19 +10,21 @@ from djoser.serializers import (
 from djoser.conf import settings
 from rest_framework import serializers
 
-from .models import History, Image, Leaderboard, Voice, Profile
-from .service import get_last_day_week, content_file_name
+from .models import History, Image, Leaderboard, Voice, Profile, StagedUpload, ArchivedVoice
+from .fieldsets import SparseFieldsMixin
+from .service import content_file_name
+from . import trending, images, staging, weeks
 
 User = get_user_model()
 
-class ImageDetailSerializer(serializers.ModelSerializer):
+class ImageDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
   """Информация о изображении"""
 
   image = serializers.SerializerMethodField()
 
   class Meta:
     model = Image
-    fields = ['image', 'date']
+    fields = ['image', 'date', 'width', 'height', 'placeholder']
 
   def get_image(self, obj):
     request = self.context.get('request')
@@ -33,24 +37,50 @@ class ImageDetailSerializerAuth(ImageDetailSerializer):
     model = Image
     fields = ImageDetailSerializer.Meta.fields + ['status', 'comment']
 
-class HistoryDetailSerializer(serializers.ModelSerializer):
+def get_voted_ids(user, history_ids):
+  """id историй, за которые голосовал пользователь, одним запросом"""
+  if not user or not user.is_authenticated:
+    return None
+  history_ids = list(history_ids)
+  hot = Voice.objects.filter(user=user, history_id__in=history_ids).values_list('history_id', flat=True)
+  # голоса закрытых недель в архиве (cold_storage), тем же запросом
+  cold = ArchivedVoice.objects.filter(user_id=user.pk, history_id__in=history_ids).values_list('history_id', flat=True)
+  return set(hot.union(cold))
+
+def get_voice_counts(history_ids):
+  """Количество голосов для страницы историй одним запросом"""
+  counts = Voice.objects.filter(history_id__in=list(history_ids)).values('history_id').annotate(total=Count('id'))
+  return {row['history_id']: row['total'] for row in counts.order_by()}
+
+class HistoryDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
   """Информация о истории"""
   img_before = ImageDetailSerializer()
   img_after = ImageDetailSerializer()
   user = serializers.SerializerMethodField(method_name='get_user')
   voices = serializers.SerializerMethodField()
+  voted = serializers.SerializerMethodField()
 
   class Meta:
     model = History
     fields = [
-      'id', 'desc', 'orientation', 'week', 'user', 'img_before', 'img_after', 'voices'
+      'id', 'desc', 'orientation', 'week', 'user', 'img_before', 'img_after', 'voices', 'voted'
     ]
 
   def get_user(self, obj):
     return obj.user.profile.get_full_name()
 
   def get_voices(self, obj):
-    return obj.voices.count()
+    counts = self.context.get('voice_counts')
+    if counts is not None:
+      return counts.get(obj.pk, 0) + obj.archived_voices
+    return obj.voices.count() + obj.archived_voices
+
+  def get_voted(self, obj):
+    # множество передаёт вьюха (get_voted_ids), для анонимов - null
+    voted = self.context.get('voted')
+    if voted is None:
+      return None
+    return obj.pk in voted
 
 class HistoryDetailSerializerAuth(HistoryDetailSerializer):
   """Информация о истории для авторизованного пользователя"""
@@ -77,6 +107,10 @@ class HistoryCreateSerializer(serializers.HyperlinkedModelSerializer):
   imageAfter = serializers.ImageField(max_length=None, allow_empty_file=False, read_only=True)
   yearAfter = serializers.IntegerField(min_value=1900, max_value=2999, read_only=True)
 
+  # id предзагрузки из /api/v1/upload/ вместо файла в запросе
+  uploadBefore = serializers.UUIDField(write_only=True, required=False, allow_null=True)
+  uploadAfter = serializers.UUIDField(write_only=True, required=False, allow_null=True)
+
   class Meta:
     model = History
     fields = (
@@ -86,6 +120,8 @@ class HistoryCreateSerializer(serializers.HyperlinkedModelSerializer):
       'yearBefore',
       'imageAfter',
       'yearAfter',
+      'uploadBefore',
+      'uploadAfter',
     )
 
   def current_user(self):
@@ -94,50 +130,95 @@ class HistoryCreateSerializer(serializers.HyperlinkedModelSerializer):
       return request.user
     return None
 
+  def validate_upload(self, value):
+    if value is None:
+      return None
+
+    upload = StagedUpload.objects.filter(pk=value, user=self.current_user()).first()
+    if upload is None:
+      raise serializers.ValidationError('Загрузка не найдена.')
+    return upload
+
+  def validate_uploadBefore(self, value):
+    return self.validate_upload(value)
+
+  def validate_uploadAfter(self, value):
+    return self.validate_upload(value)
+
+  def validate(self, attrs):
+    before, after = attrs.get('uploadBefore'), attrs.get('uploadAfter')
+    if before is not None and after is not None and before.pk == after.pk:
+      raise serializers.ValidationError({'uploadAfter': 'Одна загрузка не может быть и «до», и «после».'})
+    if self.instance is None and not weeks.is_open(weeks.current()):
+      raise serializers.ValidationError({'message': 'Приём историй на этой неделе закрыт.'})
+
+    # годы проверяются до сохранения: ошибка после переноса файлов
+    # откатила бы запись, но не предзагрузку
+    for name in ('yearBefore', 'yearAfter'):
+      year = self.initial_data.get(name, None)
+      if year is not None:
+        try:
+          attrs[name] = int(year)
+        except (TypeError, ValueError):
+          raise serializers.ValidationError({name: 'Введите правильное число.'})
+    return attrs
+
   def create(self, validated_data):
     is_draft = bool(validated_data.get('draft'))
     desc_status = 'edit' if is_draft else 'mod'
+    week = weeks.current()
+
+    # ошибка в изображениях не должна оставлять историю без картинок
+    with transaction.atomic():
+      history = History.objects.create(
+        desc=validated_data.get('desc'),
+        draft=is_draft,
+        desc_status=desc_status,
+        user=self.current_user(),
+        week=week.day,
+        contest_week=week,
+      )
 
-    history = History.objects.create(
-      desc=validated_data.get('desc'),
-      draft=is_draft,
-      desc_status=desc_status,
-      user=self.current_user(),
-      week=get_last_day_week()
-    )
-
-    self.save_images(history, is_draft, is_create=True)
+      self.save_images(history, is_draft, is_create=True)
 
     return history
 
   def update(self, instance, validated_data):
+    with transaction.atomic():
+      changed = self.update_desc(instance, validated_data)
+      self.save_images(instance, instance.draft, changed=changed)
+
+    return instance
+
+  def update_desc(self, instance, validated_data):
+    """Применяет описание и статус черновика, возвращает изменённые поля"""
+    fields = ('desc', 'draft', 'desc_status')
+    old_values = [getattr(instance, name) for name in fields]
     status = instance.desc_status
 
     if instance.desc_status == 'edit' or instance.draft:
-      instance.desc = validated_data.get('desc')
-      if not instance.draft:
-        status = 'mod'
+      if not self.partial or 'desc' in validated_data:
+        instance.desc = validated_data.get('desc')
+        if not instance.draft:
+          status = 'mod'
 
-    if instance.draft:
+    if instance.draft and (not self.partial or 'draft' in validated_data):
       instance.draft = bool(validated_data.get('draft'))
       status = 'edit' if instance.draft else 'mod'
 
     instance.desc_status = status
-    instance.save()
-
-    self.save_images(instance, instance.draft)
 
-    return instance
+    return [name for name, value in zip(fields, old_values) if getattr(instance, name) != value]
 
   def save_image(self, history, type_img, img=None, year=None, is_draft=False, is_create=False):
+    """Сохраняет изображение истории, возвращает True, если оно было заменено"""
     attr_img = 'img_%s' % type_img
     can_update_img = True
+    replaced = False
 
     status = 'edit' if is_draft else 'mod'
 
     if img:
-      img.name = content_file_name(history, type_img, img.name)
-
       # update
       old_img = getattr(history, attr_img)
       if old_img:
@@ -150,33 +231,61 @@ class HistoryCreateSerializer(serializers.HyperlinkedModelSerializer):
           can_update_img = False
 
       if can_update_img:
-        new_img = Image.objects.create(image=img, history=history, status=status)
+        fields = self.image_fields(history, type_img, img)
+        if year:
+          fields['date'] = year
+        new_img = Image.objects.create(history=history, status=status, **fields)
         setattr(history, attr_img, new_img)
+        replaced = True
 
     curr_img = getattr(history, attr_img)
     if curr_img:
+      changed = []
+
       if curr_img.status != status:
         curr_img.status = status
+        changed.append('status')
 
-      if year and can_update_img:
+      if year and can_update_img and curr_img.date != year:
         curr_img.date = year
+        changed.append('date')
 
-      curr_img.save()
+      if changed:
+        curr_img.save(update_fields=changed + ['updated_at'])
 
-  def save_images(self, history, is_draft, is_create=False):
-    post_data = self.context.get('view').request.POST
+    return replaced
+
+  def image_fields(self, history, type_img, img):
+    if isinstance(img, StagedUpload):
+      return staging.consume(img, content_file_name(history, type_img, img.ext))
+
+    img.name = content_file_name(history, type_img, img.name)
+    img, metadata = images.prepare_upload(img)
+    return dict(image=img, **metadata)
+
+  def save_images(self, history, is_draft, is_create=False, changed=()):
     files = self.context.get('view').request.FILES
+    changed = list(changed)
 
     for type_img in ['before', 'after']:
-      self.save_image(
+      suffix = type_img.capitalize()
+      replaced = self.save_image(
         history, type_img,
-        img=files.get('image%s' % type_img.capitalize(), None),
-        year=post_data.get('year%s' % type_img.capitalize(), None),
+        img=files.get('image%s' % suffix) or self.validated_data.get('upload%s' % suffix),
+        year=self.validated_data.get('year%s' % suffix, None),
         is_draft=is_draft,
         is_create=is_create
       )
+      if replaced:
+        changed.append('img_%s' % type_img)
 
-    history.save()
+    orientation = images.derive_orientation(history)
+    if orientation != history.orientation:
+      history.orientation = orientation
+      changed.append('orientation')
+
+    if changed:
+      history.save(update_fields=changed + ['updated_at'])
     return history
 
 class CreateVoiceSerializer(serializers.ModelSerializer):
@@ -196,11 +305,18 @@ class CreateVoiceSerializer(serializers.ModelSerializer):
       raise serializers.ValidationError(error)
 
 
-    voice, _ = Voice.objects.get_or_create(
+    if history.archived_voices and ArchivedVoice.objects.filter(user_id=user.pk, history_id=history.pk).exists():
+      return Voice(user=user, history=history)
+
+    voice, created = Voice.objects.get_or_create(
       user=user,
-      history=history
+      history=history,
+      defaults={'contest_week_id': history.contest_week_id}
     )
 
+    if created:
+      trending.add_voice(history.id)
+
     return voice
 
   def current_user(self):
@@ -4,8 +4,12 @@ from threading import Thread
 
 from django.core.mail import send_mail
 from django.conf import settings
+from django.utils import timezone
 
-def get_last_day_week(d=datetime.date.today()):
+def get_last_day_week(d=None):
+  # дата по умолчанию - сегодня в часовом поясе проекта, на момент вызова
+  if d is None:
+    d = timezone.localdate()
   res = d + datetime.timedelta(days = 6 - d.weekday())
   return res
 
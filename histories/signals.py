@@ -0,0 +1,120 @@
+from django.contrib.auth.models import User
+from django.core.signals import request_started, request_finished
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_user, invalidate_token
+from .models import History, Image, Leaderboard, Voice, Profile, Week, WinnerEntry
+from .response_cache import response_cache
+from .storage import HashedMediaStorage
+from . import archive, winners, connections, search, weeks
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_principal(sender, instance, **kwargs):
+  # деактивация, смена пароля или удаление пользователя;
+  # после коммита, иначе запрос успеет закэшировать старое состояние заново
+  user_id = instance.pk
+  token_keys = list(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+  transaction.on_commit(lambda: invalidate_user(user_id, token_keys))
+
+@receiver(post_delete, sender=Token)
+def invalidate_token_principal(sender, instance, **kwargs):
+  key = instance.key
+  transaction.on_commit(lambda: invalidate_token(key))
+
+@receiver(pre_save, sender=History)
+@receiver(pre_save, sender=Leaderboard)
+def link_contest_week(sender, instance, **kwargs):
+  # неделя могла быть изменена в админке
+  if instance.week:
+    instance.contest_week = weeks.for_date(instance.week)
+
+@receiver(post_save, sender=Week)
+def forget_week(sender, instance, **kwargs):
+  # дедлайн поправили в админке
+  transaction.on_commit(lambda: weeks.forget(instance.day))
+
+@receiver(pre_save, sender=Voice)
+def link_voice_week(sender, instance, **kwargs):
+  if instance.contest_week_id is None and instance.history_id:
+    instance.contest_week_id = instance.history.contest_week_id
+
+@receiver(post_save, sender=History)
+@receiver(post_delete, sender=History)
+def mark_history_week(sender, instance, **kwargs):
+  archive.mark_dirty(instance.week)
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def mark_image_week(sender, instance, **kwargs):
+  if instance.history_id:
+    weeks = History.objects.filter(pk=instance.history_id).values_list('week', flat=True)
+    archive.mark_dirty(*weeks)
+
+@receiver(post_save, sender=Voice)
+@receiver(post_delete, sender=Voice)
+def mark_voice_week(sender, instance, **kwargs):
+  # история уже загружена при создании голоса, лишнего запроса нет
+  archive.mark_dirty(instance.history.week)
+
+@receiver(post_save, sender=Leaderboard)
+@receiver(post_delete, sender=Leaderboard)
+def mark_leaderboard_week(sender, instance, **kwargs):
+  weeks = History.objects.filter(pk=instance.history_id).values_list('week', flat=True)
+  archive.mark_dirty(instance.week, *weeks)
+
+@receiver(post_save, sender=History)
+@receiver(post_delete, sender=History)
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+@receiver(post_save, sender=Voice)
+@receiver(post_delete, sender=Voice)
+@receiver(post_save, sender=Leaderboard)
+@receiver(post_delete, sender=Leaderboard)
+@receiver(post_delete, sender=WinnerEntry)
+def invalidate_responses(sender, instance, **kwargs):
+  # после коммита: иначе читатель успеет закэшировать старые данные под новой версией
+  name = sender.__name__
+  transaction.on_commit(lambda: response_cache.invalidate_model(name))
+
+@receiver(post_save, sender=Leaderboard)
+def rebuild_winner(sender, instance, **kwargs):
+  winners.schedule([instance.pk])
+
+@receiver(post_save, sender=History)
+@receiver(post_delete, sender=History)
+def rebuild_history_winners(sender, instance, **kwargs):
+  winners.schedule_for_histories([instance.pk])
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+@receiver(post_save, sender=Voice)
+@receiver(post_delete, sender=Voice)
+def rebuild_related_winners(sender, instance, **kwargs):
+  if instance.history_id:
+    winners.schedule_for_histories([instance.history_id])
+
+@receiver(post_save, sender=Profile)
+def rebuild_user_winners(sender, instance, **kwargs):
+  # имя автора входит в готовый ответ
+  history_ids = History.objects.filter(user_id=instance.user_id).values_list('pk', flat=True)
+  winners.schedule_for_histories(history_ids)
+
+@receiver(post_delete, sender=Image)
+def release_image_file(sender, instance, **kwargs):
+  storage = instance.image.storage
+  name = instance.image.name
+  if name and isinstance(storage, HashedMediaStorage):
+    transaction.on_commit(lambda: storage.release(name))
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+  # sqlite теряет триггеры FTS при пересоздании таблицы историй
+  if sender.label == 'histories':
+    search.ensure_index(using)
+
+request_started.connect(connections.check_connections, dispatch_uid='histories.check_connections')
+request_finished.connect(connections.touch_connections, dispatch_uid='histories.touch_connections')
@@ -0,0 +1,156 @@
+import datetime
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, UnsupportedMediaType, ValidationError
+from PIL import Image as PILImage
+
+from .models import StagedUpload
+from . import images
+
+STAGED_UPLOADS = {
+  # вне MEDIA_ROOT: непроверенные загрузки не должны отдаваться как медиа
+  'ROOT': os.path.join(os.path.dirname(os.path.normpath(settings.MEDIA_ROOT)), 'staging'),
+  # каталог в MEDIA_ROOT, где лежали предзагрузки до переноса ROOT
+  'DIR': 'staging',
+  'MAX_SIZE': 10 * 1024 * 1024,
+  'CHUNK_SIZE': 64 * 1024,
+  'CONTENT_TYPES': {
+    'image/jpeg': ('.jpg', 'JPEG'),
+    'image/png': ('.png', 'PNG'),
+    'image/webp': ('.webp', 'WEBP'),
+  },
+  'TTL_HOURS': 24,
+}
+STAGED_UPLOADS.update(getattr(settings, 'STAGED_UPLOADS', {}))
+
+class UploadTooLarge(APIException):
+  status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+  default_detail = 'Файл слишком большой.'
+  default_code = 'upload_too_large'
+
+def staging_root():
+  return STAGED_UPLOADS['ROOT']
+
+def upload_path(upload):
+  # старые записи хранят путь относительно MEDIA_ROOT
+  if upload.file.startswith(STAGED_UPLOADS['DIR'] + '/'):
+    return os.path.join(settings.MEDIA_ROOT, upload.file)
+  return os.path.join(staging_root(), upload.file)
+
+def stage(request, user):
+  """Потоково сохраняет тело запроса во временный файл"""
+  content_type = (request.content_type or '').split(';')[0].strip().lower()
+  if content_type not in STAGED_UPLOADS['CONTENT_TYPES']:
+    raise UnsupportedMediaType(content_type)
+  ext, image_format = STAGED_UPLOADS['CONTENT_TYPES'][content_type]
+
+  max_size = STAGED_UPLOADS['MAX_SIZE']
+  try:
+    length = int(request.META.get('CONTENT_LENGTH') or 0)
+  except ValueError:
+    length = 0
+  if length > max_size:
+    raise UploadTooLarge()
+
+  os.makedirs(staging_root(), exist_ok=True)
+  fd, path = tempfile.mkstemp(dir=staging_root(), suffix=ext)
+
+  try:
+    size = 0
+    with os.fdopen(fd, 'wb') as f:
+      while True:
+        chunk = request.read(STAGED_UPLOADS['CHUNK_SIZE'])
+        if not chunk:
+          break
+        size += len(chunk)
+        if size > max_size:
+          raise UploadTooLarge()
+        f.write(chunk)
+
+    if not size:
+      raise ValidationError({'file': 'Пустой файл.'})
+
+    metadata = prepare_file(path, image_format)
+  except BaseException:
+    os.remove(path)
+    raise
+
+  return StagedUpload.objects.create(
+    user=user,
+    file=os.path.basename(path),
+    ext=ext,
+    **metadata
+  )
+
+def prepare_file(path, image_format):
+  """Проверка формата, поворот по EXIF, метаданные и хеш"""
+  try:
+    with PILImage.open(path) as source:
+      if source.format != image_format:
+        raise ValidationError({'file': 'Содержимое не соответствует Content-Type.'})
+      source.verify()
+
+    with open(path, 'rb') as f:
+      content, metadata = images.normalize(File(f), os.path.basename(path))
+      if content is not None:
+        with open(path, 'wb') as out:
+          for chunk in content.chunks():
+            out.write(chunk)
+  except (OSError, ValueError, PILImage.DecompressionBombError):
+    raise ValidationError({'file': 'Загрузите корректное изображение.'})
+
+  sha = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(STAGED_UPLOADS['CHUNK_SIZE']), b''):
+      sha.update(chunk)
+
+  metadata['size'] = os.path.getsize(path)
+  metadata['sha256'] = sha.hexdigest()
+  return metadata
+
+def consume(upload, name):
+  """Кладёт предзагруженный файл в хранилище, возвращает поля для Image.
+
+  Запись и исходный файл удаляются только после коммита: при откате
+  предзагрузку можно использовать повторно.
+  """
+  # запись удаляется до переноса файла: второй запрос с тем же id получит 0 строк
+  deleted, _ = StagedUpload.objects.filter(pk=upload.pk).delete()
+  path = upload_path(upload)
+  if not deleted or not os.path.exists(path):
+    raise ValidationError({'upload': 'Загрузка уже использована.'})
+
+  if hasattr(default_storage, 'save_prehashed'):
+    stored_name = default_storage.save_prehashed(name, path, upload.sha256)
+  else:
+    with open(path, 'rb') as f:
+      stored_name = default_storage.save(name, File(f))
+  transaction.on_commit(lambda: remove_file(path))
+
+  return {
+    'image': stored_name,
+    'width': upload.width,
+    'height': upload.height,
+    'size': upload.size,
+    'placeholder': upload.placeholder,
+  }
+
+def remove_file(path):
+  if os.path.exists(path):
+    os.remove(path)
+
+def expired(hours=None):
+  hours = STAGED_UPLOADS['TTL_HOURS'] if hours is None else hours
+  return StagedUpload.objects.filter(created_at__lt=timezone.now() - datetime.timedelta(hours=hours))
+
+def discard(upload):
+  remove_file(upload_path(upload))
+  upload.delete()
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+def is_hashed_name(name):
+  return bool(HASHED_NAME_RE.search(name))
+
+@deconstructible
+class HashedMediaStorage(FileSystemStorage):
+  """Хранилище с адресацией по содержимому.
+
+  Файл сохраняется как <dir>/ab/cd/<sha256>.<ext>, одинаковые загрузки
+  хранятся один раз, ссылки на файл считаются в StoredFile.
+  """
+
+  def get_hashed_name(self, name, content):
+    sha = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+      sha.update(chunk)
+    return self.hashed_name(name, sha.hexdigest())
+
+  def hashed_name(self, name, digest):
+    dirname, filename = posixpath.split(name.replace('\\', '/'))
+    ext = os.path.splitext(filename)[1].lower()
+    return posixpath.join(dirname, digest[:2], digest[2:4], digest + ext)
+
+  def save(self, name, content, max_length=None):
+    if name is None:
+      name = content.name
+    if not hasattr(content, 'chunks'):
+      content = File(content, name)
+
+    name = self.get_hashed_name(name, content)
+    # строка StoredFile заблокирована до конца транзакции:
+    # release не удалит файл между проверкой на диске и записью ссылки
+    with transaction.atomic():
+      self.acquire(name)
+      return self._save(name, content)
+
+  def save_prehashed(self, name, path, digest):
+    """Кладёт уже посчитанный файл с диска (предзагрузка) жёсткой ссылкой.
+
+    Исходный файл остаётся на месте: его удаляет вызывающий, когда
+    транзакция с новой записью закоммичена.
+    """
+    name = self.hashed_name(name, digest)
+    full_path = self.path(name)
+
+    with transaction.atomic():
+      self.acquire(name)
+      if not os.path.exists(full_path):
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # ссылка во временное имя: одинаковое содержимое, replace безопасен
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        os.close(fd)
+        try:
+          try:
+            os.remove(tmp_path)
+            os.link(path, tmp_path)
+          except OSError:
+            # предзагрузки могут лежать на другом разделе
+            shutil.copyfile(path, tmp_path)
+          if self.file_permissions_mode is not None:
+            os.chmod(tmp_path, self.file_permissions_mode)
+          os.replace(tmp_path, full_path)
+        except BaseException:
+          if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+          raise
+
+    return name
+
+  def _save(self, name, content):
+    full_path = self.path(name)
+    if os.path.exists(full_path):
+      return name
+
+    directory = os.path.dirname(full_path)
+    if self.directory_permissions_mode is not None:
+      old_umask = os.umask(0)
+      try:
+        os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+      finally:
+        os.umask(old_umask)
+    else:
+      os.makedirs(directory, exist_ok=True)
+
+    # одинаковое содержимое, поэтому одновременная запись безопасна
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        content.seek(0)
+        for chunk in content.chunks():
+          f.write(chunk)
+      if self.file_permissions_mode is not None:
+        os.chmod(tmp_path, self.file_permissions_mode)
+      os.replace(tmp_path, full_path)
+    except BaseException:
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+      raise
+
+    return name
+
+  def lock(self, name):
+    """Строка StoredFile под блокировкой, (строка, создана ли).
+
+    Файлы, сохранённые до учёта ссылок, регистрируются с числом
+    ссылающихся на них Image. Только внутри транзакции.
+    """
+    from .models import Image, StoredFile
+
+    stored = StoredFile.objects.select_for_update().filter(name=name).first()
+    if stored is not None:
+      return stored, False
+    try:
+      with transaction.atomic():
+        return StoredFile.objects.create(name=name, refs=Image.objects.filter(image=name).count()), True
+    except IntegrityError:
+      # строку одновременно создал другой запрос
+      return StoredFile.objects.select_for_update().get(name=name), False
+
+  def acquire(self, name, count=1):
+    from .models import StoredFile
+
+    with transaction.atomic():
+      self.lock(name)
+      StoredFile.objects.filter(name=name).update(refs=F('refs') + count)
+
+  def release(self, name):
+    """Убирает ссылку на файл и удаляет его, если ссылок не осталось"""
+    from .models import StoredFile
+
+    with transaction.atomic():
+      stored, created = self.lock(name)
+      # у только что зарегистрированного файла удалённая ссылка уже не посчитана
+      refs = stored.refs if created else stored.refs - 1
+      if refs > 0:
+        StoredFile.objects.filter(name=name).update(refs=refs)
+        return
+      stored.delete()
+      self.delete(name)
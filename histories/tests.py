@@ -1,3 +1,1610 @@
-from django.test import TestCase
+import datetime
+import os
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .models import History, Image, Leaderboard, Profile, Voice, WinnerEntry, HourlyVotes, WeeklyVotes, IdempotencyKey
+from .models import ArchivedHistory, ArchivedVoice, RollupWatermark, StagedUpload, StoredFile, Week
+from .authentication import PrincipalCache, principal_cache
+from . import analytics, cold_storage, exports, idempotency, staging, weeks
+from .pagination import FeedPagination
+from .service import get_last_day_week
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+def write_queries(context):
+  return [query['sql'] for query in context.captured_queries if query['sql'].lstrip().upper().startswith(WRITE_PREFIXES)]
+
+class HistoryPartialUpdateTest(TestCase):
+  """PATCH /history/<pk> пишет только изменённые поля"""
+
+  def setUp(self):
+    self.user = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=self.user, first_name='Иван', surname='Иванов')
+    self.client = APIClient()
+    self.client.credentials(HTTP_AUTHORIZATION='Token %s' % Token.objects.create(user=self.user).key)
+
+    self.history = History.objects.create(
+      user=self.user, desc='Черновик', draft=True, desc_status='edit', week=get_last_day_week()
+    )
+    self.history.img_before = Image.objects.create(
+      history=self.history, image='images/before.jpg', status='edit', date=1990, width=800, height=600
+    )
+    self.history.save()
+
+  def patch(self, data):
+    url = '/api/v1/history/%d' % self.history.pk
+    with CaptureQueriesContext(connection) as context:
+      response = self.client.patch(url, data, format='json')
+    self.assertEqual(response.status_code, 200, response.content)
+    return write_queries(context)
+
+  def test_unchanged_payload_writes_nothing(self):
+    self.assertEqual(self.patch({'desc': 'Черновик'}), [])
+
+  def test_empty_payload_writes_nothing(self):
+    self.assertEqual(self.patch({}), [])
+
+  def test_desc_updates_only_history(self):
+    writes = self.patch({'desc': 'Новый текст'})
+
+    self.assertEqual(len(writes), 1)
+    self.assertIn('"desc"', writes[0])
+    self.assertNotIn('"draft"', writes[0])
+    self.history.refresh_from_db()
+    self.assertEqual(self.history.desc, 'Новый текст')
+    self.assertTrue(self.history.draft)
+
+  def test_year_updates_only_image(self):
+    writes = self.patch({'yearBefore': 2001})
+
+    self.assertEqual(len(writes), 1)
+    self.assertTrue(writes[0].startswith('UPDATE "histories_image"'))
+    self.assertEqual(Image.objects.get(pk=self.history.img_before_id).date, 2001)
+
+  def test_publish_draft_updates_history_and_image_status(self):
+    writes = self.patch({'draft': False})
+
+    self.assertEqual(len(writes), 2)
+    self.history.refresh_from_db()
+    self.assertFalse(self.history.draft)
+    self.assertEqual(self.history.desc_status, 'mod')
+    self.assertEqual(self.history.desc, 'Черновик')
+    self.assertEqual(self.history.img_before.status, 'mod')
+
+  def test_other_users_history_is_not_found(self):
+    other = User.objects.create_user('other', 'other@example.com', 'password')
+    self.client.credentials(HTTP_AUTHORIZATION='Token %s' % Token.objects.create(user=other).key)
+
+    response = self.client.patch('/api/v1/history/%d' % self.history.pk, {'desc': 'x'}, format='json')
+    self.assertEqual(response.status_code, 404)
+
+class WinnerReadModelTest(TransactionTestCase):
+  """Список победителей читается из готовых ответов"""
+  # on_commit выполняется сразу, вне обёртки TestCase
+
+  def setUp(self):
+    # таблицы очищаются между тестами, а недели закэшированы в памяти после коммита
+    weeks.clear()
+    user = User.objects.create_user('winner', 'winner@example.com', 'password')
+    Profile.objects.create(user=user, first_name='Пётр', surname='Петров')
+    self.history = History.objects.create(
+      user=user, desc='Победитель', status='pub', desc_status='pub', week=get_last_day_week()
+    )
+    Leaderboard.objects.create(history=self.history, week=self.history.week, main=True)
+
+  def test_list_is_single_read(self):
+    with CaptureQueriesContext(connection) as context:
+      response = APIClient().get('/api/v1/winner/')
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.data['results'][0]['history']['desc'], 'Победитель')
+    # count() для пагинации и выборка страницы
+    self.assertEqual(len(context.captured_queries), 2)
+
+  @override_settings(ALLOWED_HOSTS=['st-remy.example.com', 'mirror.example.org'])
+  def test_image_urls_use_request_host(self):
+    self.history.img_after = Image.objects.create(history=self.history, image='images/after.jpg', status='pub', date=2020)
+    self.history.save()
+
+    for host in ('st-remy.example.com', 'mirror.example.org'):
+      response = APIClient().get('/api/v1/winner/', HTTP_HOST=host)
+      image = response.data['results'][0]['history']['img_after']['image']
+      self.assertEqual(image, 'http://%s/media/images/after.jpg' % host)
+
+    self.assertEqual(WinnerEntry.objects.get().payload['history']['img_after']['image'], '/media/images/after.jpg')
+
+  def test_history_change_rebuilds_payload(self):
+    self.history.desc = 'Новое описание'
+    self.history.save()
+
+    payload = WinnerEntry.objects.get().payload
+    self.assertEqual(payload['history']['desc'], 'Новое описание')
+
+  def test_vote_rebuilds_payload(self):
+    voter = User.objects.create_user('voter', 'voter@example.com', 'password')
+    client = APIClient()
+    client.force_authenticate(voter)
+
+    client.post('/api/v1/voice/', {'history': self.history.pk}, format='json')
+
+    self.assertEqual(WinnerEntry.objects.get().payload['history']['voices'], 1)
+
+  def test_vote_for_other_history_skips_winners(self):
+    other = History.objects.create(user=self.history.user, desc='Другая', status='pub', week=self.history.week)
+    voter = User.objects.create_user('voter', 'voter@example.com', 'password')
+    client = APIClient()
+    client.force_authenticate(voter)
+
+    with CaptureQueriesContext(connection) as context:
+      response = client.post('/api/v1/voice/', {'history': other.pk}, format='json')
+
+    self.assertEqual(response.status_code, 200)
+    queries = [query['sql'] for query in context.captured_queries]
+    # неделя берётся из загруженной истории, победители - одним запросом к готовым ответам
+    self.assertFalse([sql for sql in queries if 'histories_leaderboard' in sql])
+    self.assertEqual(len([sql for sql in queries if sql.startswith('SELECT "histories_history"."week"')]), 0)
+    self.assertEqual(len([sql for sql in queries if 'FROM "histories_winnerentry"' in sql]), 1)
+
+class VoteRollupTest(TestCase):
+  """Инкрементальная агрегация голосов и API статистики"""
+
+  def setUp(self):
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    self.history = History.objects.create(user=author, desc='История', status='pub', week=get_last_day_week())
+    self.voters = []
+    for index, city in enumerate(['Москва', 'Москва', 'Казань']):
+      voter = User.objects.create_user('voter%d' % index, 'voter%d@example.com' % index, 'password')
+      Profile.objects.create(user=voter, first_name='Имя', surname='Фамилия', city=city)
+      self.voters.append(voter)
+
+  def vote(self, user, created_at):
+    voice = Voice.objects.create(history=self.history, user=user)
+    Voice.objects.filter(pk=voice.pk).update(created_at=created_at)
+
+  def test_rollup_is_incremental(self):
+    hour = timezone.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=3)
+    self.vote(self.voters[0], hour + datetime.timedelta(minutes=5))
+    self.vote(self.voters[2], hour + datetime.timedelta(minutes=10))
+    self.assertEqual(analytics.rollup(), 2)
+
+    self.vote(self.voters[1], hour + datetime.timedelta(minutes=20))
+    self.assertEqual(analytics.rollup(), 1)
+    self.assertEqual(analytics.rollup(), 0)
+
+    self.assertEqual(HourlyVotes.objects.get(bucket=hour, city='Москва').votes, 2)
+    self.assertEqual(HourlyVotes.objects.get(bucket=hour, city='Казань').votes, 1)
+    self.assertEqual(sum(WeeklyVotes.objects.values_list('votes', flat=True)), 3)
+
+  def test_rebuild_includes_archived_voices(self):
+    hour = timezone.now().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=3)
+    for minute, voter in enumerate(self.voters):
+      self.vote(voter, hour + datetime.timedelta(minutes=minute))
+    analytics.rollup()
+    expected = sorted(HourlyVotes.objects.values_list('history_id', 'bucket', 'city', 'votes'))
+
+    # два голоса уже в архиве, как после move_to_cold_storage
+    for voice in Voice.objects.select_related('user__profile').order_by('pk')[:2]:
+      ArchivedVoice.objects.create(
+        id=voice.pk, history_id=voice.history_id, user_id=voice.user_id, week=self.history.week,
+        created_at=voice.created_at, city=voice.user.profile.city,
+      )
+      voice.delete()
+
+    self.assertEqual(analytics.rebuild(), 3)
+    self.assertEqual(sorted(HourlyVotes.objects.values_list('history_id', 'bucket', 'city', 'votes')), expected)
+    self.assertEqual(sum(WeeklyVotes.objects.values_list('votes', flat=True)), 3)
+
+  def test_recent_votes_wait_for_lag(self):
+    self.vote(self.voters[0], timezone.now())
+    self.assertEqual(analytics.rollup(), 0)
+
+  def test_api_is_staff_only(self):
+    client = APIClient()
+    client.force_authenticate(self.voters[0])
+    self.assertEqual(client.get('/api/v1/analytics/top/').status_code, 403)
+
+  def test_top_and_cities(self):
+    now = timezone.now() - datetime.timedelta(hours=1)
+    for voter in self.voters:
+      self.vote(voter, now)
+    analytics.rollup()
+
+    staff = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+    client = APIClient()
+    client.force_authenticate(staff)
+
+    week = get_last_day_week(timezone.localdate(now)).isoformat()
+    top = client.get('/api/v1/analytics/top/', {'from': week, 'to': week}).data['results']
+    self.assertEqual(top, [{'history': self.history.pk, 'desc': 'История', 'votes': 3}])
+
+    cities = client.get('/api/v1/analytics/cities/', {'from': week, 'to': week}).data['results']
+    self.assertEqual([(row['city'], row['votes']) for row in cities], [('Москва', 2), ('Казань', 1)])
+
+    series = client.get('/api/v1/analytics/history/%d/votes/' % self.history.pk, {'interval': 'hour'}).data['results']
+    self.assertEqual([row['votes'] for row in series], [3])
+
+class VotedFlagTest(TestCase):
+  """Поле voted считается одним запросом на страницу"""
+
+  def setUp(self):
+    from django.core.cache import cache
+
+    # в TestCase кэш ответов не сбрасывается: коммита не бывает
+    cache.clear()
+    self.addCleanup(cache.clear)
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    self.histories = [
+      History.objects.create(user=author, desc='История %d' % index, status='pub', week=get_last_day_week())
+      for index in range(3)
+    ]
+    self.voter = User.objects.create_user('voter', 'voter@example.com', 'password')
+    Voice.objects.create(history=self.histories[0], user=self.voter)
+
+  def get(self, user=None):
+    client = APIClient()
+    if user:
+      client.force_authenticate(user)
+    with CaptureQueriesContext(connection) as context:
+      response = client.get('/api/v1/history/', {'limit': 10})
+    self.assertEqual(response.status_code, 200)
+    voted = {row['id']: row['voted'] for row in response.data['results']}
+    return voted, len(context.captured_queries)
+
+  def test_authenticated_user_gets_voted_with_one_query(self):
+    anonymous, anonymous_queries = self.get()
+    voted, queries = self.get(self.voter)
+
+    self.assertEqual(set(anonymous.values()), {None})
+    self.assertEqual(voted, {history.pk: history == self.histories[0] for history in self.histories})
+    self.assertEqual(queries, anonymous_queries + 1)
+
+  def test_cached_responses_are_not_shared_between_users(self):
+    other = User.objects.create_user('other', 'other@example.com', 'password')
+
+    self.assertTrue(self.get(self.voter)[0][self.histories[0].pk])
+    self.assertFalse(self.get(other)[0][self.histories[0].pk])
+
+class RendererTest(TestCase):
+  """orjson по умолчанию, MessagePack по Accept, gzip для больших ответов"""
+
+  def setUp(self):
+    from django.core.cache import cache
+
+    # в TestCase кэш ответов не сбрасывается: коммита не бывает
+    cache.clear()
+    self.addCleanup(cache.clear)
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    for index in range(20):
+      History.objects.create(user=author, desc='История %d ' % index * 20, status='pub', week=get_last_day_week())
+
+  def test_orjson_matches_drf_json(self):
+    from rest_framework.renderers import JSONRenderer
+    from .renderers import ORJSONRenderer
+
+    response = APIClient().get('/api/v1/history/', {'limit': 20})
+    self.assertEqual(ORJSONRenderer().render(response.data), JSONRenderer().render(response.data))
+
+    # сырые datetime, как в ответах аналитики
+    data = {'watermark': timezone.now(), 'bucket': timezone.make_aware(datetime.datetime(2020, 10, 4, 12))}
+    self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+  def test_msgpack_negotiation(self):
+    import msgpack
+
+    response = APIClient().get('/api/v1/history/', {'limit': 20}, HTTP_ACCEPT='application/msgpack')
+    self.assertEqual(response['Content-Type'], 'application/msgpack')
+    self.assertEqual(msgpack.unpackb(response.content)['count'], 20)
+
+  def test_compression_threshold(self):
+    client = APIClient()
+    large = client.get('/api/v1/history/', {'limit': 20}, HTTP_ACCEPT_ENCODING='gzip')
+    small = client.get('/api/v1/history/', {'limit': 20, 'offset': 100}, HTTP_ACCEPT_ENCODING='gzip')
+
+    self.assertEqual(large['Content-Encoding'], 'gzip')
+    self.assertFalse(small.has_header('Content-Encoding'))
+
+class SparseFieldsTest(TestCase):
+  """?fields= и ?omit= сокращают ответ и запросы к базе"""
+
+  def setUp(self):
+    from django.core.cache import cache
+
+    # в TestCase кэш ответов не сбрасывается: коммита не бывает
+    cache.clear()
+    self.addCleanup(cache.clear)
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    for index in range(5):
+      history = History.objects.create(user=author, desc='История %d' % index, status='pub', week=get_last_day_week())
+      history.img_after = Image.objects.create(history=history, image='images/after%d.jpg' % index, status='pub')
+      history.save()
+      Voice.objects.create(history=history, user=author)
+
+  def get(self, url, params):
+    with CaptureQueriesContext(connection) as context:
+      response = APIClient().get(url, dict(params, limit=5))
+    self.assertEqual(response.status_code, 200)
+    return response.data['results'], len(context.captured_queries)
+
+  def test_fields_trim_payload_and_queries(self):
+    full, full_queries = self.get('/api/v1/history/', {})
+    card, card_queries = self.get('/api/v1/history/', {'fields': 'id,user,img_after.image,voices'})
+
+    self.assertEqual(list(card[0]), ['id', 'user', 'img_after', 'voices'])
+    self.assertEqual(list(card[0]['img_after']), ['image'])
+    self.assertEqual(card[0]['voices'], 1)
+    self.assertLessEqual(card_queries, full_queries)
+    # count, страница с join на автора и изображение, голоса одним запросом
+    self.assertEqual(card_queries, 3)
+
+  def test_queries_do_not_grow_with_page(self):
+    _, queries = self.get('/api/v1/history/', {})
+    self.assertEqual(queries, 3)
+
+  def test_omit(self):
+    results, queries = self.get('/api/v1/history/', {'omit': 'desc,img_before,img_after,voices'})
+
+    self.assertNotIn('desc', results[0])
+    self.assertNotIn('voices', results[0])
+    self.assertIn('user', results[0])
+    self.assertEqual(queries, 2)
+
+  def test_winner_payload_is_pruned(self):
+    history = History.objects.first()
+    WinnerEntry.objects.create(
+      leaderboard=Leaderboard.objects.create(history=history, week=history.week),
+      week=history.week, history_id=history.pk,
+      payload={'history': {'id': history.pk, 'desc': 'x', 'voted': None}, 'week': '2020-01-05', 'main': False},
+    )
+
+    results, _ = self.get('/api/v1/winner/', {'fields': 'main,history.id'})
+    self.assertEqual(results[-1], {'history': {'id': history.pk}, 'main': False})
+
+class HistoryBatchTest(TestCase):
+  """GET /history/batch/?ids= - порядок запроса, фильтры и постоянное число запросов"""
+
+  def setUp(self):
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    self.published = [
+      History.objects.create(user=author, desc='История %d' % index, status='pub', week=get_last_day_week())
+      for index in range(6)
+    ]
+    self.draft = History.objects.create(user=author, desc='Черновик', draft=True, week=get_last_day_week())
+
+  def get(self, ids):
+    with CaptureQueriesContext(connection) as context:
+      response = APIClient().get('/api/v1/history/batch/', {'ids': ids})
+    return response, len(context.captured_queries)
+
+  def test_order_and_missing(self):
+    first, second = self.published[3].pk, self.published[0].pk
+    response, _ = self.get('%d,%d,%d,999999,%d' % (first, self.draft.pk, second, first))
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual([row['id'] for row in response.data['results']], [first, second])
+    self.assertEqual(response.data['missing'], [self.draft.pk, 999999])
+
+  def test_constant_queries(self):
+    _, two = self.get(','.join(str(history.pk) for history in self.published[:2]))
+    _, six = self.get(','.join(str(history.pk) for history in self.published))
+    self.assertEqual(two, six)
+
+  def test_validation(self):
+    self.assertEqual(self.get('1,x')[0].status_code, 400)
+    self.assertEqual(self.get('')[0].status_code, 400)
+    self.assertEqual(self.get(','.join(str(pk) for pk in range(1, 52)))[0].status_code, 400)
+
+class ExportTest(TestCase):
+  """Потоковые выгрузки для персонала"""
+
+  def setUp(self):
+    self.staff = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+    Profile.objects.create(user=self.staff, first_name='Анна', surname='Петрова', city='Казань')
+
+  def get(self, url, user=None):
+    client = APIClient()
+    client.force_authenticate(user or self.staff)
+    return client.get(url)
+
+  def test_csv_streams(self):
+    response = self.get('/api/v1/export/profiles/')
+
+    self.assertTrue(response.streaming)
+    content = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+    self.assertEqual(content[0].split(',')[:3], ['id', 'username', 'email'])
+    self.assertIn('Казань', content[1])
+
+  def test_ndjson(self):
+    import orjson
+
+    response = self.get('/api/v1/export/profiles/?type=ndjson')
+    lines = b''.join(response.streaming_content).splitlines()
+    self.assertEqual(orjson.loads(lines[0])['surname'], 'Петрова')
+
+  def test_voices_include_archived(self):
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    old_week = cold_storage.cutoff_week() - datetime.timedelta(weeks=1)
+    old = History.objects.create(user=author, desc='Старая', status='pub', week=old_week)
+    fresh = History.objects.create(user=author, desc='Новая', status='pub', week=get_last_day_week())
+    archived = Voice.objects.create(history=old, user=self.staff)
+    hot = Voice.objects.create(history=fresh, user=self.staff)
+    analytics.rollup(now=timezone.now() + datetime.timedelta(hours=1))
+    cold_storage.move_voices(cold_storage.cutoff_week())
+    self.assertFalse(Voice.objects.filter(pk=archived.pk).exists())
+
+    response = self.get('/api/v1/export/voices/')
+    lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()[1:]
+    self.assertEqual([line.split(',')[:2] for line in lines], [[str(archived.pk), str(old.pk)], [str(hot.pk), str(fresh.pk)]])
+    self.assertIn('staff@example.com', lines[0])
+
+    response = self.get('/api/v1/export/voices/?week=%s' % old_week.isoformat())
+    lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()[1:]
+    self.assertEqual([line.split(',')[0] for line in lines], [str(archived.pk)])
+
+  def test_staff_only(self):
+    user = User.objects.create_user('user', 'user@example.com', 'password')
+    self.assertEqual(self.get('/api/v1/export/profiles/', user).status_code, 403)
+    self.assertEqual(self.get('/api/v1/export/unknown/').status_code, 404)
+
+class IdempotencyTest(TestCase):
+  """Повтор POST с Idempotency-Key отдаёт сохранённый ответ"""
+
+  def setUp(self):
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    self.history = History.objects.create(user=author, desc='История', status='pub', week=get_last_day_week())
+    self.voter = User.objects.create_user('voter', 'voter@example.com', 'password')
+    self.client = APIClient()
+    self.client.force_authenticate(self.voter)
+
+  def vote(self, key):
+    return self.client.post('/api/v1/voice/', {'history': self.history.pk}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+  def test_retry_replays_stored_response(self):
+    first = self.vote('retry-1')
+    with CaptureQueriesContext(connection) as context:
+      second = self.vote('retry-1')
+
+    self.assertEqual(first.status_code, 200)
+    self.assertEqual(second.content, first.content)
+    self.assertEqual(second['Idempotent-Replayed'], 'true')
+    self.assertEqual(write_queries(context), [])
+    self.assertEqual(Voice.objects.filter(user=self.voter).count(), 1)
+
+  def test_key_reused_for_other_endpoint(self):
+    self.vote('retry-2')
+    response = self.client.post('/api/v1/history/', {}, format='json', HTTP_IDEMPOTENCY_KEY='retry-2')
+    self.assertEqual(response.status_code, 400)
+
+  def test_concurrent_duplicate_gets_conflict(self):
+    IdempotencyKey.objects.create(user=self.voter, scope='voice', key='retry-3', path='/api/v1/voice/')
+
+    with mock.patch.dict(idempotency.IDEMPOTENCY, {'WAIT': 0}):
+      response = self.vote('retry-3')
+
+    self.assertEqual(response.status_code, 409)
+    self.assertFalse(Voice.objects.exists())
+
+  def test_key_reused_with_other_body(self):
+    other = History.objects.create(user=self.history.user, desc='Другая', status='pub', week=self.history.week)
+    self.vote('retry-4')
+
+    response = self.client.post('/api/v1/voice/', {'history': other.pk}, format='json', HTTP_IDEMPOTENCY_KEY='retry-4')
+
+    self.assertEqual(response.status_code, 422)
+    self.assertEqual(Voice.objects.filter(user=self.voter).count(), 1)
+
+  def async_vote(self, key, history):
+    import json
+    from asgiref.sync import async_to_sync
+    from django.test import RequestFactory
+    from . import async_views
+
+    request = RequestFactory().post(
+      '/api/v1/voice/', json.dumps({'history': history.pk}), content_type='application/json',
+      HTTP_IDEMPOTENCY_KEY=key, HTTP_AUTHORIZATION='Token %s' % Token.objects.get_or_create(user=self.voter)[0].key,
+    )
+    return async_to_sync(async_views.add_voice)(request)
+
+  def test_async_duplicate_waits_without_blocking(self):
+    IdempotencyKey.objects.create(user=self.voter, scope='voice', key='retry-5', path='/api/v1/voice/')
+
+    with mock.patch.dict(idempotency.IDEMPOTENCY, {'WAIT': 0.05, 'POLL_INTERVAL': 0.02}), \
+        mock.patch.object(idempotency.time, 'sleep') as blocking_sleep, \
+        mock.patch.object(idempotency.asyncio, 'sleep', wraps=idempotency.asyncio.sleep) as async_sleep:
+      response = self.async_vote('retry-5', self.history)
+
+    self.assertEqual(response.status_code, 409)
+    # time.sleep зовёт и сам asgiref, но не с интервалом опроса
+    self.assertNotIn(mock.call(0.02), blocking_sleep.call_args_list)
+    self.assertTrue(async_sleep.called)
+
+  def test_async_key_reused_with_other_body(self):
+    other = History.objects.create(user=self.history.user, desc='Другая', status='pub', week=self.history.week)
+    self.assertEqual(self.async_vote('retry-6', self.history).status_code, 200)
+
+    self.assertEqual(self.async_vote('retry-6', other).status_code, 422)
+    self.assertEqual(Voice.objects.filter(user=self.voter).count(), 1)
+
+  def test_upload_over_memory_limit(self):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    use_temp_media(self)
+    Profile.objects.create(user=self.voter, first_name='Пётр', surname='Петров')
+    photo = png_bytes(size=(1000, 1000))
+
+    def post(key, color=None):
+      image = photo if color is None else png_bytes(color, size=(1000, 1000))
+      return self.client.post('/api/v1/history/', {
+        'desc': 'История', 'yearBefore': 1990,
+        'imageBefore': SimpleUploadedFile('before.png', image, 'image/png'),
+      }, format='multipart', HTTP_IDEMPOTENCY_KEY=key)
+
+    # тело запроса больше лимита, который Django готов держать в памяти
+    with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=len(photo) // 2):
+      first = post('upload-1')
+      second = post('upload-1')
+      other = post('upload-1', 'blue')
+
+    self.assertEqual(first.status_code, 200)
+    self.assertEqual(second.content, first.content)
+    self.assertEqual(second['Idempotent-Replayed'], 'true')
+    self.assertEqual(other.status_code, 422)
+    self.assertEqual(History.objects.filter(user=self.voter).count(), 1)
+
+class ColdStorageTest(TestCase):
+  """Перенос закрытых недель в архивные таблицы не меняет счётчики"""
+
+  def setUp(self):
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    old_week = cold_storage.cutoff_week() - datetime.timedelta(weeks=1)
+    self.history = History.objects.create(user=author, desc='Старая', status='pub', week=old_week)
+    self.rejected = History.objects.create(user=author, desc='Отклонена', status='reject', week=old_week)
+    self.voters = [User.objects.create_user('voter%d' % index, 'v%d@example.com' % index, 'password') for index in range(3)]
+    for voter in self.voters:
+      Profile.objects.create(user=voter, first_name='Голос', surname='Голосов', city='Москва')
+      Voice.objects.create(history=self.history, user=voter)
+    Voice.objects.create(history=self.rejected, user=self.voters[0])
+    analytics.rollup(now=timezone.now() + datetime.timedelta(hours=1))
+
+  def test_voices_move_and_counts_stay(self):
+    moved = cold_storage.move_voices(cold_storage.cutoff_week(), batch_size=2)
+
+    self.assertEqual(moved, 4)
+    self.assertFalse(Voice.objects.exists())
+    self.assertEqual(ArchivedVoice.objects.count(), 4)
+
+    client = APIClient()
+    client.force_authenticate(self.voters[0])
+    response = client.get('/api/v1/history/%d' % self.history.pk)
+    self.assertEqual(response.data['voices'], 3)
+    self.assertTrue(response.data['voted'])
+
+    # повторный голос за архивную историю не добавляется
+    client.post('/api/v1/voice/', {'history': self.history.pk}, format='json')
+    self.assertFalse(Voice.objects.exists())
+
+  def test_rebuild_keeps_archived_voices(self):
+    cold_storage.move_voices(cold_storage.cutoff_week())
+
+    analytics.rebuild()
+
+    rows = WeeklyVotes.objects.filter(history=self.history)
+    self.assertEqual(sum(row.votes for row in rows), 3)
+    self.assertEqual({row.city for row in rows}, {'Москва'})
+
+  def test_voices_after_watermark_stay(self):
+    moment = timezone.now() - datetime.timedelta(days=1)
+    Voice.objects.update(created_at=moment)
+    first, *rest = Voice.objects.order_by('pk').values_list('pk', flat=True)
+    # позиция на первом из голосов с одинаковым created_at
+    RollupWatermark.objects.filter(name=analytics.WATERMARK).update(created_at=moment, last_id=first)
+
+    self.assertEqual(cold_storage.move_voices(cold_storage.cutoff_week()), 1)
+    self.assertEqual(set(Voice.objects.values_list('pk', flat=True)), set(rest))
+
+  def test_rejected_histories_move(self):
+    cold_storage.move_voices(cold_storage.cutoff_week())
+    moved = cold_storage.move_rejected(cold_storage.cutoff_week())
+
+    self.assertEqual(moved, 1)
+    self.assertFalse(History.objects.filter(pk=self.rejected.pk).exists())
+    self.assertEqual(ArchivedHistory.objects.get(pk=self.rejected.pk).voices, 1)
+    self.assertEqual(len(cold_storage.history_voices(self.history.pk)), 3)
+
+class ColdStorageMediaTest(TransactionTestCase):
+  """Файлы архивных историй не освобождаются и не собираются gc_media"""
+  # on_commit выполняется сразу: удаление Image действительно освобождает файл
+
+  def setUp(self):
+    weeks.clear()
+    use_temp_media(self)
+
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    old_week = cold_storage.cutoff_week() - datetime.timedelta(weeks=1)
+    self.history = History.objects.create(user=author, desc='Отклонена', status='reject', week=old_week)
+
+  def media_file(self, name, content):
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+      f.write(content)
+    # старше любого льготного периода
+    os.utime(path, (0, 0))
+    return path
+
+  def test_archived_files_survive_gc(self):
+    from django.core.files.base import ContentFile
+    from django.core.management import call_command
+
+    stored = Image(history=self.history)
+    stored.image.save('before.png', ContentFile(png_bytes()))
+    hashed = stored.image.path
+    os.utime(hashed, (0, 0))
+    # файл, сохранённый до учёта ссылок, без строки StoredFile
+    legacy = self.media_file('images/legacy.jpg', b'legacy')
+    Image.objects.create(history=self.history, image='images/legacy.jpg')
+    orphan = self.media_file('images/orphan.jpg', b'orphan')
+
+    self.assertEqual(cold_storage.move_rejected(cold_storage.cutoff_week()), 1)
+    self.assertFalse(Image.objects.exists())
+    call_command('gc_media', grace_hours=0, stdout=open(os.devnull, 'w'))
+
+    self.assertTrue(os.path.exists(hashed))
+    self.assertTrue(os.path.exists(legacy))
+    self.assertFalse(os.path.exists(orphan))
+    names = {image['image'] for image in ArchivedHistory.objects.get(pk=self.history.pk).images}
+    self.assertEqual(names, {stored.image.name, 'images/legacy.jpg'})
+
+class WeekCalendarTest(TestCase):
+  """Неделя конкурса назначается по календарю, а не по дате запуска процесса"""
+
+  def setUp(self):
+    self.user = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=self.user, first_name='Иван', surname='Иванов')
+
+  def test_bounds(self):
+    week = weeks.for_day(datetime.date(2020, 10, 4))
+
+    self.assertEqual(week.start, timezone.make_aware(datetime.datetime(2020, 9, 28)))
+    self.assertEqual(week.end, timezone.make_aware(datetime.datetime(2020, 10, 5)))
+    self.assertEqual(weeks.for_date(datetime.date(2020, 9, 30)), week)
+
+  def test_current_week_follows_clock(self):
+    monday = timezone.make_aware(datetime.datetime(2020, 10, 5, 0, 0))
+
+    self.assertEqual(weeks.current(monday - datetime.timedelta(seconds=1)).day, datetime.date(2020, 10, 4))
+    self.assertEqual(weeks.current(monday).day, datetime.date(2020, 10, 11))
+
+  def test_rows_link_to_week(self):
+    history = History.objects.create(user=self.user, desc='История', status='pub', week=datetime.date(2020, 10, 4))
+    voter = User.objects.create_user('voter', 'voter@example.com', 'password')
+    voice = Voice.objects.create(history=history, user=voter)
+
+    self.assertEqual(history.contest_week.day, datetime.date(2020, 10, 4))
+    self.assertEqual(voice.contest_week_id, history.contest_week_id)
+
+    response = APIClient().get('/api/v1/history/', {'week': '2020-10-04'})
+    self.assertEqual([row['id'] for row in response.data['results']], [history.pk])
+    response = APIClient().get('/api/v1/history/', {'week': '2020-10-11'})
+    self.assertEqual(response.data['results'], [])
+
+class FeedExportTest(TestCase):
+  """Потоковая выгрузка ленты и ограничение limit у обычной ленты"""
+
+  def setUp(self):
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    self.histories = [
+      History.objects.create(user=author, desc='История %d' % index, status='pub', week=get_last_day_week())
+      for index in range(5)
+    ]
+    History.objects.create(user=author, desc='На модерации', status='mod', week=get_last_day_week())
+    Voice.objects.create(history=self.histories[0], user=User.objects.create_user('voter', 'v@example.com', 'password'))
+    self.client = APIClient()
+    self.client.force_authenticate(author)
+
+  def export(self, **params):
+    import orjson
+
+    response = self.client.get('/api/v1/history/export/', params)
+    self.assertTrue(response.streaming)
+    return [orjson.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+  def test_matches_feed_format(self):
+    rows = self.export()
+    feed = self.client.get('/api/v1/history/', {'limit': 10}).data['results']
+
+    self.assertEqual([row['id'] for row in rows], [history.pk for history in self.histories])
+    self.assertEqual(rows[0]['voices'], 1)
+    expected = {key: value for key, value in feed[-1].items() if key != 'voted'}
+    expected['week'] = str(expected['week'])
+    self.assertEqual(rows[0], expected)
+
+  def test_resume_after_id_in_chunks(self):
+    with mock.patch.dict(exports.FEED_EXPORT, {'CHUNK_SIZE': 2}):
+      first = self.export(limit=3)
+      rest = self.export(after=first[-1]['id'])
+
+    self.assertEqual([row['id'] for row in first + rest], [history.pk for history in self.histories])
+
+  def test_feed_limit_is_capped(self):
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    request = Request(APIRequestFactory().get('/api/v1/history/', {'limit': 100000}))
+    self.assertEqual(FeedPagination().get_limit(request), FeedPagination.max_limit)
+    self.assertEqual(self.client.get('/api/v1/history/export/', {'after': 'x'}).status_code, 400)
+
+def png_bytes(color='red', size=(40, 30)):
+  from io import BytesIO
+  from PIL import Image as PILImage
+
+  buffer = BytesIO()
+  PILImage.new('RGB', size, color).save(buffer, 'PNG')
+  return buffer.getvalue()
+
+def use_temp_media(test):
+  """Отдельный MEDIA_ROOT на время теста"""
+  import shutil
+  import tempfile
+
+  root = tempfile.mkdtemp()
+  test.addCleanup(shutil.rmtree, root, True)
+  media = override_settings(MEDIA_ROOT=root)
+  media.enable()
+  test.addCleanup(media.disable)
+  return root
+
+class StagedUploadConsumeTest(TestCase):
+  """Предзагрузка используется ровно один раз и не отдаётся как медиа"""
+
+  def setUp(self):
+    self.user = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=self.user, first_name='Иван', surname='Иванов')
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+
+  def stage(self, color='red'):
+    response = self.client.post('/api/v1/upload/', png_bytes(color), content_type='image/png')
+    self.assertEqual(response.status_code, 201)
+    return str(response.data['id'])
+
+  def create(self, before, after):
+    return self.client.post('/api/v1/history/', {
+      'desc': 'История', 'uploadBefore': before, 'uploadAfter': after, 'yearBefore': 1990, 'yearAfter': 2020,
+    }, format='json')
+
+  def test_same_upload_twice_is_rejected(self):
+    upload = self.stage()
+
+    response = self.create(upload, upload)
+
+    self.assertEqual(response.status_code, 400)
+    self.assertFalse(History.objects.exists())
+    self.assertFalse(Image.objects.exists())
+    self.assertTrue(StagedUpload.objects.filter(pk=upload).exists())
+
+  def test_consumed_upload_cannot_be_reused(self):
+    before, after = self.stage('red'), self.stage('blue')
+    self.assertEqual(self.create(before, after).status_code, 200)
+
+    response = self.create(before, self.stage('green'))
+
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(History.objects.count(), 1)
+    self.assertEqual(Image.objects.count(), 2)
+
+  def test_invalid_year_keeps_uploads(self):
+    before, after = self.stage('red'), self.stage('blue')
+
+    response = self.client.post('/api/v1/history/', {
+      'desc': 'История', 'uploadBefore': before, 'uploadAfter': after, 'yearBefore': 1990, 'yearAfter': 'abc',
+    }, format='json')
+
+    self.assertEqual(response.status_code, 400)
+    self.assertIn('yearAfter', response.data)
+    self.assertEqual(self.create(before, after).status_code, 200)
+
+  def test_failed_save_keeps_uploads(self):
+    from rest_framework.exceptions import ValidationError
+
+    before, after = self.stage('red'), self.stage('blue')
+    paths = [staging.upload_path(upload) for upload in StagedUpload.objects.all()]
+
+    # ошибка уже после переноса обеих предзагрузок
+    with mock.patch('histories.serializers.images.derive_orientation', side_effect=ValidationError('Сбой')):
+      self.assertEqual(self.create(before, after).status_code, 400)
+
+    self.assertEqual(StagedUpload.objects.count(), 2)
+    self.assertTrue(all(os.path.exists(path) for path in paths))
+    self.assertEqual(self.create(before, after).status_code, 200)
+    self.assertEqual(Image.objects.count(), 2)
+
+  def test_consume_claims_upload_once(self):
+    from rest_framework.exceptions import ValidationError
+
+    upload = StagedUpload.objects.get(pk=self.stage())
+    # второй запрос успел загрузить ту же запись до удаления первым
+    stale = StagedUpload.objects.get(pk=upload.pk)
+
+    staging.consume(upload, 'images/before.png')
+    with self.assertRaises(ValidationError):
+      staging.consume(stale, 'images/after.png')
+
+  def test_staged_files_are_outside_media(self):
+    upload = StagedUpload.objects.get(pk=self.stage())
+    path = staging.upload_path(upload)
+
+    self.assertTrue(os.path.exists(path))
+    self.assertFalse(os.path.abspath(path).startswith(os.path.abspath(settings.MEDIA_ROOT) + os.sep))
+    self.assertEqual(self.client.get('/media/staging/%s' % upload.file).status_code, 404)
+
+class StagedUploadCommitTest(TransactionTestCase):
+  """Файл предзагрузки удаляется только после коммита истории"""
+
+  def test_staged_file_removed_on_commit(self):
+    weeks.clear()
+    use_temp_media(self)
+    user = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=user, first_name='Иван', surname='Иванов')
+    client = APIClient()
+    client.force_authenticate(user)
+
+    upload = client.post('/api/v1/upload/', png_bytes(), content_type='image/png').data['id']
+    path = staging.upload_path(StagedUpload.objects.get(pk=upload))
+
+    response = client.post('/api/v1/history/', {'desc': 'История', 'uploadBefore': str(upload)}, format='json')
+
+    self.assertEqual(response.status_code, 200)
+    self.assertFalse(os.path.exists(path))
+    image = Image.objects.get()
+    self.assertTrue(os.path.exists(image.image.path))
+
+class SchemaDocsTest(TestCase):
+  """Схема на лету собирается только для персонала, страницы документации - только HTML"""
+
+  def setUp(self):
+    import tempfile
+    from st_remy import yasg
+
+    root = tempfile.mkdtemp()
+    patcher = mock.patch.dict(yasg.SCHEMA, ROOT=root)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.addCleanup(os.rmdir, root)
+
+    staff = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+    self.token = Token.objects.create(user=staff).key
+
+  def test_ui_pages_do_not_serve_spec(self):
+    client = APIClient()
+    for url in ('/swagger/', '/redoc/'):
+      self.assertEqual(client.get(url).status_code, 200)
+      self.assertEqual(client.get(url, {'format': 'openapi'}).status_code, 404)
+
+  def test_token_staff_gets_live_schema(self):
+    from django.test import RequestFactory
+    from django.contrib.auth.models import AnonymousUser
+    from st_remy import yasg
+
+    # схема не собрана: аноним получает 404, персонал по токену - схему на лету
+    self.assertEqual(APIClient().get('/swagger.json').status_code, 404)
+    response = APIClient().get('/swagger.json', HTTP_AUTHORIZATION='Token %s' % self.token)
+    self.assertEqual(response.status_code, 200)
+
+    request = RequestFactory().get('/swagger.json', {'live': 1}, HTTP_AUTHORIZATION='Token %s' % self.token)
+    request.user = AnonymousUser()
+    self.assertTrue(yasg.is_live(request))
+    request = RequestFactory().get('/swagger.json', {'live': 1}, HTTP_AUTHORIZATION='Token invalid')
+    request.user = AnonymousUser()
+    self.assertFalse(yasg.is_live(request))
+
+class StoredFileRefsTest(TransactionTestCase):
+  """Файл удаляется с последней ссылкой, проверка и запись ссылки - под блокировкой строки"""
+  # on_commit выполняется сразу: удаление Image действительно освобождает файл
+
+  def setUp(self):
+    from django.core.files.base import ContentFile
+
+    weeks.clear()
+    use_temp_media(self)
+    self.content = ContentFile(png_bytes())
+
+  def save(self):
+    image = Image(date=2020)
+    image.image.save('photo.png', self.content)
+    return image
+
+  def test_last_release_deletes_file(self):
+    first, second = self.save(), self.save()
+    self.assertEqual(first.image.name, second.image.name)
+    self.assertEqual(StoredFile.objects.get(name=first.image.name).refs, 2)
+
+    first.delete()
+    self.assertTrue(os.path.exists(second.image.path))
+    second.delete()
+    self.assertFalse(os.path.exists(second.image.path))
+    self.assertFalse(StoredFile.objects.exists())
+
+    # тот же файл после удаления записывается заново
+    third = self.save()
+    self.assertTrue(os.path.exists(third.image.path))
+    self.assertEqual(StoredFile.objects.get(name=third.image.name).refs, 1)
+
+  def test_legacy_file_is_registered(self):
+    path = os.path.join(settings.MEDIA_ROOT, 'images', 'legacy.jpg')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+      f.write(b'legacy')
+    first, second = [Image.objects.create(image='images/legacy.jpg') for _ in range(2)]
+
+    first.delete()
+    self.assertTrue(os.path.exists(path))
+    self.assertEqual(StoredFile.objects.get(name='images/legacy.jpg').refs, 1)
+    second.delete()
+    self.assertFalse(os.path.exists(path))
+
+  def test_save_and_release_lock_row(self):
+    from django.db.models import QuerySet
+
+    with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=QuerySet.select_for_update) as lock:
+      image = self.save()
+      self.assertTrue(lock.called)
+      lock.reset_mock()
+      image.delete()
+      self.assertTrue(lock.called)
+
+class WeekDeadlineTest(TransactionTestCase):
+  """После дедлайна недели истории не принимаются, правка дедлайна доходит до кэша"""
+  # on_commit выполняется сразу, поэтому недели действительно кэшируются
+
+  def setUp(self):
+    weeks.clear()
+    self.addCleanup(weeks.clear)
+    user = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=user, first_name='Иван', surname='Иванов')
+    self.client = APIClient()
+    self.client.force_authenticate(user)
+
+  def create(self):
+    uploads = [
+      str(self.client.post('/api/v1/upload/', png_bytes(color), content_type='image/png').data['id'])
+      for color in ('red', 'blue')
+    ]
+    return self.client.post('/api/v1/history/', {
+      'desc': 'История', 'uploadBefore': uploads[0], 'uploadAfter': uploads[1], 'yearBefore': 1990, 'yearAfter': 2020,
+    }, format='json')
+
+  def close_week(self):
+    Week.objects.filter(day=weeks.current().day).update(deadline=timezone.now() - datetime.timedelta(hours=1))
+
+  def test_closed_week_rejects_histories(self):
+    with mock.patch.dict(weeks.WEEKS, {'CACHE_TTL': 0}):
+      self.assertEqual(self.create().status_code, 200)
+      self.close_week()
+
+      response = self.create()
+
+    self.assertEqual(response.status_code, 400)
+    self.assertIn('message', response.data)
+    self.assertEqual(History.objects.count(), 1)
+
+  def test_cached_week_expires(self):
+    self.assertTrue(weeks.is_open(weeks.current()))
+    self.close_week()
+    # в памяти процесса - старый дедлайн, пока не истёк CACHE_TTL
+    self.assertTrue(weeks.is_open(weeks.current()))
+
+    with mock.patch.object(weeks.time, 'monotonic', return_value=time.monotonic() + weeks.WEEKS['CACHE_TTL'] + 1):
+      self.assertFalse(weeks.is_open(weeks.current()))
+
+  def test_admin_edit_resets_local_cache(self):
+    week = Week.objects.get(day=weeks.current().day)
+    week.deadline = timezone.now() - datetime.timedelta(hours=1)
+    week.save()
+
+    self.assertFalse(weeks.is_open(weeks.current()))
+
+class PrincipalCacheTest(TransactionTestCase):
+  """Инвалидация пользователя в одном процессе видна локальному кэшу другого"""
+
+  def setUp(self):
+    from django.core.cache import cache
+
+    cache.clear()
+    self.addCleanup(cache.clear)
+    principal_cache.clear_local()
+    self.addCleanup(principal_cache.clear_local)
+
+  def test_delete_reaches_other_process(self):
+    # два воркера: своя память, общий кэш Django
+    first, second = [PrincipalCache(10, 30, 300, 'test-auth') for _ in range(2)]
+    first.set('test-auth:user:1', 'old')
+    self.assertEqual(second.get('test-auth:user:1'), 'old')
+
+    first.delete('test-auth:user:1')
+    self.assertIsNone(second.get('test-auth:user:1'))
+
+    first.set('test-auth:user:1', 'new')
+    self.assertEqual(second.get('test-auth:user:1'), 'new')
+
+  def test_deactivated_user_loses_access(self):
+    user = User.objects.create_user('member', 'member@example.com', 'password', is_staff=True)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token %s' % Token.objects.create(user=user).key)
+    self.assertEqual(client.get('/api/v1/analytics/top/').status_code, 200)
+
+    user.is_active = False
+    user.save()
+
+    self.assertEqual(client.get('/api/v1/analytics/top/').status_code, 401)
+
+  def test_invalidated_on_commit(self):
+    from django.db import transaction
+    from .authentication import token_cache_key
+
+    user = User.objects.create_user('member', 'member@example.com', 'password', is_staff=True)
+    token = Token.objects.create(user=user).key
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token %s' % token)
+    client.get('/api/v1/analytics/top/')
+
+    with transaction.atomic():
+      user.is_active = False
+      user.save()
+      # до коммита другой запрос закэшировал бы ещё активного пользователя заново
+      self.assertIsNotNone(principal_cache.get(token_cache_key(token)))
+    self.assertIsNone(principal_cache.get(token_cache_key(token)))
+
+class TrendingCursorTest(TestCase):
+  """Курсор рейтинга переживает затухание между страницами"""
+
+  def setUp(self):
+    from django.core.cache import cache
+
+    cache.clear()
+    self.addCleanup(cache.clear)
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    self.ids = [
+      History.objects.create(user=author, desc='История %d' % score, status='pub', week=get_last_day_week(), score=score / 3).pk
+      for score in (5, 4, 3, 2, 1)
+    ]
+
+  def page(self, url, params=None):
+    response = APIClient().get(url, params)
+    self.assertEqual(response.status_code, 200)
+    return [item['id'] for item in response.data['results']], response.data['next']
+
+  def test_pages_after_decay(self):
+    from django.core.cache import cache
+    from . import trending
+
+    seen, url = self.page('/api/v1/history/', {'ordering': 'trending', 'limit': 2})
+    with mock.patch.dict(trending.TRENDING, {'HALF_LIFE_HOURS': 2}):
+      while url:
+        for _ in range(3):
+          trending.decay()
+        # следующую страницу отдаёт другой воркер со своим локальным кэшем
+        cache.clear()
+        ids, url = self.page(url)
+        seen += ids
+
+    self.assertEqual(seen, self.ids)
+
+  def test_invalid_cursor(self):
+    response = APIClient().get('/api/v1/history/', {'ordering': 'trending', 'cursor': 'bm9wZQ=='})
+    self.assertEqual(response.status_code, 404)
+
+class BucketThrottleTest(TestCase):
+  """Лимит пополняется равномерно, а не всем окном сразу"""
+
+  def setUp(self):
+    from types import SimpleNamespace
+    from django.core.cache import caches
+    from rest_framework.request import Request
+    from rest_framework.settings import api_settings
+    from rest_framework.test import APIRequestFactory
+
+    caches['throttle'].clear()
+    self.addCleanup(caches['throttle'].clear)
+    rates = mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, {'test': '3/min'})
+    rates.start()
+    self.addCleanup(rates.stop)
+
+    self.request = Request(APIRequestFactory().get('/'))
+    self.request.user = User.objects.create_user('client', 'client@example.com', 'password')
+    self.view = SimpleNamespace(throttle_scope='test')
+    self.now = 0
+
+  def allowed(self, at):
+    from .throttling import UserBucketThrottle
+
+    self.now = at
+    throttle = UserBucketThrottle()
+    throttle.timer = lambda: self.now
+    result = throttle.allow_request(self.request, self.view)
+    self.wait = None if result else throttle.wait()
+    return result
+
+  def test_limit_refills_gradually(self):
+    self.assertEqual([self.allowed(1000) for _ in range(4)], [True, True, True, False])
+    # место освободится, когда прошлое окно уйдёт на треть
+    self.assertAlmostEqual(self.wait, 40)
+
+    self.assertFalse(self.allowed(1039))
+    self.assertTrue(self.allowed(1040))
+    self.assertFalse(self.allowed(1040))
+
+    # за долгий простой копится не больше лимита
+    self.assertEqual([self.allowed(5000) for _ in range(4)], [True, True, True, False])
+
+  def test_no_burst_at_window_boundary(self):
+    self.assertEqual([self.allowed(59) for _ in range(3)], [True, True, True])
+    # при фиксированном окне здесь снова были бы доступны все три запроса
+    self.assertFalse(self.allowed(61))
+
+  def test_concurrent_requests_are_not_rejected(self):
+    import threading
+    from rest_framework.settings import api_settings
+
+    api_settings.DEFAULT_THROTTLE_RATES['test'] = '20/min'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(self.allowed(1000))) for _ in range(20)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    # блокировок нет: клиенты за одним IP упираются только в сам лимит
+    self.assertEqual(results, [True] * 20)
+    self.assertFalse(self.allowed(1000))
+
+  def test_deploy_check_requires_shared_cache(self):
+    from .checks import check_shared_caches
+
+    self.assertEqual({error.id for error in check_shared_caches(None)}, {'histories.W001'})
+
+class AsyncViewsTest(TestCase):
+  """Async-вьюхи не ходят в кэш из event loop"""
+
+  def setUp(self):
+    from django.core.cache import cache
+
+    cache.clear()
+    self.addCleanup(cache.clear)
+    author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=author, first_name='Иван', surname='Иванов')
+    self.history = History.objects.create(user=author, desc='История', status='pub', week=get_last_day_week())
+    self.voter = User.objects.create_user('voter', 'voter@example.com', 'password')
+    self.calls = []
+
+  def record(self, name, func):
+    import asyncio
+
+    def wrapper(*args, **kwargs):
+      try:
+        asyncio.get_running_loop()
+        self.calls.append((name, 'loop'))
+      except RuntimeError:
+        self.calls.append((name, 'thread'))
+      return func(*args, **kwargs)
+    return wrapper
+
+  def test_cache_calls_leave_event_loop(self):
+    import json
+    from asgiref.sync import async_to_sync
+    from django.test import RequestFactory
+    from .response_cache import response_cache
+    from .throttling import BucketThrottle
+    from . import async_views
+
+    factory = RequestFactory()
+    with mock.patch.object(response_cache, 'get_entry', self.record('get_entry', response_cache.get_entry)), \
+        mock.patch.object(principal_cache, 'get', self.record('principal', principal_cache.get)), \
+        mock.patch.object(BucketThrottle, 'allow_request', self.record('throttle', BucketThrottle.allow_request)):
+      for _ in range(2):
+        response = async_to_sync(async_views.history_list)(factory.get('/api/v1/history/'))
+        self.assertEqual(response.status_code, 200)
+      self.assertEqual(response['X-Cache'], 'HIT')
+
+      request = factory.post(
+        '/api/v1/voice/', json.dumps({'history': self.history.pk}), content_type='application/json',
+        HTTP_AUTHORIZATION='Token %s' % Token.objects.create(user=self.voter).key,
+      )
+      self.assertEqual(async_to_sync(async_views.add_voice)(request).status_code, 200)
+
+    self.assertEqual({name for name, _ in self.calls}, {'get_entry', 'principal', 'throttle'})
+    self.assertNotIn('loop', {where for _, where in self.calls})
+
+class BackfillImageMetadataTest(TransactionTestCase):
+  """Слишком большое изображение пропускается, остальные обрабатываются"""
+
+  def setUp(self):
+    weeks.clear()
+    use_temp_media(self)
+
+  def test_decompression_bomb_is_skipped(self):
+    from django.core.files.base import ContentFile
+    from django.core.management import call_command
+    from PIL import Image as PILImage
+
+    small, large = Image(date=2020), Image(date=2020)
+    small.image.save('small.png', ContentFile(png_bytes(size=(5, 5))))
+    large.image.save('large.png', ContentFile(png_bytes(size=(40, 30))))
+
+    # 40x30 больше двойного лимита - Pillow бросает DecompressionBombError
+    with mock.patch.object(PILImage, 'MAX_IMAGE_PIXELS', 100):
+      call_command('backfill_image_metadata', workers=1, stdout=open(os.devnull, 'w'))
+
+    self.assertEqual(Image.objects.get(pk=small.pk).width, 5)
+    self.assertIsNone(Image.objects.get(pk=large.pk).width)
+
+class FrozenWeekRedirectTest(TestCase):
+  """На архив недели уходят только запросы всей недели целиком"""
+
+  def setUp(self):
+    from .models import FrozenWeek
+
+    self.week = '2020-10-04'
+    FrozenWeek.objects.create(week=datetime.date(2020, 10, 4))
+
+  def test_whole_week_redirects(self):
+    for url, name in (('/api/v1/history/', 'histories'), ('/api/v1/winner/', 'winners')):
+      response = APIClient().get(url, {'week': self.week})
+      self.assertEqual(response.status_code, 302)
+      self.assertTrue(response['Location'].endswith('/archive/%s/%s.json' % (self.week, name)))
+
+  def test_pages_and_ordering_are_live(self):
+    for params in ({'limit': 10}, {'offset': 10}, {'ordering': 'trending'}):
+      response = APIClient().get('/api/v1/history/', dict(params, week=self.week))
+      self.assertEqual(response.status_code, 200, params)
+    self.assertEqual(APIClient().get('/api/v1/winner/', {'week': self.week, 'limit': 5}).status_code, 200)
+
+class FreezeWeeksTest(TestCase):
+  """freeze_weeks без аргументов замораживает все закрытые недели"""
+
+  def test_pending_weeks(self):
+    import json
+    from io import StringIO
+    from django.core.management import call_command
+    from . import archive
+    from .models import FrozenWeek
+
+    user = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=user, first_name='Иван', surname='Иванов')
+    history = History.objects.create(user=user, desc='Старая', status='pub', week=datetime.date(2020, 10, 4))
+    history.img_after = Image.objects.create(history=history, image='images/after.jpg', status='pub', date=2020)
+    history.save()
+    History.objects.create(user=user, desc='Текущая', status='pub', week=weeks.current().day)
+
+    root = os.path.join(use_temp_media(self), 'archive')
+    with mock.patch.dict(archive.ARCHIVE, ROOT=root):
+      call_command('freeze_weeks', stdout=StringIO())
+
+    self.assertEqual(list(FrozenWeek.objects.values_list('week', flat=True)), [datetime.date(2020, 10, 4)])
+    with open(os.path.join(root, '2020-10-04', 'histories.json'), 'rb') as f:
+      frozen = json.loads(f.read())
+    # путь без хоста: архив одинаков для всех зеркал
+    self.assertEqual(frozen['results'][0]['img_after']['image'], '/media/images/after.jpg')
+    self.assertEqual(archive.pending_weeks(), [])
+
+class SearchTest(TestCase):
+  """Полнотекстовый поиск по описанию: совпадение, релевантность, переиндексация"""
+
+  def setUp(self):
+    from django.core.cache import cache
+
+    cache.clear()
+    self.addCleanup(cache.clear)
+    self.author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=self.author, first_name='Иван', surname='Иванов')
+
+  def create(self, desc):
+    return History.objects.create(user=self.author, desc=desc, status='pub', week=get_last_day_week()).pk
+
+  def search(self, query):
+    response = APIClient().get('/api/v1/history/search/', {'q': query})
+    self.assertEqual(response.status_code, 200)
+    return [item['id'] for item in response.data['results']]
+
+  def test_match_and_prefix(self):
+    house = self.create('Старый дом у реки')
+    new_house = self.create('Новый дом')
+    river = self.create('Река и лес')
+
+    self.assertEqual(set(self.search('дом')), {house, new_house})
+    self.assertEqual(set(self.search('ре')), {house, river})
+    self.assertEqual(self.search('дом реки'), [house])
+    self.assertEqual(self.search('!!!'), [])
+
+  def test_ranking(self):
+    weak = self.create('Дом, сад, лес, поле, река и старая мельница')
+    strong = self.create('Дом, дом, родной дом')
+
+    self.assertEqual(self.search('дом'), [strong, weak])
+
+  def test_edit_updates_index(self):
+    pk = self.create('Старый вокзал')
+    history = History.objects.get(pk=pk)
+    history.desc = 'Новый мост'
+    history.save()
+
+    self.assertEqual(self.search('вокзал'), [])
+    self.assertEqual(self.search('мост'), [pk])
+
+  def test_reindex_command(self):
+    from django.core.management import call_command
+    from . import search
+
+    pk = self.create('Старая площадь')
+    if connection.vendor == 'sqlite':
+      # индекс разошёлся с таблицей
+      with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO %s(%s) VALUES ('delete-all')" % (search.FTS_TABLE, search.FTS_TABLE))
+      self.assertEqual(self.search('площадь'), [])
+
+    call_command('reindex_histories', stdout=open(os.devnull, 'w'))
+
+    self.assertEqual(self.search('площадь'), [pk])
+
+  def test_post_migrate_restores_triggers(self):
+    from django.core.management.sql import emit_post_migrate_signal
+    from . import search
+
+    if connection.vendor != 'sqlite':
+      self.skipTest('триггеры FTS есть только в sqlite')
+
+    before = self.create('Старая мельница')
+    # так триггеры пропадают, когда миграция пересоздаёт таблицу
+    with connection.cursor() as cursor:
+      for suffix in ('ai', 'ad', 'au'):
+        cursor.execute('DROP TRIGGER %s_%s' % (search.FTS_TABLE, suffix))
+    during = self.create('Новая мельница')
+    self.assertEqual(self.search('мельница'), [before])
+
+    emit_post_migrate_signal(0, False, connection.alias)
+
+    self.assertEqual(set(self.search('мельница')), {before, during})
+    after = self.create('Третья мельница')
+    self.assertIn(after, self.search('мельница'))
+
+  def test_postgresql_query(self):
+    from . import search
+
+    with mock.patch.object(connection, 'vendor', 'postgresql'):
+      queryset = search.search(History.objects.all(), 'Старый Дом')
+
+    self.assertFalse(queryset.query.extra_tables)
+    self.assertIn("to_tsquery('russian', %s)", queryset.query.where.children[0].sqls[0])
+    self.assertEqual(queryset.query.where.children[0].params, ['старый:* & дом:*'])
+    self.assertEqual(queryset.query.order_by, ('-rank', '-created_at'))
+
+class ResponseCacheTest(TestCase):
+  """Кэш ответов: сброс при записи, свой ключ у пользователя, один рендер на ключ"""
+
+  def setUp(self):
+    from django.core.cache import cache
+
+    cache.clear()
+    self.addCleanup(cache.clear)
+    self.author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=self.author, first_name='Иван', surname='Иванов')
+    self.history = History.objects.create(user=self.author, desc='История', status='pub', week=get_last_day_week())
+
+  def get(self, client=None):
+    response = (client or APIClient()).get('/api/v1/history/')
+    self.assertEqual(response.status_code, 200)
+    return response
+
+  def client_for(self, username):
+    user = User.objects.create_user(username, '%s@example.com' % username, 'password')
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token %s' % Token.objects.create(user=user).key)
+    return user, client
+
+  def test_keys_are_per_user(self):
+    voter, voter_client = self.client_for('voter')
+    _, other_client = self.client_for('other')
+    Voice.objects.create(history=self.history, user=voter)
+
+    self.assertEqual(self.get(voter_client)['X-Cache'], 'MISS')
+    other = self.get(other_client)
+    self.assertEqual(other['X-Cache'], 'MISS')
+    voter_again = self.get(voter_client)
+    self.assertEqual(voter_again['X-Cache'], 'HIT')
+    self.assertEqual(self.get()['X-Cache'], 'MISS')
+
+    self.assertTrue(voter_again.json()['results'][0]['voted'])
+    self.assertFalse(other.json()['results'][0]['voted'])
+
+  def test_single_flight(self):
+    import threading
+    from .response_cache import response_cache
+
+    renders = []
+    started = threading.Event()
+
+    def render():
+      renders.append(1)
+      started.set()
+      time.sleep(0.1)
+      return (b'{}', 'application/json')
+
+    results = []
+    threads = [
+      threading.Thread(target=lambda: results.append(response_cache.get_or_render('response:test:flight', render)))
+      for _ in range(4)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual(len(renders), 1)
+    self.assertEqual(sorted(hit for _, hit in results), [False, True, True, True])
+
+  def test_waits_for_other_process(self):
+    import threading
+    from django.core.cache import cache
+    from .response_cache import response_cache
+
+    # ключ рендерит другой процесс: блокировка в общем кэше уже занята
+    cache.add('response:test:other:lock', 1, 10)
+    threading.Timer(0.1, lambda: cache.set('response:test:other', (b'[]', 'application/json'))).start()
+
+    entry, hit = response_cache.get_or_render('response:test:other', mock.Mock(side_effect=AssertionError))
+
+    self.assertTrue(hit)
+    self.assertEqual(entry, (b'[]', 'application/json'))
+
+class ResponseCacheInvalidationTest(TransactionTestCase):
+  """Кэш ответов сбрасывается после коммита записи"""
+
+  def setUp(self):
+    from django.core.cache import cache
+
+    cache.clear()
+    self.addCleanup(cache.clear)
+    weeks.clear()
+    self.author = User.objects.create_user('author', 'author@example.com', 'password')
+    Profile.objects.create(user=self.author, first_name='Иван', surname='Иванов')
+    self.history = History.objects.create(user=self.author, desc='История', status='pub', week=get_last_day_week())
+
+  def get(self):
+    response = APIClient().get('/api/v1/history/')
+    self.assertEqual(response.status_code, 200)
+    return response
+
+  def test_writes_invalidate(self):
+    voter = User.objects.create_user('voter', 'voter@example.com', 'password')
+    writes = [
+      lambda: History.objects.filter(pk=self.history.pk).first().save(),
+      lambda: Image.objects.create(history=self.history, image='images/photo.jpg'),
+      lambda: Voice.objects.create(history=self.history, user=voter),
+    ]
+
+    self.assertEqual(self.get()['X-Cache'], 'MISS')
+    for write in writes:
+      self.assertEqual(self.get()['X-Cache'], 'HIT')
+      write()
+      self.assertEqual(self.get()['X-Cache'], 'MISS')
+
+  def test_invalidated_on_commit(self):
+    from django.db import transaction
+    from .response_cache import response_cache
+
+    version = response_cache.get_version('history')
+    with transaction.atomic():
+      self.history.save()
+      # до коммита читатель видит старые данные и старую версию
+      self.assertEqual(response_cache.get_version('history'), version)
+    self.assertNotEqual(response_cache.get_version('history'), version)
+
+class GcMediaTest(TestCase):
+  """gc_media удаляет только старые файлы без ссылок"""
+
+  def setUp(self):
+    self.root = use_temp_media(self)
+    self.paths = {}
+    for name in ('images/used.jpg', 'images/stored.jpg', 'images/orphan.jpg', 'images/fresh.jpg',
+                 'archive/2020-10-04/histories.json', 'staging/upload.png'):
+      path = self.paths[name] = os.path.join(self.root, name)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(path, 'wb') as f:
+        f.write(name.encode())
+      if name != 'images/fresh.jpg':
+        os.utime(path, (0, 0))
+
+    Image.objects.create(image='images/used.jpg')
+    StoredFile.objects.create(name='images/stored.jpg', refs=1)
+    StoredFile.objects.create(name='images/orphan.jpg', refs=0)
+
+  def gc(self, **options):
+    from django.core.management import call_command
+
+    call_command('gc_media', stdout=open(os.devnull, 'w'), **options)
+    return {name for name, path in self.paths.items() if os.path.exists(path)}
+
+  def test_removes_only_old_orphans(self):
+    kept = self.gc()
+
+    self.assertEqual(set(self.paths) - kept, {'images/orphan.jpg'})
+    self.assertEqual(set(StoredFile.objects.values_list('name', flat=True)), {'images/stored.jpg'})
+
+  def test_grace_period(self):
+    self.assertNotIn('images/fresh.jpg', self.gc(grace_hours=0))
+
+  def test_dry_run(self):
+    self.assertEqual(self.gc(dry_run=True), set(self.paths))
+
+  def test_quarantine(self):
+    quarantine = os.path.join(self.root, 'quarantine')
+
+    kept = self.gc(quarantine=quarantine)
+
+    self.assertNotIn('images/orphan.jpg', kept)
+    self.assertTrue(os.path.exists(os.path.join(quarantine, 'images', 'orphan.jpg')))
+    # карантин внутри MEDIA_ROOT не сканируется повторно
+    self.gc(quarantine=quarantine, grace_hours=0)
+    self.assertTrue(os.path.exists(os.path.join(quarantine, 'images', 'orphan.jpg')))
+
+class WarmupTest(TestCase):
+  """Прогрев идёт без входящего запроса и не оставляет открытых соединений"""
+
+  def test_warmup_without_request(self):
+    from st_remy import warmup
+
+    with mock.patch.object(warmup.connections, 'close_all') as close_all:
+      stats = warmup.warmup()
+
+    self.assertGreater(stats['url_patterns'], 0)
+    self.assertGreater(stats['serializers'], 0)
+    self.assertEqual(stats['urls']['/api/v1/history/'], 200)
+    self.assertEqual(stats['urls']['/api/v1/winner/'], 200)
+    self.assertTrue(close_all.called)
+
+class ConnectionHealthTest(TestCase):
+  """Простоявшее соединение проверяется перед запросом, живое переиспользуется"""
+
+  def check(self, idle, usable):
+    from . import connections as health
+
+    conn = mock.Mock(connection=object(), st_remy_last_used=time.monotonic() - idle)
+    conn.is_usable.return_value = usable
+    with mock.patch.object(health.connections, 'all', return_value=[conn]):
+      health.check_connections()
+    return conn
+
+  def test_recent_connection_is_not_pinged(self):
+    conn = self.check(idle=1, usable=False)
+    self.assertFalse(conn.is_usable.called)
+    self.assertFalse(conn.close.called)
+
+  def test_idle_connection_is_reused_when_usable(self):
+    self.assertFalse(self.check(idle=3600, usable=True).close.called)
+
+  def test_idle_broken_connection_is_closed(self):
+    self.assertTrue(self.check(idle=3600, usable=False).close.called)
+
+  def test_request_marks_connection_used(self):
+    connection.st_remy_last_used = None
+    APIClient().get('/api/v1/history/')
+    self.assertIsNotNone(connection.st_remy_last_used)
@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+THROTTLE = {
+  # алиас из CACHES: должен быть общим для всех воркеров (memcached)
+  'CACHE': 'throttle',
+}
+THROTTLE.update(getattr(settings, 'THROTTLE', {}))
+
+class BucketThrottle(SimpleRateThrottle):
+  """Ограничение частоты запросов по scope вьюхи.
+
+  Корзина на N запросов за период пополняется равномерно: счётчик текущего
+  окна плюс доля прошлого, которая ещё не истекла (скользящее окно).
+  Запрос - один атомарный incr в общем кэше и чтение прошлого окна,
+  без блокировок: одновременные запросы не мешают друг другу.
+  """
+
+  cache_format = 'throttle:%(scope)s:%(ident)s'
+  scope_suffix = ''
+
+  def __init__(self):
+    # rate определяется в allow_request по throttle_scope вьюхи
+    self.cache = caches[THROTTLE['CACHE']]
+
+  def get_rate(self):
+    return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+  def get_ident_key(self, request):
+    raise NotImplementedError('.get_ident_key() must be overridden')
+
+  def allow_request(self, request, view):
+    scope = getattr(view, 'throttle_scope', None)
+    if not scope:
+      return True
+
+    self.scope = scope + self.scope_suffix
+    self.rate = self.get_rate()
+    if self.rate is None:
+      return True
+
+    self.num_requests, self.duration = self.parse_rate(self.rate)
+    key = self.cache_format % {'scope': self.scope, 'ident': self.get_ident_key(request)}
+
+    now = self.timer()
+    window = int(now // self.duration)
+    current = '%s:%d' % (key, window)
+
+    try:
+      count = self.cache.incr(current)
+    except ValueError:
+      # первый запрос в окне
+      if self.cache.add(current, 1, self.duration * 2):
+        count = 1
+      else:
+        count = self.cache.incr(current)
+
+    previous = self.cache.get('%s:%d' % (key, window - 1), 0)
+    # доля прошлого окна, ещё попадающая в последние duration секунд
+    left = 1 - (now - window * self.duration) / self.duration
+    if previous * left + count <= self.num_requests:
+      return True
+
+    # отклонённый запрос не расходует лимит
+    try:
+      self.cache.decr(current)
+    except ValueError:
+      pass
+    self.retry_after = self.get_retry_after(now, window, previous, count - 1)
+    return False
+
+  def get_retry_after(self, now, window, previous, count):
+    """Через сколько секунд оценка окна опустится ниже лимита"""
+    free = self.num_requests - 1
+    if count > free:
+      # в этом окне места уже не будет, в следующем прошлым станет текущее
+      start, previous = (window + 1) * self.duration, count
+    else:
+      start, free = window * self.duration, free - count
+    if previous <= free:
+      return start - now
+    return start + self.duration * (1 - free / previous) - now
+
+  def wait(self):
+    return max(self.retry_after, 0)
+
+class UserBucketThrottle(BucketThrottle):
+  """Лимит на пользователя (для анонимов - на IP)"""
+
+  def get_ident_key(self, request):
+    if request.user and request.user.is_authenticated:
+      return 'user:%s' % request.user.pk
+    return 'ip:%s' % self.get_ident(request)
+
+class IPBucketThrottle(BucketThrottle):
+  """Лимит на IP, настраивается ключом <scope>_ip"""
+
+  scope_suffix = '_ip'
+
+  def get_ident_key(self, request):
+    return self.get_ident(request)
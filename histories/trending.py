@@ -0,0 +1,49 @@
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+TRENDING = {
+  'HALF_LIFE_HOURS': 24,
+  'DECAY_INTERVAL_HOURS': 1,
+  'MIN_SCORE': 0.01,
+}
+TRENDING.update(getattr(settings, 'TRENDING', {}))
+
+def decay_factor(hours=None):
+  if hours is None:
+    hours = TRENDING['DECAY_INTERVAL_HOURS']
+  return 0.5 ** (hours / TRENDING['HALF_LIFE_HOURS'])
+
+def add_voice(history_id, weight=1):
+  """Инкрементальное обновление рейтинга при новом голосе"""
+  from .models import History
+  History.objects.filter(pk=history_id).update(score=F('score') + weight)
+
+def decay():
+  """Затухание рейтинга всех историй одним запросом"""
+  from .models import History
+
+  History.objects.filter(score__gt=0, score__lt=TRENDING['MIN_SCORE']).update(score=0)
+  return History.objects.filter(score__gt=0).update(score=F('score') * decay_factor())
+
+def rebuild(batch_size=1000):
+  """Полный пересчёт рейтинга по таблице голосов"""
+  from .models import History, Voice
+
+  now = timezone.now()
+  half_life = TRENDING['HALF_LIFE_HOURS'] * 3600
+  scores = defaultdict(float)
+
+  voices = Voice.objects.values_list('history_id', 'created_at').iterator(chunk_size=batch_size)
+  for history_id, created_at in voices:
+    age = max((now - created_at).total_seconds(), 0)
+    scores[history_id] += math.pow(0.5, age / half_life)
+
+  History.objects.exclude(pk__in=scores.keys()).exclude(score=0).update(score=0)
+
+  histories = [History(pk=pk, score=score) for pk, score in scores.items()]
+  History.objects.bulk_update(histories, ['score'], batch_size=batch_size)
+  return len(histories)
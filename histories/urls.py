@@ -1,13 +1,33 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
 urlpatterns = [
   path("history/", views.HistoryViewSet.as_view({'get': 'list', 'post': 'create'})),
+  path("history/search/", views.HistoryViewSet.as_view({'get': 'search'})),
+  path("history/batch/", views.HistoryViewSet.as_view({'get': 'batch'})),
+  path("history/export/", views.FeedExportView.as_view()),
   path("history/my/", views.MyHistoryViewSet.as_view({'get': 'list'})),
-  path("history/<int:pk>", views.HistoryViewSet.as_view({'get': 'retrieve', 'post': 'update'})),
+  path("history/<int:pk>", views.HistoryViewSet.as_view({'get': 'retrieve', 'post': 'update', 'patch': 'partial_update'})),
 
   path("winner/", views.WinnerViewSet.as_view({'get': 'list'})),
   path("voice/", views.AddVoiceViewSet.as_view({'post': 'create'})),
+  path("upload/", views.StagedUploadView.as_view()),
   path("feedback/", views.FeedbackSendView.as_view()),
+
+  path("analytics/history/<int:pk>/votes/", views.AnalyticsViewSet.as_view({'get': 'votes'})),
+  path("analytics/top/", views.AnalyticsViewSet.as_view({'get': 'top'})),
+  path("analytics/cities/", views.AnalyticsViewSet.as_view({'get': 'cities'})),
+
+  path("export/<str:name>/", views.ExportView.as_view()),
 ]
+
+if settings.ASGI_MODE:
+  from . import async_views
+
+  urlpatterns = [
+    path("history/", async_views.history_list),
+    path("winner/", async_views.winner_list),
+    path("voice/", async_views.add_voice),
+  ] + urlpatterns
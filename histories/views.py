@@ -1,3 +1,7 @@
+from django.conf import settings
+from django.http import Http404, HttpResponseRedirect, StreamingHttpResponse
+from django.views import static
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import viewsets, permissions
@@ -5,15 +9,59 @@ from rest_framework import viewsets, permissions
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
-from .models import History, Image, Leaderboard
+from .models import History, Image, WinnerEntry
 from .serializers import (
   HistoryDetailSerializer,
   HistoryDetailSerializerAuth,
   WinnerListSerializer,
+  get_voted_ids,
+  get_voice_counts,
   HistoryCreateSerializer,
   CreateVoiceSerializer,
 )
-from . import service
+from .pagination import TrendingPagination
+from .response_cache import cache_response
+from .storage import is_hashed_name
+from .idempotency import idempotent
+from . import service, search, archive, staging, analytics, fieldsets, exports, weeks, winners
+
+week_parameter = openapi.Parameter('week', openapi.IN_QUERY, "Неделя (воскресенье), YYYY-MM-DD", type=openapi.TYPE_STRING)
+fields_parameters = [
+  openapi.Parameter('fields', openapi.IN_QUERY, "Только эти поля через запятую, вложенные через точку: id,user,img_after.image", type=openapi.TYPE_STRING),
+  openapi.Parameter('omit', openapi.IN_QUERY, "Исключить поля: desc,img_before", type=openapi.TYPE_STRING),
+]
+idempotency_parameter = openapi.Parameter(
+  'Idempotency-Key', openapi.IN_HEADER, "Ключ повтора: запрос с тем же ключом вернёт сохранённый ответ", type=openapi.TYPE_STRING
+)
+analytics_parameters = [
+  openapi.Parameter('interval', openapi.IN_QUERY, "hour или week (по умолчанию week)", type=openapi.TYPE_STRING),
+  openapi.Parameter('from', openapi.IN_QUERY, "Начало периода (неделя YYYY-MM-DD или час ISO 8601)", type=openapi.TYPE_STRING),
+  openapi.Parameter('to', openapi.IN_QUERY, "Конец периода включительно", type=openapi.TYPE_STRING),
+  openapi.Parameter('limit', openapi.IN_QUERY, "Количество записей", type=openapi.TYPE_INTEGER),
+]
+
+# в архиве вся неделя одним JSON: страницы, сортировка и другой формат собираются как обычно
+LIVE_PARAMS = ('limit', 'offset', 'ordering', 'cursor', 'format')
+
+def frozen_week_redirect(request, name):
+  """Редирект на статичный архив закрытой недели"""
+  # в архиве все поля, выборочные ответы собираются как обычно
+  if fieldsets.is_requested(request) or any(param in request.query_params for param in LIVE_PARAMS):
+    return None
+  week = archive.parse_week(request.query_params.get('week'))
+  url = archive.get_frozen_url(week, name)
+  if url:
+    return HttpResponseRedirect(request.build_absolute_uri(url))
+
+def filter_week(request, queryset):
+  day = archive.parse_week(request.query_params.get('week'))
+  if not day:
+    return queryset
+  if queryset.model is History:
+    # индексированный внешний ключ вместо сравнения дат
+    week = weeks.get(day)
+    return queryset.filter(contest_week=week) if week else queryset.none()
+  return queryset.filter(week=day)
 
 class IsOwner(permissions.BasePermission):
   def has_object_permission(self, request, view, obj):
@@ -22,39 +70,170 @@ class IsOwner(permissions.BasePermission):
 
     return obj.user == request.user
 
-class MyHistoryViewSet(viewsets.ModelViewSet):
+class HistoryFieldsMixin:
+  """?fields= / ?omit= и загрузка связанных данных только для запрошенных полей"""
+  read_actions = ['list', 'retrieve', 'search', 'batch']
+  with_voted = True
+
+  def get_fieldset(self):
+    # при сборке схемы запроса нет
+    if self.request is None:
+      return fieldsets.EMPTY
+    if not hasattr(self, '_fieldset'):
+      self._fieldset = fieldsets.from_request(self.request)
+    return self._fieldset
+
+  def get_serializer_context(self):
+    context = super().get_serializer_context()
+    if self.action in self.read_actions:
+      context['fieldset'] = self.get_fieldset()
+    return context
+
+  def get_serializer(self, *args, **kwargs):
+    serializer = super().get_serializer(*args, **kwargs)
+    if args and self.action in self.read_actions:
+      instances = args[0] if kwargs.get('many') else [args[0]]
+      history_ids = [history.pk for history in instances]
+      fieldset = self.get_fieldset()
+
+      if fieldsets.wants(fieldset, 'voices'):
+        serializer.context['voice_counts'] = get_voice_counts(history_ids)
+      if self.with_voted and fieldsets.wants(fieldset, 'voted'):
+        serializer.context['voted'] = get_voted_ids(self.request.user, history_ids)
+    return serializer
+
+  def select_fields(self, histories):
+    fieldset = self.get_fieldset()
+
+    related = [name for name in ('img_before', 'img_after') if fieldsets.wants(fieldset, name)]
+    if fieldsets.wants(fieldset, 'user'):
+      related.append('user__profile')
+    if related:
+      histories = histories.select_related(*related)
+    if not fieldsets.wants(fieldset, 'desc'):
+      histories = histories.defer('desc')
+    return histories
+
+class MyHistoryViewSet(HistoryFieldsMixin, viewsets.ModelViewSet):
   """Вывод истории в профиле"""
   serializer_class = HistoryDetailSerializerAuth
   permission_classes = [permissions.IsAuthenticated]
+  # за свои истории голосовать нельзя
+  with_voted = False
 
-  @swagger_auto_schema(operation_description="Вывод списка историй текущего пользователя")
+  @swagger_auto_schema(operation_description="Вывод списка историй текущего пользователя", manual_parameters=fields_parameters)
   def list(self, request):
     return super().list(request)
 
   def get_queryset(self):
+    if getattr(self, 'swagger_fake_view', False):
+      return History.objects.none()
     histories = History.objects.filter(user=self.request.user).order_by('-created_at')
-    return histories
+    return self.select_fields(histories)
 
-class HistoryViewSet(viewsets.ModelViewSet):
+class HistoryViewSet(HistoryFieldsMixin, viewsets.ModelViewSet):
   """Класс для работы с историями"""
 
   permission_classes = [permissions.IsAuthenticatedOrReadOnly&IsOwner]
+  batch_max_size = 50
+
+  @property
+  def throttle_scope(self):
+    if self.action == 'create':
+      return 'history_create'
 
-  @swagger_auto_schema(operation_description="Вывод списка историй")
+  @swagger_auto_schema(
+    operation_description="Вывод списка историй",
+    manual_parameters=[
+      openapi.Parameter('ordering', openapi.IN_QUERY, "trending - по рейтингу", type=openapi.TYPE_STRING),
+      week_parameter,
+    ] + fields_parameters
+  )
   def list(self, request):
+    return frozen_week_redirect(request, 'histories') or self.cached_list(request)
+
+  @cache_response('history')
+  def cached_list(self, request):
     return super().list(request)
 
+  @property
+  def paginator(self):
+    if self.is_trending() and not hasattr(self, '_paginator'):
+      self._paginator = TrendingPagination()
+    return super().paginator
+
+  def is_trending(self):
+    return self.action == 'list' and self.request.query_params.get('ordering') == 'trending'
+
   @swagger_auto_schema(
     operation_description="Вывод информации о историй",
     manual_parameters=[
       openapi.Parameter('id', openapi.IN_PATH, "Id", type=openapi.TYPE_INTEGER, required=True),
-    ],
+    ] + fields_parameters,
     responses={200: HistoryDetailSerializer()}
   )
   def retrieve(self, request, pk):
     return super().retrieve(request, pk)
 
-  @swagger_auto_schema(operation_description="Создание истории", responses={200: HistoryDetailSerializer()})
+  @swagger_auto_schema(
+    operation_description="Несколько историй по id в порядке запроса. "
+      "Не найденные и неопубликованные id возвращаются в missing",
+    manual_parameters=[
+      openapi.Parameter('ids', openapi.IN_QUERY, "id через запятую (не больше 50)", type=openapi.TYPE_STRING, required=True),
+    ] + fields_parameters
+  )
+  def batch(self, request):
+    return self.cached_batch(request)
+
+  @cache_response('history')
+  def cached_batch(self, request):
+    ids = self.parse_ids(request.query_params.get('ids', ''))
+    histories = self.get_queryset().in_bulk(ids)
+    found = [histories[pk] for pk in ids if pk in histories]
+
+    serializer = self.get_serializer(found, many=True)
+    return Response({
+      'results': serializer.data,
+      'missing': [pk for pk in ids if pk not in histories],
+    })
+
+  def parse_ids(self, value):
+    ids = []
+    for part in value.split(','):
+      part = part.strip()
+      if not part:
+        continue
+      if not part.isdigit():
+        raise ValidationError({'ids': 'Ожидаются числовые id через запятую.'})
+      if int(part) not in ids:
+        ids.append(int(part))
+
+    if not ids:
+      raise ValidationError({'ids': 'Укажите хотя бы один id.'})
+    if len(ids) > self.batch_max_size:
+      raise ValidationError({'ids': 'Не больше %d id за запрос.' % self.batch_max_size})
+    return ids
+
+  @swagger_auto_schema(
+    operation_description="Полнотекстовый поиск по описанию историй",
+    manual_parameters=[
+      openapi.Parameter('q', openapi.IN_QUERY, "Строка поиска", type=openapi.TYPE_STRING, required=True),
+    ] + fields_parameters
+  )
+  def search(self, request):
+    query = request.query_params.get('q', '')
+    queryset = search.search(self.get_queryset(), query)
+
+    page = self.paginate_queryset(queryset)
+    if page is not None:
+      serializer = self.get_serializer(page, many=True)
+      return self.get_paginated_response(serializer.data)
+
+    serializer = self.get_serializer(queryset, many=True)
+    return Response(serializer.data)
+
+  @swagger_auto_schema(operation_description="Создание истории", manual_parameters=[idempotency_parameter], responses={200: HistoryDetailSerializer()})
+  @idempotent('history')
   def create(self, request, *args, **kwargs):
     serializer = self.get_serializer(data=request.data)
     serializer.is_valid(raise_exception=True)
@@ -71,10 +250,25 @@ class HistoryViewSet(viewsets.ModelViewSet):
     instance_serializer = HistoryDetailSerializerAuth(instance, context={"request": request})
     return Response(instance_serializer.data)
 
+  @swagger_auto_schema(operation_description="Частичное обновление истории (только переданные поля)", responses={200: HistoryDetailSerializer()})
+  def partial_update(self, request, pk, *args, **kwargs):
+    instance = self.get_object()
+    serializer = self.get_serializer(instance, data=request.data, partial=True)
+    serializer.is_valid(raise_exception=True)
+    instance = self.perform_update(serializer)
+    instance_serializer = HistoryDetailSerializerAuth(instance, context={"request": request})
+    return Response(instance_serializer.data)
+
   def get_queryset(self):
-    if self.action in ['list', 'retrieve']:
+    # при сборке схемы (build_schema) запроса и пользователя нет
+    if getattr(self, 'swagger_fake_view', False):
+      return History.objects.none()
+    if self.action in self.read_actions:
       histories = History.objects.filter(draft=False, status='pub').order_by('-created_at')
-    elif self.action in ['update']:
+      if self.action == 'list':
+        histories = filter_week(self.request, histories)
+      histories = self.select_fields(histories)
+    elif self.action in ['update', 'partial_update']:
       histories = History.objects.filter(user=self.request.user).order_by('-created_at')
     return histories
 
@@ -85,9 +279,9 @@ class HistoryViewSet(viewsets.ModelViewSet):
     return serializer.save()
 
   def get_serializer_class(self):
-    if self.action in ['list', 'retrieve']:
+    if self.action in self.read_actions:
       return HistoryDetailSerializer
-    elif self.action in ['create', 'update']:
+    elif self.action in ['create', 'update', 'partial_update']:
       return HistoryCreateSerializer
 
 class WinnerViewSet(viewsets.ReadOnlyModelViewSet):
@@ -95,26 +289,174 @@ class WinnerViewSet(viewsets.ReadOnlyModelViewSet):
 
   serializer_class = WinnerListSerializer
 
+  @swagger_auto_schema(operation_description="Вывод списка победителей", manual_parameters=[week_parameter] + fields_parameters)
+  def list(self, request):
+    return frozen_week_redirect(request, 'winners') or self.cached_list(request)
+
+  @cache_response('winner')
+  def cached_list(self, request):
+    # готовые ответы собираются в winners.rebuild
+    payloads = self.get_queryset().values_list('payload', flat=True)
+    page = self.paginate_queryset(payloads)
+    results = list(page if page is not None else payloads)
+
+    fieldset = fieldsets.from_request(request)
+    if fieldsets.wants(fieldsets.nested(fieldset, 'history'), 'voted') and fieldsets.wants(fieldset, 'history'):
+      results = self.mark_voted(results)
+    results = [winners.absolute_urls(fieldsets.prune(payload, fieldset), request) for payload in results]
+    if page is not None:
+      return self.get_paginated_response(results)
+    return Response(results)
+
+  def mark_voted(self, payloads):
+    voted = get_voted_ids(self.request.user, [payload['history']['id'] for payload in payloads])
+    if voted is not None:
+      for payload in payloads:
+        payload['history']['voted'] = payload['history']['id'] in voted
+    return payloads
+
   def get_queryset(self):
-    winners = Leaderboard.objects.all().order_by('-main', '-week')
-    return winners
+    winners = WinnerEntry.objects.order_by('-main', '-week')
+    return filter_week(self.request, winners)
 
 class AddVoiceViewSet(viewsets.ModelViewSet):
   """Добавление голоса истории"""
   serializer_class = CreateVoiceSerializer
   permission_classes = [permissions.IsAuthenticated]
+  throttle_scope = 'voice'
 
-  @swagger_auto_schema(operation_description="Создание истории", responses={200: HistoryDetailSerializerAuth()})
+  @swagger_auto_schema(operation_description="Создание истории", manual_parameters=[idempotency_parameter], responses={200: HistoryDetailSerializerAuth()})
+  @idempotent('voice')
   def create(self, request, *args, **kwargs):
     serializer = self.get_serializer(data=request.data)
     serializer.is_valid(raise_exception=True)
     instance = serializer.save()
-    instance_serializer = HistoryDetailSerializerAuth(instance.history, context={"request": request})
+    context = {"request": request, "voted": {instance.history_id}}
+    instance_serializer = HistoryDetailSerializerAuth(instance.history, context=context)
     return Response(instance_serializer.data)
 
 
+class StagedUploadView(APIView):
+  """Предварительная загрузка изображения"""
+  permission_classes = [permissions.IsAuthenticated]
+  throttle_scope = 'upload'
+  # тело запроса читается потоком в staging.stage
+  parser_classes = []
+
+  @swagger_auto_schema(
+    operation_description="Потоковая загрузка изображения (тело запроса - файл, Content-Type: image/*). "
+      "Возвращённый id передаётся в uploadBefore/uploadAfter при создании или обновлении истории",
+    responses={201: openapi.Response("id предзагрузки")}
+  )
+  def post(self, request):
+    upload = staging.stage(request, request.user)
+    return Response(status=201, data={
+      'id': upload.id,
+      'width': upload.width,
+      'height': upload.height,
+      'size': upload.size,
+    })
+
+class AnalyticsViewSet(viewsets.ViewSet):
+  """Статистика голосов по агрегатам (только для персонала)"""
+  permission_classes = [permissions.IsAdminUser]
+
+  def respond(self, results):
+    return Response({'watermark': analytics.get_watermark(), 'results': results})
+
+  @swagger_auto_schema(operation_description="Голоса истории по часам или неделям", manual_parameters=analytics_parameters)
+  def votes(self, request, pk):
+    return self.respond(analytics.series(pk, request.query_params))
+
+  @swagger_auto_schema(
+    operation_description="Топ историй по голосам за период (по умолчанию текущая неделя)",
+    manual_parameters=analytics_parameters + [openapi.Parameter('city', openapi.IN_QUERY, "Город", type=openapi.TYPE_STRING)]
+  )
+  def top(self, request):
+    return self.respond(analytics.top(request.query_params))
+
+  @swagger_auto_schema(
+    operation_description="Голоса по городам за период (по умолчанию текущая неделя)",
+    manual_parameters=analytics_parameters + [openapi.Parameter('history', openapi.IN_QUERY, "id истории", type=openapi.TYPE_INTEGER)]
+  )
+  def cities(self, request):
+    return self.respond(analytics.cities(request.query_params))
+
+class ExportView(APIView):
+  """Потоковая выгрузка для персонала (CSV или NDJSON)"""
+  permission_classes = [permissions.IsAdminUser]
+
+  @swagger_auto_schema(
+    operation_description="Выгрузка profiles, voices (вместе с архивными голосами) или histories. Ответ отдаётся потоком",
+    manual_parameters=[
+      openapi.Parameter('type', openapi.IN_QUERY, "csv (по умолчанию) или ndjson", type=openapi.TYPE_STRING),
+      week_parameter,
+      openapi.Parameter('status', openapi.IN_QUERY, "Статус истории (для histories)", type=openapi.TYPE_STRING),
+    ],
+    responses={200: openapi.Response("Файл выгрузки")}
+  )
+  def get(self, request, name):
+    if name not in exports.EXPORTS:
+      raise NotFound()
+    fmt = request.query_params.get('type', 'csv')
+    if fmt not in exports.FORMATS:
+      raise ValidationError({'type': 'Допустимые значения: %s.' % ', '.join(exports.FORMATS)})
+
+    model, _ = exports.EXPORTS[name]
+    queryset = model.objects.all()
+    week = archive.parse_week(request.query_params.get('week'))
+    if week and name == 'histories':
+      queryset = queryset.filter(week=week)
+    elif week and name == 'voices':
+      queryset = queryset.filter(history__week=week)
+    if name == 'histories' and request.query_params.get('status'):
+      queryset = queryset.filter(status=request.query_params['status'])
+    if name == 'voices':
+      queryset = exports.with_archived_voices(queryset, week)
+
+    return exports.export_response(name, queryset, fmt)
+
+class FeedExportView(APIView):
+  """Потоковая выгрузка опубликованных историй (NDJSON) для партнёров"""
+  permission_classes = [permissions.IsAuthenticated]
+  throttle_scope = 'feed_export'
+
+  @swagger_auto_schema(
+    operation_description=(
+      "Истории по возрастанию id, по строке JSON на историю, не больше FEED_EXPORT['MAX_ROWS'] за запрос. "
+      "Продолжение (в том числе после обрыва) - ?after=<id последней полученной строки>, "
+      "выгрузка закончена, когда строк меньше limit"
+    ),
+    manual_parameters=[
+      openapi.Parameter('after', openapi.IN_QUERY, "id последней полученной истории", type=openapi.TYPE_INTEGER),
+      openapi.Parameter('limit', openapi.IN_QUERY, "Строк за запрос", type=openapi.TYPE_INTEGER),
+      week_parameter,
+    ],
+    responses={200: openapi.Response("application/x-ndjson")}
+  )
+  def get(self, request):
+    after = self.get_int('after', 0)
+    limit = min(self.get_int('limit', exports.FEED_EXPORT['MAX_ROWS'], minimum=1), exports.FEED_EXPORT['MAX_ROWS'])
+
+    histories = filter_week(request, History.objects.filter(draft=False, status='pub'))
+    lines = exports.feed_lines(histories, request, after=after, limit=limit)
+    return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+  def get_int(self, name, default, minimum=0):
+    value = self.request.query_params.get(name)
+    if value is None:
+      return default
+    try:
+      value = int(value)
+    except ValueError:
+      value = minimum - 1
+    if value < minimum:
+      raise ValidationError({name: 'Ожидается целое число не меньше %d.' % minimum})
+    return value
+
 class FeedbackSendView(APIView):
   """Отправка формы обртатной связи"""
+  throttle_scope = 'feedback'
 
   @swagger_auto_schema(operation_description="Отправка формы обртатной связи",
   request_body=openapi.Schema(
@@ -130,3 +472,13 @@ class FeedbackSendView(APIView):
   def post(self, request):
     service.send_feedback(request.data)
     return Response(status=201, data='OK')
+
+def serve_media(request, path):
+  """Отдача медиа, файлы с хешем в имени кэшируются навсегда"""
+  # предзагрузки старого формата ещё могут лежать в MEDIA_ROOT
+  if path.startswith(staging.STAGED_UPLOADS['DIR'] + '/'):
+    raise Http404()
+  response = static.serve(request, path, document_root=settings.MEDIA_ROOT)
+  if response.status_code == 200 and is_hashed_name(path):
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+  return response
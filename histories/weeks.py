@@ -0,0 +1,94 @@
+"""Календарь конкурса: недели понедельник-воскресенье в часовом поясе проекта.
+
+Недели держатся в памяти процесса не дольше CACHE_TTL: дедлайн можно
+поправить в админке, и правка доходит до всех воркеров.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import Week
+from .service import get_last_day_week
+
+WEEKS = {
+  # за сколько часов до конца недели закрывается приём историй
+  'DEADLINE_HOURS': 0,
+  # сколько секунд неделя живёт в памяти процесса
+  'CACHE_TTL': 60,
+}
+WEEKS.update(getattr(settings, 'WEEKS', {}))
+
+_by_day = {}
+_current = None
+
+def bounds(day):
+  """Начало, конец и дедлайн недели, заканчивающейся в воскресенье day"""
+  tz = timezone.get_default_timezone()
+  start = timezone.make_aware(datetime.datetime.combine(day - datetime.timedelta(days=6), datetime.time.min), tz)
+  end = timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min), tz)
+  return start, end, end - datetime.timedelta(hours=WEEKS['DEADLINE_HOURS'])
+
+def remember(week):
+  # только после коммита: откат транзакции не оставит в памяти несуществующую неделю
+  transaction.on_commit(lambda: _by_day.__setitem__(week.day, (time.monotonic() + WEEKS['CACHE_TTL'], week)))
+
+def forget(day):
+  """Убирает неделю из памяти этого процесса (остальные подхватят правку через CACHE_TTL)"""
+  global _current
+  _by_day.pop(day, None)
+  if _current is not None and _current[1].day == day:
+    _current = None
+
+def get(day):
+  """Неделя по воскресенью или None, без создания"""
+  item = _by_day.get(day)
+  if item is not None and item[0] > time.monotonic():
+    return item[1]
+
+  week = Week.objects.filter(day=day).first()
+  if week is not None:
+    remember(week)
+  return week
+
+def for_day(day):
+  """Неделя по воскресенью, создаётся при первом обращении"""
+  week = get(day)
+  if week is not None:
+    return week
+
+  start, end, deadline = bounds(day)
+  try:
+    with transaction.atomic():
+      week = Week.objects.create(day=day, start=start, end=end, deadline=deadline)
+  except IntegrityError:
+    week = Week.objects.get(day=day)
+  remember(week)
+  return week
+
+def for_date(value):
+  return for_day(get_last_day_week(value))
+
+def current(now=None):
+  """Текущая неделя; из памяти, пока не наступил её конец или не истёк CACHE_TTL"""
+  global _current
+  now = now or timezone.now()
+
+  item = _current
+  if item is None or item[0] <= time.monotonic() or not item[1].start <= now < item[1].end:
+    week = for_date(timezone.localdate(now))
+    # в памяти только после коммита
+    _current = _by_day.get(week.day)
+    return week
+  return item[1]
+
+def is_open(week, now=None):
+  """Принимаются ли ещё истории на неделю"""
+  return (now or timezone.now()) < week.deadline
+
+def clear():
+  global _current
+  _by_day.clear()
+  _current = None
@@ -0,0 +1,86 @@
+from django.db import transaction
+
+from .models import Leaderboard, WinnerEntry
+from .response_cache import response_cache
+from .serializers import WinnerListSerializer
+
+class RelativeRequest:
+  """Запрос для сериализаторов без хоста: ссылки на изображения остаются путями"""
+  user = None
+
+  def build_absolute_uri(self, location=None):
+    return location
+
+def absolute_urls(payload, request):
+  """Дополняет пути изображений хостом текущего запроса"""
+  history = payload.get('history') or {}
+  for name in ('img_before', 'img_after'):
+    image = history.get(name)
+    if image and image.get('image'):
+      image['image'] = request.build_absolute_uri(image['image'])
+  return payload
+
+def leaderboards():
+  return Leaderboard.objects.select_related(
+    'history__user__profile', 'history__img_before', 'history__img_after'
+  ).order_by('pk')
+
+def rebuild(leaderboard_ids=None, chunk_size=500, request=None):
+  """Перерисовывает готовые ответы для указанных (или всех) победителей"""
+  # в payload хранятся пути, хост подставляет WinnerViewSet для каждого запроса
+  request = request or RelativeRequest()
+  context = {'request': request}
+  queryset = leaderboards()
+  if leaderboard_ids is not None:
+    queryset = queryset.filter(pk__in=leaderboard_ids)
+
+  built = 0
+  last_pk = 0
+  while True:
+    chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+    if not chunk:
+      break
+
+    payloads = WinnerListSerializer(chunk, many=True, context=context).data
+    entries = [
+      WinnerEntry(
+        leaderboard_id=winner.pk,
+        week=winner.week,
+        main=winner.main,
+        history_id=winner.history_id,
+        payload=payload,
+      )
+      for winner, payload in zip(chunk, payloads)
+    ]
+
+    with transaction.atomic():
+      WinnerEntry.objects.filter(pk__in=[winner.pk for winner in chunk]).delete()
+      WinnerEntry.objects.bulk_create(entries)
+
+    built += len(chunk)
+    last_pk = chunk[-1].pk
+
+  if leaderboard_ids is None:
+    WinnerEntry.objects.exclude(leaderboard__in=Leaderboard.objects.all()).delete()
+
+  # bulk-операции не отправляют сигналы
+  response_cache.invalidate_model('WinnerEntry')
+  return built
+
+def schedule(leaderboard_ids):
+  """Перестроение после коммита, чтобы в ответ попали сохранённые данные"""
+  leaderboard_ids = list(leaderboard_ids)
+  if leaderboard_ids:
+    transaction.on_commit(lambda: rebuild(leaderboard_ids))
+
+def schedule_for_histories(history_ids):
+  """То же для историй: победители ищутся тоже после коммита, вне горячего пути голосования"""
+  history_ids = list(history_ids)
+  if history_ids:
+    transaction.on_commit(lambda: rebuild_for_histories(history_ids))
+
+def rebuild_for_histories(history_ids):
+  # один запрос по индексу готовых ответов; новых победителей строит schedule
+  leaderboard_ids = list(WinnerEntry.objects.filter(history_id__in=history_ids).values_list('leaderboard_id', flat=True))
+  if leaderboard_ids:
+    rebuild(leaderboard_ids)
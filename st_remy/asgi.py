@@ -3,6 +3,10 @@ ASGI config for st_remy project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Run it with an ASGI server, e.g.:
+
+    gunicorn st_remy.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 """
@@ -12,5 +16,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'st_remy.settings')
+os.environ.setdefault('ST_REMY_ASGI', '1')
 
 application = get_asgi_application()
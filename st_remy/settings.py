@@ -14,6 +14,8 @@ from pathlib import Path
 import os
 from datetime import timedelta
 
+from corsheaders.defaults import default_headers
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,6 +54,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'histories.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,6 +84,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'st_remy.wsgi.application'
 
+# Выставляется в st_remy/asgi.py: включает async-версии горячих эндпоинтов
+ASGI_MODE = os.environ.get('ST_REMY_ASGI') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
@@ -89,9 +95,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # постоянные соединения между запросами (0 - закрывать после каждого)
+        'CONN_MAX_AGE': int(os.environ.get('ST_REMY_CONN_MAX_AGE', 60)),
     }
 }
 
+# Соединение, простоявшее дольше N секунд, проверяется перед запросом (histories/connections.py)
+CONN_HEALTH_CHECK_IDLE = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -141,17 +152,156 @@ STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Файлы хранятся по хешу содержимого: media/images/ab/cd/<sha256>.<ext>
+DEFAULT_FILE_STORAGE = 'histories.storage.HashedMediaStorage'
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'histories.authentication.CachedTokenAuthentication',
+        'histories.authentication.CachedJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'histories.renderers.ORJSONRenderer',
+        'histories.renderers.MessagePackRenderer',
+        'histories.renderers.XMessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'histories.renderers.ORJSONParser',
+        'histories.renderers.MessagePackParser',
+        'histories.renderers.XMessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
-    'PAGE_SIZE': 3
+    'DEFAULT_PAGINATION_CLASS': 'histories.pagination.FeedPagination',
+    'PAGE_SIZE': 3,
+    'DEFAULT_THROTTLE_CLASSES': (
+        'histories.throttling.UserBucketThrottle',
+        'histories.throttling.IPBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'voice': '30/min',
+        'voice_ip': '120/min',
+        'history_create': '10/hour',
+        'history_create_ip': '30/hour',
+        'upload': '60/hour',
+        'feed_export': '60/hour',
+        'feed_export_ip': '120/hour',
+        'feedback': '5/hour',
+        'feedback_ip': '10/hour',
+    },
+}
+
+# default (кэш ответов, single-flight, поколения авторизации) и throttle (лимиты запросов)
+# должны быть общими для всех воркеров: ST_REMY_MEMCACHED=host:port[,host:port].
+# Без него - память процесса, только для разработки (manage.py check --deploy предупредит)
+MEMCACHED_LOCATIONS = [location for location in os.environ.get('ST_REMY_MEMCACHED', '').split(',') if location]
+if MEMCACHED_LOCATIONS:
+    CACHES = {
+        alias: {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': MEMCACHED_LOCATIONS,
+            'KEY_PREFIX': alias,
+        }
+        for alias in ('default', 'throttle')
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'throttle': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'throttle',
+        },
+    }
+
+# Кэш пользователей для авторизации по токену/JWT: память процесса (LOCAL_TTL) поверх кэша default,
+# копия в памяти сверяется с поколением ключа в default, поэтому default должен быть общим для воркеров
+AUTH_CACHE = {
+    'LOCAL_SIZE': 2048,
+    'LOCAL_TTL': 30,
+    'SHARED_TTL': 300,
+}
+
+# Рейтинг историй (ordering=trending), затухание: manage.py decay_scores
+TRENDING = {
+    'HALF_LIFE_HOURS': 24,
+    'DECAY_INTERVAL_HOURS': 1,
+}
+
+# Статичные архивы закрытых недель: manage.py freeze_weeks
+# (ссылки на изображения в них - пути от корня сайта, без хоста)
+ARCHIVE = {
+    'ROOT': os.path.join(MEDIA_ROOT, 'archive'),
+    'URL': MEDIA_URL + 'archive/',
+}
+
+# Недели конкурса (histories.weeks): приём историй закрывается за N часов до конца недели,
+# правка дедлайна в админке доходит до воркеров за CACHE_TTL секунд
+WEEKS = {
+    'DEADLINE_HOURS': 0,
+    'CACHE_TTL': 60,
+}
+
+# Потоковая выгрузка ленты (/api/v1/history/export/): строк за запрос и в одном запросе к БД
+FEED_EXPORT = {
+    'MAX_ROWS': 10000,
+    'CHUNK_SIZE': 500,
+}
+
+# Кэш ответов ленты и победителей
+RESPONSE_CACHE = {
+    'TIMEOUT': 60,
+    'LOCK_TIMEOUT': 10,
+    'WAIT': 5,
+}
+
+# Предзагрузка изображений (/api/v1/upload/), файлы - в staging рядом с MEDIA_ROOT, очистка: manage.py clean_staged_uploads
+STAGED_UPLOADS = {
+    'MAX_SIZE': 10 * 1024 * 1024,
+    'TTL_HOURS': 24,
+}
+
+# Повтор POST /history/ и /voice/ с заголовком Idempotency-Key, очистка: manage.py clear_idempotency_keys
+IDEMPOTENCY = {
+    'TTL_HOURS': 24,
+    'WAIT': 10,
+}
+
+# Перенос голосов закрытых недель в архивные таблицы: manage.py move_to_cold_storage [--rejected]
+COLD_STORAGE = {
+    'KEEP_WEEKS': 2,
+    'BATCH_SIZE': 1000,
+}
+
+# gzip для ответов больше MIN_SIZE байт (histories.middleware.CompressionMiddleware)
+COMPRESSION = {
+    'MIN_SIZE': 1024,
+}
+
+# Прогрев при старте gunicorn (deploy/gunicorn.conf.py): эти адреса запрашиваются до форка воркеров
+WARMUP = {
+    'URLS': ['/api/v1/history/', '/api/v1/winner/', '/swagger.json'],
+}
+
+# Схема API собирается при деплое: manage.py build_schema
+SCHEMA = {
+    'ROOT': os.path.join(BASE_DIR, 'schema'),
+    'MAX_AGE': 3600,
+}
+
+# UI документации загружает собранную схему, а не генерирует её
+SWAGGER_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
+}
+REDOC_SETTINGS = {
+    'SPEC_URL': ('schema-json', {'format': '.json'}),
 }
 
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = list(default_headers) + ['idempotency-key']
 # CORS_ORIGIN_WHITE_LIST = [
 # ]
 
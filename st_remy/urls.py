@@ -5,6 +5,7 @@ from django.contrib import admin
 from django.urls import path, include, re_path
 from django.conf.urls.static import static
 from .yasg import urlpatterns as doc_urls
+from histories.views import serve_media
 import django.views.static
 
 urlpatterns = [
@@ -22,5 +23,5 @@ if settings.DEBUG:
 else:
   urlpatterns += [
     re_path(r'^static/(?P<path>.*)$', django.views.static.serve, {'document_root': settings.STATIC_ROOT, 'show_indexes': settings.DEBUG}),
-    re_path(r'^media/(?P<path>.*)$', django.views.static.serve, {'document_root': settings.MEDIA_ROOT, 'show_indexes': settings.DEBUG})
+    re_path(r'^media/(?P<path>.*)$', serve_media)
   ]
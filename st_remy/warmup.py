@@ -0,0 +1,65 @@
+"""Прогрев приложения перед форком воркеров gunicorn (preload_app).
+
+Всё, что импортируется и кэшируется здесь, воркеры получают готовым
+через copy-on-write, поэтому первый запрос после деплоя не платит за
+ленивые импорты, построение URL-резолвера и полей сериализаторов.
+"""
+import inspect
+import logging
+
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+from django.urls import get_resolver
+from rest_framework import serializers as drf_serializers
+
+logger = logging.getLogger(__name__)
+
+def warmup_resolvers():
+  resolver = get_resolver()
+  resolver.reverse_dict
+  return len(resolver.url_patterns)
+
+def warmup_serializers():
+  from histories import serializers
+
+  count = 0
+  for _, cls in inspect.getmembers(serializers, inspect.isclass):
+    if issubclass(cls, drf_serializers.Serializer) and cls.__module__ == serializers.__name__:
+      cls().fields
+      count += 1
+  return count
+
+def warmup_schema():
+  from .yasg import prebuilt
+  version, _ = prebuilt.get('.json')
+  return version
+
+def warmup_host():
+  for host in settings.ALLOWED_HOSTS:
+    if host and host != '*' and not host.startswith('.'):
+      return host
+  return 'localhost'
+
+def warmup_urls():
+  """Запросы к горячим адресам: middleware, рендереры, кэш ответов"""
+  client = Client(HTTP_HOST=warmup_host())
+
+  statuses = {}
+  for url in getattr(settings, 'WARMUP', {}).get('URLS', []):
+    try:
+      statuses[url] = client.get(url).status_code
+    except Exception:
+      logger.exception('Warmup request to %s failed', url)
+  return statuses
+
+def warmup():
+  stats = {
+    'url_patterns': warmup_resolvers(),
+    'serializers': warmup_serializers(),
+    'schema': warmup_schema(),
+    'urls': warmup_urls(),
+  }
+  # соединения мастера не должны достаться воркерам
+  connections.close_all()
+  return stats
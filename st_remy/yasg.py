@@ -1,22 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.urls import path, re_path
+from django.views.decorators.http import condition
 from rest_framework import permissions
-from drf_yasg.views import get_schema_view
+from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.views import UI_RENDERERS, get_schema_view
 from drf_yasg import openapi
 
+SCHEMA = {
+  # собирается командой manage.py build_schema
+  'ROOT': os.path.join(settings.BASE_DIR, 'schema'),
+  'MAX_AGE': 3600,
+}
+SCHEMA.update(getattr(settings, 'SCHEMA', {}))
+
+FORMATS = {
+  '.json': (OpenAPICodecJson, 'application/json; charset=utf-8'),
+  '.yaml': (OpenAPICodecYaml, 'application/yaml; charset=utf-8'),
+}
+
+MANIFEST = 'manifest.json'
+
+info = openapi.Info(
+  title="ST-Remy",
+  default_version='v1',
+  description="Api сайта st-remy",
+  license=openapi.License(name="BSD License"),
+)
 
 schema_view = get_schema_view(
-  openapi.Info(
-    title="ST-Remy",
-    default_version='v1',
-    description="Api сайта st-remy",
-    license=openapi.License(name="BSD License"),
-  ),
+  info,
   public=True,
   permission_classes=(permissions.AllowAny,),
 )
 
+def build_schema(root=None):
+  """Генерирует схему и пишет версионированные JSON/YAML, возвращает версию"""
+  root = root or SCHEMA['ROOT']
+  schema = OpenAPISchemaGenerator(info).get_schema(request=None, public=True)
+
+  encoded = {ext: codec([]).encode(schema) for ext, (codec, _) in FORMATS.items()}
+  version = hashlib.sha256(encoded['.json']).hexdigest()[:12]
+
+  os.makedirs(root, exist_ok=True)
+  files = {}
+  for ext, content in encoded.items():
+    name = 'openapi-%s%s' % (version, ext)
+    write_file(os.path.join(root, name), content)
+    files[ext] = name
+
+  write_file(os.path.join(root, MANIFEST), json.dumps({'version': version, 'files': files}).encode())
+
+  # старые версии больше не нужны
+  keep = set(files.values()) | {MANIFEST}
+  for name in os.listdir(root):
+    if name.startswith('openapi-') and name not in keep:
+      os.remove(os.path.join(root, name))
+
+  return version
+
+def write_file(path, content):
+  tmp = path + '.tmp'
+  with open(tmp, 'wb') as f:
+    f.write(content)
+  os.replace(tmp, path)
+
+class PrebuiltSchema:
+  """Собранная схема в памяти процесса, перечитывается при смене манифеста"""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.mtime = None
+    self.version = None
+    self.contents = {}
+
+  def get(self, ext):
+    manifest = os.path.join(SCHEMA['ROOT'], MANIFEST)
+    try:
+      mtime = os.stat(manifest).st_mtime
+    except FileNotFoundError:
+      return None, None
+
+    with self.lock:
+      if mtime != self.mtime:
+        self.load(manifest, mtime)
+      return self.version, self.contents.get(ext)
+
+  def load(self, manifest, mtime):
+    with open(manifest) as f:
+      data = json.load(f)
+
+    contents = {}
+    for ext, name in data['files'].items():
+      with open(os.path.join(SCHEMA['ROOT'], name), 'rb') as f:
+        contents[ext] = f.read()
+
+    self.version, self.contents, self.mtime = data['version'], contents, mtime
+
+prebuilt = PrebuiltSchema()
+
+def get_user(request):
+  """Пользователь по сессии или по заголовку Authorization (токен, JWT)"""
+  if not hasattr(request, '_schema_user'):
+    user = request.user
+    if not user.is_authenticated:
+      for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+          principal = authenticator().authenticate(request)
+        except APIException:
+          principal = None
+        if principal is not None:
+          user = principal[0]
+          break
+    request._schema_user = user
+  return request._schema_user
+
+def is_live(request):
+  # генерация на лету - только для разработки и персонала (?live=1)
+  return settings.DEBUG or (get_user(request).is_staff and 'live' in request.GET)
+
+def schema_etag(request, format):
+  if is_live(request):
+    return None
+  version, _ = prebuilt.get(format)
+  return '"%s%s"' % (version, format) if version else None
+
+@condition(etag_func=schema_etag)
+def schema_file(request, format):
+  _, content = prebuilt.get(format)
+  if is_live(request) or (content is None and get_user(request).is_staff):
+    return live_schema_view(request, format=format)
+  if content is None:
+    raise Http404('Схема не собрана: выполните manage.py build_schema')
+
+  response = HttpResponse(content, content_type=FORMATS[format][1])
+  response['Cache-Control'] = 'public, max-age=%d' % SCHEMA['MAX_AGE']
+  return response
+
+live_schema_view = schema_view.without_ui(cache_timeout=0)
+
+def ui_view(renderer):
+  # только HTML: ?format=openapi не должен собирать схему на лету,
+  # сама схема грузится из собранного /swagger.json (SPEC_URL)
+  return schema_view.as_cached_view(cache_timeout=0, renderer_classes=UI_RENDERERS[renderer])
+
 urlpatterns = [
-  re_path(r'swagger(?P<format>\.json|\.yaml)', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-  path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-  path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-]
\ No newline at end of file
+  re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_file, name='schema-json'),
+  path('swagger/', ui_view('swagger'), name='schema-swagger-ui'),
+  path('redoc/', ui_view('redoc'), name='schema-redoc'),
+]